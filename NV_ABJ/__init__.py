@@ -9,7 +9,7 @@ from NV_ABJ.utilities.data_manager import *
 ###################################################################################################################
 from NV_ABJ.abstract_interfaces.connected_device import ConnectedDevice
 from NV_ABJ.abstract_interfaces.microwave_source import MicrowaveSource
-from NV_ABJ.abstract_interfaces.photon_counter import PhotonCounter
+from NV_ABJ.abstract_interfaces.photon_counter import PhotonCounter, ReadoutGateMap
 from NV_ABJ.abstract_interfaces.positioner import PositionerSingleAxis
 from NV_ABJ.abstract_interfaces.scanner import ScannerSingleAxis
 from NV_ABJ.abstract_interfaces.pulse_generator import PulseGenerator
@@ -1,8 +1,11 @@
 __all__ = ["MeasurementSequence"]
 
 from abc import ABCMeta, abstractmethod
+from typing import Optional
 import numpy.typing as npt
+from NV_ABJ.abstract_interfaces.photon_counter import ReadoutGateMap
 from NV_ABJ.experimental_logic.sequence_generation.sequence_generation import Sequence
+from NV_ABJ.experimental_logic.sequence_generation.sequence_template import SequenceTemplate
 
 class MeasurementSequence(metaclass=ABCMeta):
     
@@ -10,6 +13,23 @@ class MeasurementSequence(metaclass=ABCMeta):
     def generate_sequence(self,*args,**kwargs):
         """Returns a sequence class that can be imported to a pulse generator and run 
         """
+        
+    def sequence_template(self,wrapped:bool=True,**fixed_parameters)->SequenceTemplate:
+        """Returns a template of generate_sequence for sweeps where only some of the parameters change like tau in a rabi.
+        The swept parameters are given to bind on the template 
+
+        Args:
+            wrapped (bool, optional): If the delays before the start are wrapped around to the end of the sequence. Defaults to True.
+            **fixed_parameters: the parameters of generate_sequence that stay the same for every sweep point
+        """
+        return SequenceTemplate(self.generate_sequence,wrapped=wrapped,**fixed_parameters)
+
+    def readout_gate_map(self)->Optional[ReadoutGateMap]:
+        """Where the readouts of the sequence are in the counter samples so the counts of every readout are found at once with
+        ReadoutGateMap.demultiplex. Defaults to None for sequences that do not describe their readouts
+        """
+        return None
+
     @abstractmethod
     def counts_to_raw_counts(self, data:npt.NDArray,*args,**kwargs):
         """This returns a dict with the numpy arrays separated for what the data represents.
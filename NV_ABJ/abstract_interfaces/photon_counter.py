@@ -1,9 +1,67 @@
 from abc import ABCMeta, ABC,abstractmethod
+from dataclasses import dataclass
 from numpy.typing import NDArray
 import numpy as np
 
 from NV_ABJ.abstract_interfaces.connected_device import ConnectedDevice
 
+@dataclass
+class ReadoutGateMap:
+    """Where the readout gates are in the counter samples of a sequence that is triggered on every readout edge. Every repetition
+    of the sequence has the same number of edges and each gate is the counts between two of those edges
+
+        gate_map = ReadoutGateMap(edges_per_repetition=4,gates={"signal":(0,1),"reference":(2,3)})
+    """
+    edges_per_repetition:int
+    gates:dict # name: (start edge, end edge) of every gate in a repetition in the order of the columns
+
+    def __post_init__(self):
+        if self.edges_per_repetition < 1:
+            raise ValueError(f"A repetition needs at least one edge you entered:{self.edges_per_repetition}")
+        for name, (start_edge, end_edge) in self.gates.items():
+            if not 0 <= start_edge < end_edge < self.edges_per_repetition:
+                raise ValueError(f"The gate {name} must start before it ends on edges of the repetition you entered:{(start_edge,end_edge)}")
+
+    @classmethod
+    def paired(cls,gate_names:list):
+        """Gate map where every gate has its own start and end edge like a signal followed by a reference
+
+        Args:
+            gate_names (list[str]): the names of the gates in the order they are read out
+        """
+        return cls(edges_per_repetition=2*len(gate_names),gates={name:(2*ind,2*ind+1) for ind, name in enumerate(gate_names)})
+
+    @property
+    def gate_names(self)->list:
+        return list(self.gates)
+
+    def demultiplex(self,edge_counts:NDArray)->NDArray[np.int64]:
+        """Splits the counter samples of whole repetitions into the counts of every gate. The edges are read from the gates on 
+        every call so a gate map that was changed is used as it is
+
+        Args:
+            edge_counts (NDArray): counter value at every edge, unsigned 32 bit samples still give the right counts when the counter rolls over
+
+        Raises:
+            ValueError: The samples are not a whole number of repetitions
+
+        Returns:
+            NDArray[np.int64]: counts of every gate with a row for every repetition and a column for every gate
+        """
+        edge_counts = np.asarray(edge_counts)
+        if edge_counts.size % self.edges_per_repetition != 0:
+            raise ValueError(f"{edge_counts.size} samples are not a whole number of repetitions of {self.edges_per_repetition} edges")
+
+        start_edges = np.array([start_edge for start_edge, _ in self.gates.values()],dtype=np.intp)
+        end_edges = np.array([end_edge for _, end_edge in self.gates.values()],dtype=np.intp)
+
+        repetitions = edge_counts.reshape(-1,self.edges_per_repetition)
+        return (repetitions[:,end_edges]-repetitions[:,start_edges]).astype(np.int64)
+
+    def channels(self,gate_counts:NDArray)->dict:
+        """The column of every gate from demultiplex by its name"""
+        return {name:gate_counts[:,ind] for ind, name in enumerate(self.gates)}
+
 class PhotonCounter(ConnectedDevice,metaclass=ABCMeta):
     """This is a class that all photon counters implemented on the system should follow in order to be utilized 
     """
@@ -33,6 +91,19 @@ class PhotonCounter(ConnectedDevice,metaclass=ABCMeta):
             NDArray[np.int64]: returns a list of the sequences that have been triggered during a dwell time 
         """
     
+    def get_counts_raw_line(self,number_of_pixels:int,dwell_time_s:float)->NDArray[np.int64]:
+        """Gets the raw counts of consecutive dwell times like the pixels of a scanned line. This calls get_counts_raw for every
+        pixel, photon counters that can take the whole line in a single buffered read should override it
+
+        Args:
+            number_of_pixels (int): how many dwell times are taken
+            dwell_time_s (float): how long each pixel is sampled for
+
+        Returns:
+            NDArray[np.int64]: counts during every dwell time
+        """
+        return np.array([self.get_counts_raw(dwell_time_s) for _ in range(number_of_pixels)],dtype=np.int64)
+
     def get_counts_per_second(self,dwell_time_s:float):
         """Calls get_counts_raw and return the divided value by the dwell time 
 
@@ -1,41 +1,228 @@
-__all__ = ["PulseGenerator"]
+__all__ = ["PulseGenerator","ScheduledStart","StartScheduler"]
 
 from abc import ABCMeta, abstractmethod
+from collections import deque
 from NV_ABJ.abstract_interfaces.connected_device import ConnectedDevice
 
 # For asynchronous worker 
 import threading 
 import time
-import multiprocessing
+
+class ScheduledStart:
+
+    def __init__(self,deadline_s:float,condition:threading.Condition=None):
+        """Handle of a start that is scheduled for a time in the future which can be cancelled or waited on
+
+        Args:
+            deadline_s (float): time.perf_counter time the start is called at
+            condition (threading.Condition, optional): Condition of the scheduler that is notified when the start is cancelled so 
+            the scheduler stops waiting for it. Defaults to None.
+        """
+        self.deadline_s = deadline_s
+        self.started_s = None # time.perf_counter time the start was called at
+        self.latency_s = None # How late the start was called compared to the deadline
+        self.response = None # What the start function returned
+        self.exception = None # Exception raised by the start function
+        self._cancelled = False
+        self._claimed = False # Set when the scheduler is about to call the start so it can no longer be cancelled
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        self._condition = condition
+
+    def cancel(self)->bool:
+        """Cancels the start if it has not been called yet
+
+        Returns:
+            bool: True if the start will not be called
+        """
+        with self._lock:
+            if self._claimed or self._finished.is_set():
+                return self._cancelled
+            self._cancelled = True
+            self._finished.set()
+
+        # The scheduler removes the cancelled start and waits for the next deadline instead
+        if self._condition != None:
+            with self._condition:
+                self._condition.notify()
+        return True
+
+    def _claim(self)->bool:
+        with self._lock:
+            if self._cancelled:
+                return False
+            self._claimed = True
+            return True
+
+    def cancelled(self)->bool:
+        return self._cancelled
+
+    def done(self)->bool:
+        """If the start was called or cancelled"""
+        return self._finished.is_set()
+
+    def wait(self,timeout_s:float=None)->bool:
+        """Waits until the start was called or cancelled
+
+        Args:
+            timeout_s (float, optional): Longest time to wait. Defaults to None which waits until it is done.
+
+        Returns:
+            bool: True if it is done
+        """
+        return self._finished.wait(timeout_s)
+
+    def result(self,timeout_s:float=None):
+        """Waits for the start and returns what it returned. An exception raised by the start is raised again here
+
+        Args:
+            timeout_s (float, optional): Longest time to wait. Defaults to None which waits until it is done.
+        """
+        if not self._finished.wait(timeout_s):
+            raise TimeoutError(f"The start was not called within {timeout_s} s")
+        if self._cancelled:
+            raise RuntimeError("The start was cancelled")
+        if self.exception != None:
+            raise self.exception
+        return self.response
+
+    def __repr__(self):
+        state = "cancelled" if self._cancelled else ("started" if self.done() else "pending")
+        return f"ScheduledStart({state}, latency_s={self.latency_s})"
+
+class StartScheduler:
+
+    def __init__(self,spin_s:float=0.02,maximum_history:int=1000):
+        """Calls functions at a deadline from a thread that is already running so nothing has to be started or imported when 
+        the deadline is close. The thread sleeps until shortly before the deadline and then checks a monotonic clock until it is 
+        reached because sleeping alone can be late by the resolution of the system timer which is about 15 ms on Windows. While it 
+        checks the clock the thread holds the GIL so other Python threads like the ones reading the counters are slowed for up to 
+        spin_s before every start
+
+        Args:
+            spin_s (float, optional): How long before the deadline the thread stops sleeping. A shorter time slows the other threads 
+            for less time but the start can be later. Defaults to 0.02.
+            maximum_history (int, optional): How many start latencies are kept. Defaults to 1000.
+        """
+        self.spin_s = spin_s
+        self.latencies_s = deque(maxlen=maximum_history) # How late every start was called
+        self._scheduled = []
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._worker,name="StartScheduler",daemon=True)
+        self._thread.start()
+
+    def schedule(self,function,delayed_s:float)->ScheduledStart:
+        """Calls a function after a delay
+
+        Args:
+            function (callable): called without arguments from the scheduler thread
+            delayed_s (float): How long from now the function is called
+
+        Returns:
+            ScheduledStart: handle to cancel or wait for the call
+        """
+        if delayed_s < 0:
+            raise ValueError(f"The delay must be greater than or equal to zero you entered:{delayed_s}")
+
+        handle = ScheduledStart(deadline_s=time.perf_counter()+delayed_s,condition=self._condition)
+        with self._condition:
+            self._scheduled.append((handle,function))
+            self._scheduled.sort(key=lambda scheduled: scheduled[0].deadline_s)
+            self._condition.notify()
+        return handle
+
+    def jitter_s(self)->dict:
+        """Statistics of how late the starts were called
+
+        Returns:
+            dict: mean, standard deviation and maximum latency in seconds and how many starts they are from
+        """
+        latencies_s = list(self.latencies_s)
+        if len(latencies_s) == 0:
+            return {"mean":None,"standard_deviation":None,"maximum":None,"count":0}
+
+        mean = sum(latencies_s)/len(latencies_s)
+        standard_deviation = (sum((latency-mean)**2 for latency in latencies_s)/len(latencies_s))**0.5
+        return {"mean":mean,"standard_deviation":standard_deviation,"maximum":max(latencies_s),"count":len(latencies_s)}
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                # Cancelled starts are removed so they do not wake the thread
+                self._scheduled = [scheduled for scheduled in self._scheduled if not scheduled[0].cancelled()]
+                if len(self._scheduled) == 0:
+                    self._condition.wait()
+                    continue
+
+                handle, function = self._scheduled[0]
+                remaining_s = handle.deadline_s-time.perf_counter()
+                if remaining_s > self.spin_s:
+                    # A new or cancelled start wakes the thread so the next deadline is checked again
+                    self._condition.wait(remaining_s-self.spin_s)
+                    continue
+                self._scheduled.pop(0)
+
+            while time.perf_counter() < handle.deadline_s:
+                pass
+
+            # Once the handle is claimed a cancel does nothing
+            if not handle._claim():
+                continue
+            handle.started_s = time.perf_counter()
+            handle.latency_s = handle.started_s-handle.deadline_s
+            try:
+                handle.response = function()
+            except Exception as exception:
+                handle.exception = exception
+            self.latencies_s.append(handle.latency_s)
+            handle._finished.set()
 
 class PulseGenerator(ConnectedDevice,metaclass=ABCMeta):
 
-    def _start_asynchronous_worker(self,delayed_s:float):
-            # Wait for a time
-            print("Waiting Time")
-            time.sleep(self.delayed_s)
+    # Fingerprint of the program that is on the pulse generator so loading the same program again can be skipped 
+    _loaded_fingerprint = None
+    # Thread that calls the delayed starts, it is made the first time it is needed
+    _start_scheduler = None
 
-            # Call start function
-            self.start()
-            print("Starting Function")
+    def invalidate_loaded_program(self):
+        """Forgets which program is on the pulse generator so the next load is always sent to it. Call this if the pulse 
+        generator was programmed or power cycled outside of this class
+        """
+        self._loaded_fingerprint = None
 
+    def prepare_asynchronous_start(self,spin_s:float=None)->StartScheduler:
+        """Starts the thread used by start_asynchronous ahead of time. It is started by the first start_asynchronous otherwise
 
+        Args:
+            spin_s (float, optional): How long before the deadline the thread stops sleeping and holds the GIL while it checks the 
+            clock, see StartScheduler. Defaults to None which keeps the time that is set or 0.02 s for a new thread.
 
-    def start_asynchronous(self, delayed_s:float)->None:
+        Returns:
+            StartScheduler: the scheduler which keeps the measured start latencies
+        """
+        if self._start_scheduler == None:
+            self._start_scheduler = StartScheduler() if spin_s == None else StartScheduler(spin_s=spin_s)
+        elif spin_s != None:
+            self._start_scheduler.spin_s = spin_s
+        return self._start_scheduler
+
+    def start_asynchronous(self, delayed_s:float)->ScheduledStart:
         """ This function calls the start function after the specified amount of time
         This is used so that the timing of the first pulse can start after the counters are loaded.
         This allows for the timing of the devices to not be inhibited for determining when the first pulse 
-        was performed. N
+        was performed. The start is called from a thread that is already running against a monotonic deadline. For the last 
+        20 ms before the deadline that thread checks the clock without sleeping and holds the GIL so other Python threads hardly 
+        run, set a shorter time with prepare_asynchronous_start(spin_s=...) if they have to keep up
 
         Needed for non-uniform pulses a.k.a. pulses with multiple different readouts 
         
         Args:
             delayed_s(float): How long the function will wait before starting the pulse blaster
-        """
-        start_async = multiprocessing.Process(target=self._start_asynchronous_worker, args=(delayed_s,))
-        start_async.start()
-
 
+        Returns:
+            ScheduledStart: handle to cancel the start or wait for it, its latency_s is how late the start was called
+        """
+        return self.prepare_asynchronous_start().schedule(self.start,delayed_s)
 
     @abstractmethod
     def load(self,sequence)->int:
@@ -0,0 +1,236 @@
+"""This module finds repeated blocks of instructions so they can be written as loops on a pulse generator. Instructions are
+interned into integer tokens and blocks are compared with polynomial prefix hashes so a comparison does not depend on the
+length of the block. Every hash match is confirmed on the tokens themselves so a collision can never create a wrong loop
+"""
+__all__ = ["intern_tokens","find_repeated_blocks","build_loop_tree"]
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+from numpy.typing import NDArray
+
+# Odd multiplier for the prefix hashes. The arithmetic is modulo 2**64 which numpy does for free with uint64 overflow
+_HASH_BASE = 0x9E3779B97F4A7C15
+_HASH_MASK = (1 << 64) - 1
+
+def intern_tokens(items:list, key=None)->tuple:
+    """Converts a list of hashable items into integer tokens where equal items share the same token
+
+    Args:
+        items (list): items that will be compared
+        key (callable, optional): Converts an item into something hashable. Defaults to None which uses the item
+
+    Returns:
+        tuple[NDArray,list]: int64 token for every item and a list of the first item seen for each token
+    """
+    token_lookup = {}
+    unique_items = []
+    tokens = np.zeros(len(items),dtype=np.int64)
+
+    for ind, item in enumerate(items):
+        hashable = item if key == None else key(item)
+        if (token := token_lookup.get(hashable)) == None:
+            token = len(unique_items)
+            token_lookup[hashable] = token
+            unique_items.append(item)
+        tokens[ind] = token
+
+    return tokens, unique_items
+
+def find_repeated_blocks(tokens:NDArray, minimum_block_length:int=2, can_bound_block:NDArray=None, maximize_saving:bool=False)->list:
+    """Walks through the tokens and at every position that is not already inside of a loop finds the shortest block that is
+    immediately repeated. The block is then extended for as many whole repetitions as follow it.
+
+    Only later occurrences of the current token can start a repeat so those are the only block lengths checked and all
+    of them are checked at once with the prefix hashes. A sequence without repeats is close to linear and each found
+    loop is confirmed in time proportional to how much of the sequence it covers
+
+    Args:
+        tokens (NDArray): integer tokens of the instructions, see intern_tokens
+        minimum_block_length (int, optional): The shortest block that can be looped. Defaults to 2 because a pulse generator
+        needs separate instructions to start and end a loop
+        can_bound_block (NDArray, optional): Boolean for each token if it can be the first or last entry of a block. Defaults to None
+        which allows every token
+        maximize_saving (bool, optional): Picks the block that removes the most instructions instead of the shortest block. For (XY8)^N 
+        the shortest block is half of an XY8 which hides the N repeats. Defaults to False.
+
+    Returns:
+        list[tuple[int,int,int]]: (start index, block length, repetitions) covering the tokens in order. Entries that are not
+        looped have a block length of 1 and 1 repetition
+    """
+    tokens = np.asarray(tokens,dtype=np.int64)
+    number_of_tokens = len(tokens)
+
+    if can_bound_block is None:
+        can_bound_block = np.ones(number_of_tokens,dtype=bool)
+
+    # prefix[k] is the sum of (token_j+1)*base**j for j < k so the hash of a block shifted by x is multiplied by base**x
+    powers = np.cumprod(np.full(number_of_tokens+1,_HASH_BASE,dtype=np.uint64))
+    powers = np.concatenate((np.ones(1,dtype=np.uint64),powers[:-1]))
+    prefix = np.concatenate((np.zeros(1,dtype=np.uint64),np.cumsum((tokens.astype(np.uint64)+np.uint64(1))*powers[:-1])))
+
+    # Python integers are faster for the single comparisons used while counting repetitions
+    prefix_list = prefix.tolist()
+    powers_list = powers.tolist()
+
+    # Positions of every token in order so the candidate lengths are found with a binary search
+    token_positions = {}
+    for ind, token in enumerate(tokens.tolist()):
+        token_positions.setdefault(token,[]).append(ind)
+    token_positions_arrays = {}
+
+    def block_hash(start:int,length:int)->int:
+        return (prefix_list[start+length]-prefix_list[start]) & _HASH_MASK
+
+    def count_repetitions(start:int,length:int)->int:
+        # Counting how many times the block is repeated one after another
+        repetitions = 2
+        first_hash = block_hash(start,length)
+        while start+(repetitions+1)*length <= number_of_tokens:
+            next_start = start+repetitions*length
+            if (block_hash(next_start,length) == (first_hash*powers_list[repetitions*length]) & _HASH_MASK
+                and np.array_equal(tokens[start:start+length],tokens[next_start:next_start+length])):
+                repetitions = repetitions + 1
+            else:
+                break
+
+        # The loop has to finish on an instruction that is allowed to end a block
+        while repetitions > 1 and not can_bound_block[start+repetitions*length-1]:
+            repetitions = repetitions - 1
+        return repetitions
+
+    blocks = []
+    ind = 0
+    while ind < number_of_tokens:
+        remaining = number_of_tokens-ind
+        positions = token_positions[int(tokens[ind])]
+
+        # Later occurrences of this token that could start a second copy of a block
+        low = bisect_left(positions,ind+minimum_block_length)
+        high = bisect_right(positions,ind+remaining//2)
+
+        block_length = 0
+        block_repetitions = 0
+        if low < high and can_bound_block[ind]:
+            if (candidates := token_positions_arrays.get(int(tokens[ind]))) is None:
+                candidates = token_positions_arrays[int(tokens[ind])] = np.array(positions,dtype=np.int64)
+            lengths = candidates[low:high]-ind
+            lengths = lengths[can_bound_block[ind+lengths-1]]
+
+            # The block starting at ind multiplied by base**length must equal the block starting at ind+length
+            first = (prefix[ind+lengths]-prefix[ind])*powers[lengths]
+            second = prefix[ind+2*lengths]-prefix[ind+lengths]
+
+            for length in lengths[first == second].tolist():
+                if np.array_equal(tokens[ind:ind+length],tokens[ind+length:ind+2*length]):
+                    if (repetitions := count_repetitions(ind,length)) < 2:
+                        continue
+
+                    # The number of instructions removed by looping is the copies after the first
+                    if block_length == 0 or (repetitions-1)*length > (block_repetitions-1)*block_length:
+                        block_length = length
+                        block_repetitions = repetitions
+
+                    if not maximize_saving:
+                        break
+
+        if block_length == 0:
+            blocks.append((ind,1,1))
+            ind = ind + 1
+            continue
+
+        blocks.append((ind,block_length,block_repetitions))
+        ind = ind + block_repetitions*block_length
+
+    return blocks
+
+def build_loop_tree(tokens:NDArray, maximum_depth:int=8, maximum_repetitions:int=None, minimum_block_length:int=2)->list:
+    """Finds loops inside of loops. find_repeated_blocks is run repeatedly where every loop found becomes a single token
+    for the next pass so repeats of blocks that contain loops are found. The body of every loop is also compressed on its own 
+    because the first repeat found, like a whole sequence that is added twice, can hide smaller repeats inside of it. 
+    A loop can only start and end on a plain token because a pulse generator instruction can only start or end one loop
+
+    Args:
+        tokens (NDArray): integer tokens of the instructions, see intern_tokens
+        maximum_depth (int, optional): How many loops can be nested inside of each other. Defaults to 8.
+        maximum_repetitions (int, optional): Largest repetition count of a single loop, larger counts are written as consecutive loops. 
+        Defaults to None which is unlimited
+        minimum_block_length (int, optional): The shortest block that can be looped. Defaults to 2.
+
+    Returns:
+        list: The tree in order where entries are either an int token or a tuple of (repetitions, list of entries)
+    """
+    tokens = np.asarray(tokens,dtype=np.int64)
+    nodes, _ = _compress_nodes(nodes=tokens.tolist(),
+                               level_tokens=tokens,
+                               plain=np.ones(len(tokens),dtype=bool),
+                               depths=np.zeros(len(tokens),dtype=np.int64),
+                               maximum_depth=maximum_depth,
+                               maximum_repetitions=maximum_repetitions,
+                               minimum_block_length=minimum_block_length)
+    return nodes
+
+def _compress_nodes(nodes:list, level_tokens:NDArray, plain:NDArray, depths:NDArray, maximum_depth:int, maximum_repetitions:int, minimum_block_length:int)->tuple:
+    """Compresses a list of nodes that are already tokens, see build_loop_tree
+
+    Returns:
+        tuple[list,int]: the compressed nodes and the deepest nesting of loops inside of them
+    """
+    while maximum_depth > 0:
+        blocks = find_repeated_blocks(level_tokens,minimum_block_length=minimum_block_length,can_bound_block=plain,maximize_saving=True)
+
+        changed = False
+        next_nodes = []
+        next_keys = []
+        next_plain = []
+        next_depths = []
+
+        def keep(ind:int):
+            next_nodes.append(nodes[ind])
+            next_keys.append(("node",int(level_tokens[ind])))
+            next_plain.append(plain[ind])
+            next_depths.append(depths[ind])
+
+        for start, length, repetitions in blocks:
+            if length == 1:
+                keep(start)
+                continue
+
+            # A loop around a body that is already as deep as allowed can not be made so it is left as it is
+            if depths[start:start+length].max()+1 > maximum_depth:
+                for ind in range(start,start+repetitions*length):
+                    keep(ind)
+                continue
+
+            # The first and last instruction of the body already start and end this loop so a loop inside can not use them
+            body_plain = plain[start:start+length].copy()
+            body_plain[0] = False
+            body_plain[-1] = False
+
+            body, body_depth = _compress_nodes(nodes=nodes[start:start+length],
+                                               level_tokens=level_tokens[start:start+length],
+                                               plain=body_plain,
+                                               depths=depths[start:start+length],
+                                               maximum_depth=maximum_depth-1,
+                                               maximum_repetitions=maximum_repetitions,
+                                               minimum_block_length=minimum_block_length)
+            body_key = tuple(level_tokens[start:start+length].tolist())
+            changed = True
+
+            # The loop counters of a pulse generator are limited so large counts are split into consecutive loops
+            while repetitions > 0:
+                loop_repetitions = repetitions if maximum_repetitions == None else min(repetitions,maximum_repetitions)
+                next_nodes.append((loop_repetitions,body))
+                next_keys.append(("loop",loop_repetitions,body_key))
+                next_plain.append(False)
+                next_depths.append(body_depth+1)
+                repetitions = repetitions - loop_repetitions
+
+        if not changed:
+            break
+
+        level_tokens, _ = intern_tokens(next_keys)
+        nodes = next_nodes
+        plain = np.array(next_plain,dtype=bool)
+        depths = np.array(next_depths,dtype=np.int64)
+
+    return nodes, int(depths.max()) if len(depths) > 0 else 0
@@ -0,0 +1,63 @@
+__all__ = ["CompiledSequenceCache","compiled_sequence_cache"]
+
+from collections import OrderedDict
+import copy
+
+class CompiledSequenceCache:
+
+    def __init__(self,maximum_size:int=128):
+        """Least recently used cache of compiled sequences. The same sequence is often compiled many times in a session like
+        when the trigger widget is toggled or data is saved so a repeated compile is only a dictionary lookup. Every call gets its
+        own copy of the cached result so a caller that changes it does not change what the next caller gets
+
+        Args:
+            maximum_size (int, optional): How many compiled results are kept before the least recently used is removed. Defaults to 128.
+        """
+        if maximum_size < 0:
+            raise ValueError(f"The maximum size must be greater than or equal to zero you entered:{maximum_size}")
+
+        self.maximum_size = maximum_size
+        self.hits = 0
+        self.misses = 0
+        self._compiled = OrderedDict()
+
+    def __len__(self):
+        return len(self._compiled)
+
+    def __repr__(self):
+        return f"CompiledSequenceCache(hits={self.hits}, misses={self.misses}, size={len(self)}, maximum_size={self.maximum_size})"
+
+    def get(self,key,compile_function):
+        """Returns the cached result for the key or compiles, stores and returns it
+
+        Args:
+            key (hashable): the structure of the sequence and the compile options
+            compile_function (callable): called without arguments when the key is not cached
+
+        Returns:
+            A copy of the compiled result
+        """
+        if key in self._compiled:
+            self.hits = self.hits + 1
+            self._compiled.move_to_end(key)
+            return copy.deepcopy(self._compiled[key])
+
+        self.misses = self.misses + 1
+        compiled = compile_function()
+
+        if self.maximum_size > 0:
+            self._compiled[key] = compiled
+            if len(self._compiled) > self.maximum_size:
+                self._compiled.popitem(last=False)
+            return copy.deepcopy(compiled)
+
+        return compiled
+
+    def clear(self):
+        """Removes every compiled result and resets the hit and miss counters"""
+        self._compiled.clear()
+        self.hits = 0
+        self.misses = 0
+
+# Cache shared by every sequence
+compiled_sequence_cache = CompiledSequenceCache()
@@ -1,8 +1,16 @@
-__all__ = ["SequenceDevice","SequenceSubset","Sequence","SequenceDeviceConfiguration"]
+__all__ = ["SequenceDevice","SequenceSubset","Sequence","SequenceDeviceConfiguration","SequenceRepeat","InstructionLoop","SequenceIr","DelayConflict","addresses_to_mask","mask_to_addresses"]
 
 from dataclasses import dataclass
+from bisect import bisect_left
 import copy
 
+# Numpy is used for the array backed timeline engine
+import numpy as np
+
+from NV_ABJ.experimental_logic.sequence_generation.loop_compression import intern_tokens, find_repeated_blocks, build_loop_tree
+from NV_ABJ.experimental_logic.sequence_generation.sequence_cache import compiled_sequence_cache
+from NV_ABJ.experimental_logic.sequence_generation.sequence_ir import InstructionLoop, SequenceIr, optimize, enforce_minimum_length
+
 @dataclass(frozen=True)
 class SequenceDeviceConfiguration:
     """This is a immutable subclass to the sequence device class this is how we want to configure the devices within.
@@ -15,6 +23,76 @@ class SequenceDeviceConfiguration:
     def __lt__(self,other):
         return self.delayed_to_on_ns < other.delayed_to_on_ns
 
+@dataclass
+class SequenceRepeat:
+    """Steps of a sub sequence that are repeated. The steps are stored once and only unrolled when a full timeline is requested
+    """
+    repetitions:int # How many times the steps are run must be greater than or equal to two
+    steps:list # (duration_ns, set of SequenceDeviceConfiguration) steps of a single repetition
+
+@dataclass(frozen=True)
+class DelayConflict:
+    """A device with a delay that has to be turned on before it was turned off from the previous time it was on
+    """
+    device:SequenceDeviceConfiguration # The device that is delayed
+    step_index:int # Index of the step the device is turned on for, repeated steps are counted as if they were written out
+    on_time_ns:float # The time the device has to be turned on at including the delay
+    previous_off_time_ns:float # The time the device was turned off from the last time it was on
+
+def addresses_to_mask(addresses)->int:
+    """Converts device addresses into a single integer where bit n is set when the device at address n is on
+
+    Args:
+        addresses (iterable): integer addresses of the devices that are on
+
+    Returns:
+        int: the device mask
+    """
+    mask = 0
+    for address in addresses:
+        mask = mask | (1 << address)
+    return mask
+
+def mask_to_addresses(mask:int)->set:
+    """Converts a device mask back into the set of addresses that are on
+
+    Args:
+        mask (int): device mask, see addresses_to_mask
+
+    Returns:
+        set: integer addresses of the devices that are on
+    """
+    mask = int(mask)
+    addresses = set()
+    while mask:
+        lowest_bit = mask & -mask
+        addresses.add(lowest_bit.bit_length()-1)
+        mask = mask ^ lowest_bit
+    return addresses
+
+def _delay_conflicts_message(delay_conflicts:list)->str:
+    """Error message listing every delay conflict"""
+    conflicts_text = ""
+    for conflict in delay_conflicts:
+        conflicts_text = conflicts_text + f"\tDevice:{conflict.device} Index:{conflict.step_index} On:{conflict.on_time_ns} ns Previously off:{conflict.previous_off_time_ns} ns\n"
+    return f"The devices delayed on overlaps with when it was previously on the duration.\nConflicts:{len(delay_conflicts)}\n{conflicts_text}"
+
+def _unrolled_delay_conflicts(delay_conflicts:list,unrolled_step_indices:list,repeated_windows:list)->list:
+    """Delay conflicts of a compact sequence with the step index and times each step would have if every repeat was written out, 
+    ordered by the step index
+    """
+    def unrolled(conflict:DelayConflict)->DelayConflict:
+        # Every window that ended before the step the device is turned on for stands in for the middle copies that are not written 
+        # out, the copies on either side reach as far as the delays so the previous turn off is moved the same amount 
+        step_time_ns = conflict.on_time_ns+conflict.device.delayed_to_on_ns
+        offset_ns = sum((window_end_ns-window_start_ns)*(repetitions-1) for window_start_ns, window_end_ns, repetitions in repeated_windows
+                        if window_end_ns <= step_time_ns+1e-9)
+        return DelayConflict(device=conflict.device,step_index=unrolled_step_indices[conflict.step_index],
+                             on_time_ns=conflict.on_time_ns+offset_ns,previous_off_time_ns=conflict.previous_off_time_ns+offset_ns)
+
+    delay_conflicts = [unrolled(conflict) for conflict in delay_conflicts]
+    return sorted(delay_conflicts,key=lambda conflict: (conflict.step_index,conflict.device.address))
+
 class SequenceDevice:
     def __init__(self,address:int,delayed_to_on_ns:int=0,inverted_output:bool=False,
                  device_status:bool = False, device_label:str = None, graph_order = None, graph_color = None):
@@ -98,7 +176,8 @@ class Sequence:
         self.add_sub_sequence(sub_sequence=sub_sequence)
     
     def add_sub_sequence(self, sub_sequence:SequenceSubset):
-        """Allows you to add a subsequence to the sequence. This will unwrap the sequence into the sequence steps 
+        """Allows you to add a subsequence to the sequence. A looped SequenceSubset is kept as a single SequenceRepeat step 
+        so the memory and compile time do not depend on how many times it is looped
 
         Args:
             sub_sequence (SequenceSubset): The subsequence you have created
@@ -107,9 +186,10 @@ class Sequence:
         sub_sequence = copy.deepcopy(sub_sequence)
 
         if type(sub_sequence) == SequenceSubset:
-            # Loops through the sub sequence for the amount of times it was specified 
-            looping_times = sub_sequence.loop_steps+1
-            for i in range(looping_times):
+            # The loop is only stored once and is unrolled when the timeline needs it 
+            if sub_sequence.loop_steps > 0 and len(sub_sequence.steps) > 0:
+                self.steps.append(SequenceRepeat(repetitions=sub_sequence.loop_steps+1,steps=sub_sequence.steps))
+            else:
                 for step in sub_sequence.steps:
                     self.steps.append(step)
             
@@ -131,266 +211,585 @@ class Sequence:
         return f"\nSteps:\n{steps_text}\nDevice:{self.devices}"
     
 
-    def linear_time_sequence(self,wrapped:bool=True):
+    def linear_time_sequence(self,wrapped:bool=True,numpy_engine:bool=False):
         """This function generates a linear time progression of the sequences and raises errors if a sequence is not possible due to timing of the 
         delays on a device interacting with times it was previously on. It also applies the delay for the devices 
 
+        Args:
+            wrapped (bool, optional): If the delays before the start of the sequence are wrapped around to the end of the sequence. Defaults to True.
+            numpy_engine (bool, optional): Uses the array backed engine which scales as O(n log n) in the number of steps. Defaults to False 
+            which places the same on intervals with sets so both engines give the same timeline.
+
         Raises:
             ValueError: if there is a time where a device is off for less than it's delay to on it will raise an error 
 
         Returns:
-            tuple[dict,set]: returns a dictionary containing the devices and times each device is on and a set of all the state changes for a device 
+            tuple[dict,list]: returns a dictionary containing the devices and times each device is on and a set of all the state changes for a device 
         """
+        # The full timeline contains every repetition so any repeated steps are unrolled first 
+        if any(type(step) == SequenceRepeat for step in self.steps):
+            return self._unrolled_sequence().linear_time_sequence(wrapped=wrapped,numpy_engine=numpy_engine)
 
-        # Finding the time without delays added on 
-        time_ns = 0 # Keeping track of the nominal time 
-        step_times_ns = set([0]) # Set of all unique times 
+        if numpy_engine:
+            return self._linear_time_sequence_numpy(wrapped=wrapped)
+        return self._linear_time_sets(wrapped=wrapped)
+    
+    def _structure_key(self)->tuple:
+        """Canonical hashable form of the steps and devices used to look up compiled results. The type of each duration is 
+        included because 10 and 10.0 are written differently to a pulse generator 
 
-        sequence_devices = {} # A list of the devices broken into linear time 
-        devices_with_delays = set() # A list of all devices that have delays 
+        Returns:
+            tuple: the structure of the sequence
+        """
+        def step_key(step):
+            if type(step) == SequenceRepeat:
+                return (step.repetitions,tuple(step_key(repeat_step) for repeat_step in step.steps))
+            return (type(step[0]),step[0],frozenset(step[1]))
 
-        for device in self.devices:
-            sequence_devices[device.address] = {"device":device,"on_times_ns":set()}
-            
-            if device.delayed_to_on_ns > 0:
-                devices_with_delays.add(device)
+        return (tuple(step_key(step) for step in self.steps),frozenset(self.devices))
 
+    def _unrolled_sequence(self):
+        """Copy of the sequence where every SequenceRepeat is written out as its steps 
 
-        temp_steps = self.steps
+        Returns:
+            Sequence: sequence with only (duration_ns, devices) steps
+        """
+        unrolled_sequence = Sequence()
+        unrolled_sequence.devices = self.devices
+        for step in self.steps:
+            if type(step) == SequenceRepeat:
+                unrolled_sequence.steps.extend(step.steps*step.repetitions)
+            else:
+                unrolled_sequence.steps.append(step)
+        return unrolled_sequence
 
-        # Adding in the first step
-        previous_duration = temp_steps[0][0]
-        devices_previously_on = temp_steps[0][1]
-        devices_on_before_start = set()
-        
-        devices_previously_on_sorted = sorted(devices_previously_on)
-        for ind,device in enumerate(devices_previously_on_sorted):
-            for dev in devices_previously_on_sorted[ind:]:
-                sequence_devices[dev.address]['on_times_ns'].add(-device.delayed_to_on_ns)
-                sequence_devices[dev.address]['on_times_ns'].add(time_ns)
-            
-            if device.delayed_to_on_ns > 0:
-                # Getting the devices that will need to be wrapped
-                devices_on_before_start.add(device)
+    def _compact_sequence(self):
+        """Unrolls each SequenceRepeat only as much as the device delays need. A delay moves a turn on earlier so it can reach 
+        back into previous repetitions. With enough copies before and after, a single middle copy has the same instructions as 
+        every other middle copy and can stand in for all of them
 
+        Returns:
+            tuple[Sequence,list,list]: the compact sequence, (start time ns, end time ns, repetitions) of the middle copies and the 
+            index each compact step would have if every repeat was written out
+        """
+        maximum_delay_ns = max((device.delayed_to_on_ns for device in self.devices),default=0)
+
+        compact_sequence = Sequence()
+        compact_sequence.devices = self.devices
+        repeated_windows = []
+        unrolled_step_indices = []
+        time_ns = 0
+        unrolled_index = 0
+
+        def add_steps(steps:list):
+            nonlocal time_ns, unrolled_index
+            for step in steps:
+                compact_sequence.steps.append(step)
+                unrolled_step_indices.append(unrolled_index)
+                time_ns = time_ns + step[0]
+                unrolled_index = unrolled_index + 1
 
-            step_times_ns.add(-device.delayed_to_on_ns)
+        for step in self.steps:
+            if type(step) != SequenceRepeat:
+                add_steps([step])
+                continue
 
-        time_ns = time_ns + previous_duration
-        step_times_ns.add(time_ns)
+            repetition_duration_ns = sum(repeat_step[0] for repeat_step in step.steps)
+            # Number of copies on either side of the middle copy that a delay could reach through 
+            context_copies = int(np.ceil(maximum_delay_ns/repetition_duration_ns))+1
 
+            if step.repetitions <= 2*context_copies+1:
+                add_steps(step.steps*step.repetitions)
+            else:
+                add_steps(step.steps*context_copies)
+                window_start_ns = time_ns
+                add_steps(step.steps)
+                repeated_windows.append((window_start_ns,time_ns,step.repetitions-2*context_copies))
+                unrolled_index = unrolled_index + (step.repetitions-2*context_copies-1)*len(step.steps)
+                add_steps(step.steps*context_copies)
 
+        return compact_sequence, repeated_windows, unrolled_step_indices
 
-        # Adds the times the device is already on from the list 
-        for ind,step in enumerate(temp_steps[1:]):
-            duration = step[0] 
-            devices = step[1]
+    def _step_arrays(self):
+        """Converts the steps into arrays of durations and integer bitmasks of the addresses that are on
 
-            # If there are devices in the step
-            if devices != set():
-                devices_with_delays_new = devices_with_delays.intersection(devices - devices_previously_on)
-                # If the previous devices are the same as the ones that are now on we don't want to account for any delays 
-                if devices_with_delays_new == set():
-                    for device in devices:
-                        sequence_devices[device.address]["on_times_ns"].add(time_ns)
-                        step_times_ns.add(time_ns)
+        Returns:
+            tuple[NDArray,NDArray]: durations (int64 if every duration is an integer otherwise float64) and the uint64 device mask of each step 
+        """
+        durations = [step[0] for step in self.steps]
 
-                        
+        # Integer durations are kept as integers so the times written to the pulse generator are unchanged 
+        if all(isinstance(duration,(int,np.integer)) for duration in durations):
+            durations = np.array(durations,dtype=np.int64)
+        else:
+            durations = np.array(durations,dtype=np.float64)
 
-                # If there is a device with a delay in it we want to account for it 
-                else:
-                    # If the devices are on during the time we want to add the time when this device turns on 
-                    devices_with_delays_new_sorted = sorted(devices_with_delays_new)
-                    for device in devices_with_delays_new_sorted:
+        masks = np.array([addresses_to_mask(device.address for device in step[1]) for step in self.steps],dtype=np.uint64)
 
-                        device_time = time_ns-device.delayed_to_on_ns
+        return durations, masks
 
-                        # Checks if the delay time is overlapping with when it was previously on
-                        if len(sequence_devices[device.address]["on_times_ns"]) > 0 and max(sequence_devices[device.address]["on_times_ns"]) > device_time:
-                            raise ValueError(f"The devices delayed on overlaps with when it was previously on the duration.\nDevice:{sequence_devices[device.address]}\nStep:{step}\nIndex:{ind}")
+    def _device_intervals(self,wrapped:bool=True)->tuple:
+        """Builds a sorted index of the on intervals [start, end) of every device with the start moved earlier by the devices delay.
+        The steps are in time order so the intervals of a device are already sorted and a delayed start only has to be compared 
+        with the end of the interval before it
 
-                        sequence_devices[device.address]["on_times_ns"].add(device_time)
-                        step_times_ns.add(device_time)
+        Args:
+            wrapped (bool, optional): If the delays before the start are wrapped around to the end of the sequence. Defaults to True.
 
-                        for device_previous in devices_previously_on:
-                            sequence_devices[device_previous.address]["on_times_ns"].add(device_time)
-                            sequence_devices[device_previous.address]["on_times_ns"].add(time_ns)
-                    
-                    # We now need to add the devices that don't have a delay to the timeline 
-                    new_devices_on_without_delays = devices-devices_previously_on-devices_with_delays_new
-                    
-                    for device in new_devices_on_without_delays:
-                        sequence_devices[device.address]["on_times_ns"].add(time_ns)
-                        step_times_ns.add(time_ns)
+        Returns:
+            tuple[NDArray,dict,list]: the step boundaries with the period as the last entry, a dictionary of address to (starts, ends) 
+            and a list of every DelayConflict 
+        """
+        durations, masks = self._step_arrays()
+
+        # Nominal times that each step starts at with the final entry being the period of the sequence
+        step_boundaries = np.concatenate((np.zeros(1,dtype=durations.dtype),np.cumsum(durations)))
+        period = step_boundaries[-1]
 
-                        # We want to add the time to all devices that continue to be on for this step 
-                        for device_on in devices:
-                            sequence_devices[device_on.address]["on_times_ns"].add(time_ns)
+        device_intervals = {}
+        delay_conflicts = []
+
+        for device in self.devices:
+            device_on = ((masks >> np.uint64(device.address)) & np.uint64(1)).astype(bool)
             
-            # Without devices in the step we still need to add the time to step so the devices that were on before will have an indication to turn off
-            else:
-                step_times_ns.add(time_ns)
+            # Finding the steps where the device turns on and the step after it turns off
+            changes = np.diff(np.concatenate(([0],device_on.astype(np.int8),[0])))
+            rising_steps = np.flatnonzero(changes == 1)
+            falling_steps = np.flatnonzero(changes == -1)
+
+            starts = step_boundaries[rising_steps] - device.delayed_to_on_ns
+            ends = step_boundaries[falling_steps]
+
+            # Checks if the delay time is overlapping with when it was previously on
+            for ind in np.flatnonzero(starts[1:] < ends[:-1]).tolist():
+                delay_conflicts.append(DelayConflict(device=device,step_index=int(rising_steps[ind+1]),
+                                                     on_time_ns=starts[ind+1].item(),previous_off_time_ns=ends[ind].item()))
+
+            if wrapped and len(starts) > 0 and starts[0] < 0:
+                # If the device is also on at the end it is already on when the sequence repeats 
+                if not device_on[-1]:
+                    shifted_time = period + starts[0]
+                    if shifted_time < ends[-1]:
+                        delay_conflicts.append(DelayConflict(device=device,step_index=0,
+                                                             on_time_ns=shifted_time.item(),previous_off_time_ns=ends[-1].item()))
+                    starts = np.append(starts,shifted_time)
+                    ends = np.append(ends,period)
+                starts[0] = 0
+
+            device_intervals[device.address] = (starts,ends)
+
+        return step_boundaries, device_intervals, delay_conflicts
+
+    def delay_conflicts(self,wrapped:bool=True)->list:
+        """Finds every time a delayed device has to be turned on before it was turned off from the last time it was on. 
+        This can be used to check a large number of sequences before running them. A conflict inside of a long SequenceRepeat is 
+        the same for every middle repetition so it is only reported for the repetitions near the start and end of the repeat
 
+        Args:
+            wrapped (bool, optional): If the delays before the start are wrapped around to the end of the sequence. Defaults to True.
 
-            # Updating which devices were previously on
-            devices_previously_on = devices
-            time_ns = time_ns + duration
-            step_times_ns.add(time_ns)
+        Returns:
+            list[DelayConflict]: every conflict ordered by the step index
+        """
+        if len(self.steps) == 0:
+            return []
 
+        # Repeats only need to be checked as far as the delays reach
+        compact_sequence, repeated_windows, unrolled_step_indices = self._compact_sequence()
+        _, _, delay_conflicts = compact_sequence._device_intervals(wrapped=wrapped)
+        return _unrolled_delay_conflicts(delay_conflicts,unrolled_step_indices,repeated_windows)
 
+    def validate_delays(self,wrapped:bool=True):
+        """Checks the delays of the sequence and reports every conflict at once
 
-        # Adding the final time_ns
-        step_times_ns.add(time_ns)
+        Args:
+            wrapped (bool, optional): If the delays before the start are wrapped around to the end of the sequence. Defaults to True.
 
-        # for wrapping 
-        devices_on_in_end = devices_previously_on
+        Raises:
+            ValueError: if a delayed turn on overlaps with when the device was previously on 
+        """
+        if (delay_conflicts := self.delay_conflicts(wrapped=wrapped)) != []:
+            raise ValueError(_delay_conflicts_message(delay_conflicts))
 
+    def _validated_intervals(self,wrapped:bool=True)->tuple:
+        """The on intervals of every device from _device_intervals, every delay conflict is raised at once
 
+        Args:
+            wrapped (bool, optional): If the delays before the start are wrapped around to the end of the sequence. Defaults to True.
+
+        Raises:
+            ValueError: if the sequence is empty or a delayed turn on overlaps with when the device was previously on 
+
+        Returns:
+            tuple[NDArray,dict]: the step boundaries with the period as the last entry and a dictionary of address to (starts, ends)
+        """
+        if len(self.steps) == 0:
+            raise ValueError("The sequence must contain at least one step to generate a linear time sequence")
+
+        step_boundaries, device_intervals, delay_conflicts = self._device_intervals(wrapped=wrapped)
+        if delay_conflicts != []:
+            raise ValueError(_delay_conflicts_message(delay_conflicts))
+        return step_boundaries, device_intervals
+
+    def _linear_time_sets(self,wrapped:bool=True,intervals:tuple=None):
+        """Set backed version of the linear time sequence. The on intervals of every device are placed onto the sorted set of all 
+        the edges of the sequence one interval at a time
+
+        Args:
+            wrapped (bool, optional): If the delays before the start are wrapped around to the end of the sequence. Defaults to True.
+            intervals (tuple, optional): The result of _validated_intervals when it is already known. Defaults to None which finds it.
+
+        Returns:
+            tuple[dict,list]: returns a dictionary containing the devices and times each device is on and a sorted list of all the state changes 
+        """
+        if intervals == None:
+            intervals = self._validated_intervals(wrapped=wrapped)
+        step_boundaries, device_intervals = intervals
+
+        step_times_ns = set(step_boundaries.tolist())
+        for starts, _ in device_intervals.values():
+            step_times_ns.update(starts.tolist())
         if wrapped:
-            # We need devices that were on at the very start
-            
-            # This removes any devices that are on before the start but are already on in the end 
-            devices_needing_shifting = devices_on_before_start-devices_on_in_end
+            step_times_ns = {time for time in step_times_ns if time >= 0}
+        step_times_ns = sorted(step_times_ns)
 
-            devices_needing_shifting_sorted = sorted(devices_needing_shifting)
+        sequence_devices = {}
+        for device in self.devices:
+            starts, ends = device_intervals[device.address]
 
-            for shifted_device in devices_needing_shifting_sorted:
-                
-                # Find what devices are on in the duration between the shift and the end 
-                shifted_time = time_ns + min(sequence_devices[shifted_device.address]["on_times_ns"])
+            # A device is on at every step time inside of one of its intervals, the end of an interval is when it turns off
+            on_times_ns = set()
+            for start, end in zip(starts.tolist(),ends.tolist()):
+                on_times_ns.update(step_times_ns[bisect_left(step_times_ns,start):bisect_left(step_times_ns,end)])
 
-                sequence_devices[shifted_device.address]["on_times_ns"].add(shifted_time)
-                step_times_ns.add(shifted_time)
+            # An inverted device is on whenever the device is not being turned on
+            if device.inverted_output:
+                on_times_ns = set(step_times_ns)-on_times_ns
 
-                step_times_ns_sorted = sorted(step_times_ns)
+            sequence_devices[device.address] = {"device":device,"on_times_ns":on_times_ns}
 
-                for ind, time in enumerate(step_times_ns_sorted[:-1]):
-                    future_time = step_times_ns_sorted[ind+1]
+        return sequence_devices, step_times_ns
 
-                    if time <= shifted_time and shifted_time < future_time:
+    def _linear_time_arrays(self,wrapped:bool=True,intervals:tuple=None):
+        """Array backed version of the linear time sequence. Every device is turned into a list of on intervals [start, end) using the 
+        cumulative step times, the start of each interval is moved earlier by the devices delay and the intervals are then 
+        placed onto the sorted set of all the edges of the sequence
 
-                        for device_address in sequence_devices:
-                            times = sequence_devices[device_address]["on_times_ns"]
+        Args:
+            wrapped (bool, optional): If the delays before the start are wrapped around to the end of the sequence. Defaults to True.
+            intervals (tuple, optional): The result of _validated_intervals when it is already known. Defaults to None which finds it.
 
-                            if time in times:
-                                sequence_devices[device_address]["on_times_ns"].add(shifted_time)
-                            
+        Raises:
+            ValueError: if a delayed turn on overlaps with when the device was previously on 
 
-            # When all devices are wrapped around we can remove the negative values from all lists 
-            for device_address in sequence_devices:
-                times = sequence_devices[device_address]["on_times_ns"]
-                temp = times.copy()
-                for time in times:
-                    if time < 0:
-                        temp.remove(time)
-                sequence_devices[device_address]["on_times_ns"] = temp
-            
-            temp = step_times_ns.copy()
-            for time in step_times_ns:
-                if time < 0:
-                    temp.remove(time)
-            step_times_ns = temp
+        Returns:
+            tuple[NDArray,dict,NDArray]: sorted step times, a dictionary of address to a boolean array of the step times the device is on at 
+            and the uint64 masks of the devices that are on for each interval between step times (inverted outputs are not applied)
+        """
+        if intervals == None:
+            intervals = self._validated_intervals(wrapped=wrapped)
+        step_boundaries, device_intervals = intervals
+
+        edges = [step_boundaries]+[starts for starts,_ in device_intervals.values()]
+        step_times_ns = np.unique(np.concatenate(edges))
+        if wrapped:
+            step_times_ns = step_times_ns[step_times_ns >= 0]
 
+        # Placing the intervals on to the step times a device is on at a step time when it is inside of any of its intervals 
+        device_on_times = {}
+        interval_masks = np.zeros(len(step_times_ns)-1,dtype=np.uint64)
+        for device in self.devices:
+            starts, ends = device_intervals[device.address]
+            coverage = np.zeros(len(step_times_ns)+1,dtype=np.int64)
+            np.add.at(coverage,np.searchsorted(step_times_ns,starts),1)
+            np.add.at(coverage,np.searchsorted(step_times_ns,ends),-1)
+            on_at_step_time = np.cumsum(coverage)[:-1] > 0
+
+            device_on_times[device.address] = on_at_step_time
+            interval_masks[on_at_step_time[:-1]] |= np.uint64(1 << device.address)
+
+        return step_times_ns, device_on_times, interval_masks
+
+    def _linear_time_sequence_numpy(self,wrapped:bool=True):
+        """Uses the array backed engine to generate the same output as linear_time_sequence
+
+        Args:
+            wrapped (bool, optional): If the delays before the start are wrapped around to the end of the sequence. Defaults to True.
+
+        Returns:
+            tuple[dict,list]: returns a dictionary containing the devices and times each device is on and a sorted list of all the state changes 
+        """
+        step_times_ns, device_on_times, _ = self._linear_time_arrays(wrapped=wrapped)
 
-        # Finding any inverted output devices
-        inverted_devices = set()
+        sequence_devices = {}
         for device in self.devices:
+            on_at_step_time = device_on_times[device.address]
+
+            # The final time is the end of the sequence so it is never an on time unless the output is inverted
             if device.inverted_output:
-                inverted_devices.add(device)
+                on_times_ns = step_times_ns[~on_at_step_time]
+            else:
+                on_times_ns = step_times_ns[:-1][on_at_step_time[:-1]]
 
-        # Taking care of any inverted outputs 
-        if inverted_devices != set():
-            # Because we are inverting bits we want an independent copy of the steps to not affect the sequence 
+            sequence_devices[device.address] = {"device":device,"on_times_ns":set(on_times_ns.tolist())}
 
-            for device in inverted_devices:
-                # Inverting all the outputs
-                on_times_ns = step_times_ns-sequence_devices[device.address]['on_times_ns']
-                sequence_devices[device.address]['on_times_ns'] = on_times_ns
+        return sequence_devices, step_times_ns.tolist()
 
+    def _instruction_segments(self,wrapped:bool=True,numpy_engine:bool=False)->list:
+        """Converts the sequence into segments of instructions where segments from a SequenceRepeat keep their repetitions
+        instead of being unrolled 
 
-        return sequence_devices, sorted(step_times_ns)
-    
-    def instructions(self,allow_subroutine:bool = True,wrapped:bool=True):
-        # We want to start with what the linear time has already given us time wise
-        linear_time_dict, step_times = self.linear_time_sequence(wrapped=wrapped)
+        Returns:
+            list[tuple[list,int]]: ([duration_ns, device mask] instructions, repetitions) in order, segments that are not repeated have one repetition 
+        """
+        compact_sequence, repeated_windows, unrolled_step_indices = self._compact_sequence()
 
-        instruction_set = []
-        
-        # We want to convert into a list of instructions 
-        for ind,time in enumerate(step_times[:-1]):
-            instruction_set.append([step_times[ind+1]-time,set()])
+        # The delays are only checked once, the conflicts are reported with the step indices of the whole sequence so they include every repeat 
+        step_boundaries, device_intervals, delay_conflicts = compact_sequence._device_intervals(wrapped=wrapped)
+        if delay_conflicts != []:
+            raise ValueError(_delay_conflicts_message(_unrolled_delay_conflicts(delay_conflicts,unrolled_step_indices,repeated_windows)))
+
+        instruction_set, step_times = compact_sequence._instruction_masks(wrapped=wrapped,numpy_engine=numpy_engine,
+                                                                          intervals=(step_boundaries,device_intervals))
+
+        def step_index(time_ns:float)->int:
+            # The window edges are step boundaries so they are always in the step times 
+            ind = bisect_left(step_times,time_ns)
+            if ind > 0 and (ind == len(step_times) or abs(step_times[ind-1]-time_ns) < abs(step_times[ind]-time_ns)):
+                ind = ind - 1
+            return ind
+
+        segments = []
+        previous_end = 0
+        for window_start_ns, window_end_ns, repetitions in repeated_windows:
+            start = step_index(window_start_ns)
+            end = step_index(window_end_ns)
+            if start > previous_end:
+                segments.append((instruction_set[previous_end:start],1))
+            segments.append((instruction_set[start:end],repetitions))
+            previous_end = end
+
+        if previous_end < len(instruction_set):
+            segments.append((instruction_set[previous_end:],1))
+
+        return segments
+
+    def _instruction_masks(self,wrapped:bool=True,numpy_engine:bool=False,intervals:tuple=None)->tuple:
+        """Converts the linear time sequence into a flat list of instructions where the devices that are on are a single integer mask
+
+        Args:
+            wrapped (bool, optional): If the delays before the start are wrapped around to the end of the sequence. Defaults to True.
+            numpy_engine (bool, optional): Uses the array backed linear time engine. Defaults to False.
+            intervals (tuple, optional): The result of _validated_intervals when the delays are already checked. Defaults to None which finds it.
+
+        Returns:
+            tuple[list,list]: [duration_ns, device mask] for every instruction and the sorted step times 
+        """
+        if any(type(step) == SequenceRepeat for step in self.steps):
+            return self._unrolled_sequence()._instruction_masks(wrapped=wrapped,numpy_engine=numpy_engine)
 
+        if numpy_engine:
+            step_times_ns, _, interval_masks = self._linear_time_arrays(wrapped=wrapped,intervals=intervals)
+            
+            # An inverted device is on whenever the device is not being turned on
+            inverted_mask = addresses_to_mask(device.address for device in self.devices if device.inverted_output)
+            masks = (interval_masks ^ np.uint64(inverted_mask)).tolist()
+            step_times = step_times_ns.tolist()
+
+        else:
+            # We want to start with what the linear time has already given us time wise
+            linear_time_dict, step_times = self._linear_time_sets(wrapped=wrapped,intervals=intervals)
+
+            time_index = {time:ind for ind,time in enumerate(step_times[:-1])}
+            masks = [0]*(len(step_times)-1)
             for device_address in linear_time_dict:
-                if time in linear_time_dict[device_address]["on_times_ns"]:
-                    instruction_set[ind][1].add(device_address)                   
+                bit = 1 << device_address
+                for time in linear_time_dict[device_address]["on_times_ns"]:
+                    if (ind := time_index.get(time)) != None:
+                        masks[ind] = masks[ind] | bit
 
+        instruction_set = [[step_times[ind+1]-step_times[ind],mask] for ind,mask in enumerate(masks)]
+        return instruction_set, step_times
 
-        if allow_subroutine:
+    def _instruction_set(self,wrapped:bool=True,numpy_engine:bool=False)->list:
+        """Converts the linear time sequence into a flat list of instructions
 
-            def finding_maximum_sequence(seq):
-                max_len = int(len(seq) / 2)
-                for x in range(2, max_len):
-                    if str(seq[0:x]) == str(seq[x:2*x]) :
-                        return x,seq[0:x]
+        Returns:
+            list[list]: [duration_ns, set of device addresses that are on] for every instruction
+        """
+        instruction_set, _ = self._instruction_masks(wrapped=wrapped,numpy_engine=numpy_engine)
+        return [[duration,mask_to_addresses(mask)] for duration,mask in instruction_set]
 
-                return 1, []
-    
-            # Enters loop
+    def instruction_tree(self,wrapped:bool=True,maximum_loop_depth:int=8,maximum_loop_repetitions:int=None,numpy_engine:bool=False,use_cache:bool=True)->list:
+        """Compresses the instructions into loops that can be nested inside of each other. This is needed for sequences like
+        (XY8)^N inside of a signal and reference that would otherwise be written out as thousands of instructions. Every loop
+        starts and ends on a plain instruction because an instruction can only start or end a single loop
+
+        Args:
+            wrapped (bool, optional): If the delays before the start are wrapped around to the end of the sequence. Defaults to True.
+            maximum_loop_depth (int, optional): How many loops can be nested inside of each other. Defaults to 8.
+            maximum_loop_repetitions (int, optional): The largest count of a single loop. Defaults to None which is unlimited.
+            numpy_engine (bool, optional): Uses the array backed linear time engine. Defaults to False.
+            use_cache (bool, optional): Returns a copy of the result of an earlier compile of the same sequence and options. 
+            Defaults to True.
+
+        Returns:
+            list: [duration_ns, device mask] for plain instructions and InstructionLoop for loops in the order they are run
+        """
+        return self.compile(wrapped=wrapped,maximum_loop_depth=maximum_loop_depth,maximum_loop_repetitions=maximum_loop_repetitions,
+                            optimize_instructions=False,numpy_engine=numpy_engine,use_cache=use_cache).instructions
+
+    def compile(self,wrapped:bool=True,maximum_loop_depth:int=8,maximum_loop_repetitions:int=None,clock_period_ns:float=None,
+                optimize_instructions:bool=True,numpy_engine:bool=False,use_cache:bool=True,minimum_duration_ns:float=None,
+                maximum_edge_shift_ns:float=0)->SequenceIr:
+        """Compiles the sequence into the intermediate representation a pulse generator writes its program from. The optimization 
+        passes drop zero length steps, merge neighboring instructions with the same output and round to the clock before the 
+        instructions are compressed into loops, see sequence_ir
+
+        Args:
+            wrapped (bool, optional): If the delays before the start are wrapped around to the end of the sequence. Defaults to True.
+            maximum_loop_depth (int, optional): How many loops can be nested inside of each other. Defaults to 8.
+            maximum_loop_repetitions (int, optional): The largest count of a single loop. Defaults to None which is unlimited.
+            clock_period_ns (float, optional): Rounds every duration to the clock period and tracks the rounding error. Defaults to None.
+            optimize_instructions (bool, optional): Runs the optimization passes. Defaults to True.
+            numpy_engine (bool, optional): Uses the array backed linear time engine. Defaults to False.
+            use_cache (bool, optional): Returns a copy of the result of an earlier compile of the same sequence and options. 
+            Defaults to True.
+            minimum_duration_ns (float, optional): Instructions shorter than this are fixed by moving edges after the loops are found. 
+            Defaults to None which allows any length.
+            maximum_edge_shift_ns (float, optional): Largest time an edge can be moved to fix a short instruction, a larger fix raises 
+            a ValueError. Defaults to 0 which raises on any short instruction.
+
+        Returns:
+            SequenceIr: the compiled instructions, the rounding error and the largest edge shift
+        """
+        if use_cache:
+            key = ("compile",self._structure_key(),wrapped,maximum_loop_depth,maximum_loop_repetitions,clock_period_ns,optimize_instructions,numpy_engine,
+                   minimum_duration_ns,maximum_edge_shift_ns)
+            return compiled_sequence_cache.get(key,lambda: self.compile(wrapped=wrapped,
+                                                                        maximum_loop_depth=maximum_loop_depth,
+                                                                        maximum_loop_repetitions=maximum_loop_repetitions,
+                                                                        clock_period_ns=clock_period_ns,
+                                                                        optimize_instructions=optimize_instructions,
+                                                                        numpy_engine=numpy_engine,
+                                                                        use_cache=False,
+                                                                        minimum_duration_ns=minimum_duration_ns,
+                                                                        maximum_edge_shift_ns=maximum_edge_shift_ns))
+
+        # Without any loops allowed there is nothing to compress 
+        if maximum_loop_depth < 1:
+            segments = [(self._instruction_masks(wrapped=wrapped,numpy_engine=numpy_engine)[0],1)]
+        else:
+            segments = self._instruction_segments(wrapped=wrapped,numpy_engine=numpy_engine)
+
+        line_key = lambda line: (line[0],line[1])
+
+        def compress(instruction_set:list,maximum_depth:int)->list:
+            if maximum_depth < 1:
+                return instruction_set
+
+            tokens, unique_lines = intern_tokens(instruction_set,key=line_key)
+
+            def to_instructions(nodes:list)->list:
+                instructions = []
+                for node in nodes:
+                    if type(node) == tuple:
+                        instructions.append(InstructionLoop(repetitions=node[0],body=to_instructions(node[1])))
+                    else:
+                        instructions.append(unique_lines[node])
+                return instructions
+
+            return to_instructions(build_loop_tree(tokens,maximum_depth=maximum_depth,maximum_repetitions=maximum_loop_repetitions))
+
+        instruction_tree = []
+        rounding_error_ns = 0
+        for instruction_set, repetitions in segments:
+            # The passes run on the flat instructions so equal instructions after rounding are found as loops 
+            if optimize_instructions:
+                segment_ir = optimize(SequenceIr(instructions=instruction_set),clock_period_ns=clock_period_ns)
+                instruction_set = segment_ir.instructions
+                rounding_error_ns = rounding_error_ns + segment_ir.rounding_error_ns*repetitions
+
+            if repetitions == 1:
+                instruction_tree.extend(compress(instruction_set,maximum_loop_depth))
+
+            # A single repeated instruction is the same as one instruction that is longer 
+            elif len(instruction_set) == 1:
+                instruction_tree.append([instruction_set[0][0]*repetitions,instruction_set[0][1]])
+
+            else:
+                # The first and last instruction start and end the loop so only the middle of the body can hold other loops 
+                body = [instruction_set[0]]+compress(instruction_set[1:-1],maximum_loop_depth-1)+[instruction_set[-1]]
+                while repetitions > 0:
+                    loop_repetitions = repetitions if maximum_loop_repetitions == None else min(repetitions,maximum_loop_repetitions)
+                    instruction_tree.append(InstructionLoop(repetitions=loop_repetitions,body=body))
+                    repetitions = repetitions - loop_repetitions
+
+        # Neighboring segments can end and start with the same output and short instructions are fixed once the loops are known
+        sequence_ir = SequenceIr(instructions=instruction_tree,rounding_error_ns=rounding_error_ns)
+        if optimize_instructions:
+            sequence_ir = optimize(sequence_ir)
+        if minimum_duration_ns != None:
+            sequence_ir = enforce_minimum_length(sequence_ir,minimum_duration_ns=minimum_duration_ns,maximum_edge_shift_ns=maximum_edge_shift_ns,
+                                                 clock_period_ns=clock_period_ns)
+        return sequence_ir
+
+    def instructions(self,allow_subroutine:bool = True,wrapped:bool=True,numpy_engine:bool=False,use_cache:bool=True):
+        # Repeated compiles of the same sequence are copied from the cache instead 
+        if use_cache:
+            key = ("instructions",self._structure_key(),allow_subroutine,wrapped,numpy_engine)
+            return compiled_sequence_cache.get(key,lambda: self.instructions(allow_subroutine=allow_subroutine,
+                                                                             wrapped=wrapped,
+                                                                             numpy_engine=numpy_engine,
+                                                                             use_cache=False))
+
+        if allow_subroutine:
             count = 0
             sub_routines = {}
+            sub_routine_keys = {}
             reduced_instructions = {}
-            reduced_instructions_length = 0
-            final_instruction_index = -1
-
-            for i,line in enumerate(instruction_set):
-                length, seq = finding_maximum_sequence(instruction_set[i:])
-
-                # If the length is longer than 1 we can loop it 
-                if length != 1 and i > final_instruction_index:
-                    
-                    key = None
-                    # We want to check if the sequence is in the sub_routines
-                    for sub in sub_routines:
-                        if sub_routines[sub] == seq:
-                            key = sub
-                    if key == None:
-                        key = count
-                        sub_routines[key] = seq
-                        count = count + 1
-                    
-                    # We now want to find the number of times this list is repeated 
-                    instances = 0
-                    inst = instruction_set[i:]
-
-                    for ind, _ in enumerate(inst):
-                        if str(seq) == str(inst[ind*(length):(ind+1)*(length)]):
-                            instances = instances+1
-
-                        else:
-                            break
-                    
-                    final_instruction_index = i+instances*length-1
-
-                    # Adding to the reduced instructions with the number of loops
-                    reduced_instructions[reduced_instructions_length] = (True,key,instances)
-                    
-                    # Incrementing the reduced instruction set by one 
-                    reduced_instructions_length = reduced_instructions_length + 1
-
-
-                elif length == 1 and i > final_instruction_index:
+
+            def add_sub_routine(instruction_set:list)->int:
+                # We want to check if the sequence is in the sub_routines
+                nonlocal count
+                block = tuple((line[0],line[1]) for line in instruction_set)
+                if (key := sub_routine_keys.get(block)) == None:
+                    key = count
+                    sub_routine_keys[block] = key
+                    sub_routines[key] = [[line[0],mask_to_addresses(line[1])] for line in instruction_set]
+                    count = count + 1
+                return key
+
+            for instruction_set, repetitions in self._instruction_segments(wrapped=wrapped,numpy_engine=numpy_engine):
+                # Repeated sub sequences are already known loops 
+                if repetitions > 1:
+                    if len(instruction_set) == 1:
+                        reduced_instructions[len(reduced_instructions)] = (False,[instruction_set[0][0]*repetitions,mask_to_addresses(instruction_set[0][1])],0)
+                    else:
+                        reduced_instructions[len(reduced_instructions)] = (True,add_sub_routine(instruction_set),repetitions)
+                    continue
+
+                # Equal instructions share a token so repeats are found by comparing integers instead of text
+                tokens, _ = intern_tokens(instruction_set,key=lambda line: (line[0],line[1]))
+
+                for start, length, block_repetitions in find_repeated_blocks(tokens):
+
+                    # If the length is longer than 1 we can loop it 
+                    if length != 1:
+                        # Adding to the reduced instructions with the number of loops
+                        key = add_sub_routine(instruction_set[start:start+length])
+                        reduced_instructions[len(reduced_instructions)] = (True,key,block_repetitions)
+
+                    else:
                         # If this is not the start to a loop we want to make sure to add it to the list 
-                        reduced_instructions[reduced_instructions_length] = (False,line,0)
-                    
-                        # Incrementing the reduced instruction set by one 
-                        reduced_instructions_length = reduced_instructions_length + 1
+                        reduced_instructions[len(reduced_instructions)] = (False,[instruction_set[start][0],mask_to_addresses(instruction_set[start][1])],0)
             
             instructions = reduced_instructions
         
         else:
             instructions = {}
             sub_routines = {}
-            for ind, item in enumerate(instruction_set):
+            for ind, item in enumerate(self._instruction_set(wrapped=wrapped,numpy_engine=numpy_engine)):
                 instructions[ind] = (False,item,0)
 
         return instructions,sub_routines
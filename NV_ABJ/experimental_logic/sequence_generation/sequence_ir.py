@@ -0,0 +1,292 @@
+"""Intermediate representation that sits between a Sequence and the program a pulse generator is loaded with. Instructions are
+[duration_ns, device mask] lines or InstructionLoop blocks so passes can clean up the instructions without knowing about the
+devices or the pulse generator. Every pass returns a new SequenceIr and does not modify the one it is given
+"""
+__all__ = ["InstructionLoop","SequenceIr","drop_zero_length","merge_identical_states","quantize_to_clock","enforce_minimum_length","optimize"]
+from dataclasses import dataclass, field
+
+@dataclass
+class InstructionLoop:
+    """A block of instructions that the pulse generator repeats. The body can contain other loops
+    """
+    repetitions:int # How many times the body is run must be greater than or equal to one
+    body:list # [duration_ns, device mask] instructions or InstructionLoop in the order they are run
+
+@dataclass
+class SequenceIr:
+    """Instructions of a compiled sequence and the timing error the passes have added to them
+    """
+    instructions:list = field(default_factory=list) # [duration_ns, device mask] instructions or InstructionLoop in the order they are run
+    rounding_error_ns:float = 0 # Total change in the length of the whole sequence from rounding including every repetition
+    edge_shift_ns:float = 0 # Largest time any edge was moved to make every instruction as long as the minimum
+
+    def number_of_instructions(self)->int:
+        """How many instructions the program needs with loops counted once"""
+        def count(nodes:list)->int:
+            return sum(count(node.body) if type(node) == InstructionLoop else 1 for node in nodes)
+        return count(self.instructions)
+
+    def duration_ns(self)->float:
+        """Length of the whole sequence with every repetition"""
+        def duration(nodes:list)->float:
+            return sum(node.repetitions*duration(node.body) if type(node) == InstructionLoop else node[0] for node in nodes)
+        return duration(self.instructions)
+
+def _loop_nodes(repetitions:int,body:list)->list:
+    """Returns the nodes for a loop whose body may have become shorter from a pass. A pulse generator loop needs a plain
+    instruction to start and end on so a body of a single instruction becomes one longer instruction and a body that starts
+    or ends on another loop is written out
+    """
+    if len(body) == 0:
+        return []
+    if len(body) == 1 and type(body[0]) != InstructionLoop:
+        return [[body[0][0]*repetitions,body[0][1]]]
+    if type(body[0]) == InstructionLoop or type(body[-1]) == InstructionLoop:
+        return body*repetitions
+    return [InstructionLoop(repetitions=repetitions,body=body)]
+
+def drop_zero_length(sequence_ir:SequenceIr)->SequenceIr:
+    """Removes instructions that do not take any time
+
+    Args:
+        sequence_ir (SequenceIr): instructions to clean up
+
+    Returns:
+        SequenceIr: instructions without any zero length steps
+    """
+    def drop(nodes:list)->list:
+        kept = []
+        for node in nodes:
+            if type(node) == InstructionLoop:
+                kept.extend(_loop_nodes(node.repetitions,drop(node.body)))
+            elif node[0] > 0:
+                kept.append(node)
+        return kept
+
+    return SequenceIr(instructions=drop(sequence_ir.instructions),rounding_error_ns=sequence_ir.rounding_error_ns,edge_shift_ns=sequence_ir.edge_shift_ns)
+
+def merge_identical_states(sequence_ir:SequenceIr)->SequenceIr:
+    """Combines neighboring instructions that have the same device mask into a single instruction. Instructions are never merged
+    across the start or end of a loop
+
+    Args:
+        sequence_ir (SequenceIr): instructions to clean up
+
+    Returns:
+        SequenceIr: instructions where no two neighboring plain instructions have the same output
+    """
+    def merge(nodes:list)->list:
+        merged = []
+        for node in nodes:
+            if type(node) == InstructionLoop:
+                loop_nodes = _loop_nodes(node.repetitions,merge(node.body))
+            else:
+                loop_nodes = [node]
+
+            for loop_node in loop_nodes:
+                if (type(loop_node) != InstructionLoop and len(merged) > 0 and type(merged[-1]) != InstructionLoop
+                    and merged[-1][1] == loop_node[1]):
+                    merged[-1] = [merged[-1][0]+loop_node[0],loop_node[1]]
+                else:
+                    merged.append(loop_node)
+        return merged
+
+    return SequenceIr(instructions=merge(sequence_ir.instructions),rounding_error_ns=sequence_ir.rounding_error_ns,edge_shift_ns=sequence_ir.edge_shift_ns)
+
+def quantize_to_clock(sequence_ir:SequenceIr,clock_period_ns:float)->SequenceIr:
+    """Rounds every duration to a whole number of clock periods. An instruction is never rounded down to zero so a loop keeps
+    the instructions it starts and ends on. The change in length of the sequence is added to the rounding error
+
+    Args:
+        sequence_ir (SequenceIr): instructions to round
+        clock_period_ns (float): period of the pulse generator clock, 2 ns at 500 MHz
+
+    Returns:
+        SequenceIr: instructions with durations that are multiples of the clock period
+    """
+    if clock_period_ns <= 0:
+        raise ValueError(f"The clock period must be greater than zero you entered:{clock_period_ns}")
+
+    rounding_error_ns = sequence_ir.rounding_error_ns
+
+    def quantize(nodes:list,repetitions:int)->list:
+        nonlocal rounding_error_ns
+        quantized = []
+        for node in nodes:
+            if type(node) == InstructionLoop:
+                quantized.append(InstructionLoop(repetitions=node.repetitions,body=quantize(node.body,repetitions*node.repetitions)))
+                continue
+
+            clock_cycles = max(round(node[0]/clock_period_ns),1)
+            duration_ns = clock_cycles*clock_period_ns
+            # Whole numbers are kept as integers so they are written the same way as integer durations
+            if float(duration_ns).is_integer():
+                duration_ns = int(duration_ns)
+
+            rounding_error_ns = rounding_error_ns + (duration_ns-node[0])*repetitions
+            quantized.append([duration_ns,node[1]])
+        return quantized
+
+    instructions = quantize(sequence_ir.instructions,1)
+    return SequenceIr(instructions=instructions,rounding_error_ns=rounding_error_ns,edge_shift_ns=sequence_ir.edge_shift_ns)
+
+def enforce_minimum_length(sequence_ir:SequenceIr,minimum_duration_ns:float,maximum_edge_shift_ns:float=0,clock_period_ns:float=None)->SequenceIr:
+    """Makes every instruction at least as long as the minimum a pulse generator can run. A short instruction borrows the missing
+    time from the instructions around it by moving the edges between them, every edge is moved as little as it can be and never by
+    more than the maximum edge shift. No instruction is removed so every change of the output is kept and the length of the sequence 
+    does not change. The edges at the start and end of the sequence and of every loop body stay in place, when a short instruction 
+    can not be fixed next to a loop one pass of the loop is written out so its edges can move too. The largest edge that was moved 
+    is added to the edge shift
+
+    Args:
+        sequence_ir (SequenceIr): instructions to fix
+        minimum_duration_ns (float): shortest instruction of the pulse generator, six clock cycles for a pulse blaster
+        maximum_edge_shift_ns (float, optional): Largest time an edge can be moved. Defaults to 0 which raises on any short instruction.
+        clock_period_ns (float, optional): The edges are only moved by whole clock periods. Defaults to None which moves them by any time.
+
+    Raises:
+        ValueError: An instruction can not be fixed without moving an edge by more than the maximum edge shift
+
+    Returns:
+        SequenceIr: instructions where every instruction is at least the minimum duration
+    """
+    if minimum_duration_ns <= 0:
+        raise ValueError(f"The minimum duration must be greater than zero you entered:{minimum_duration_ns}")
+    if maximum_edge_shift_ns < 0:
+        raise ValueError(f"The maximum edge shift must be greater than or equal to zero you entered:{maximum_edge_shift_ns}")
+    if clock_period_ns != None:
+        maximum_edge_shift_ns = int(maximum_edge_shift_ns/clock_period_ns+1e-9)*clock_period_ns
+
+    # Whole numbers are kept as integers so they are written the same way as the rounded durations
+    if float(minimum_duration_ns).is_integer():
+        minimum_duration_ns = int(minimum_duration_ns)
+    if float(maximum_edge_shift_ns).is_integer():
+        maximum_edge_shift_ns = int(maximum_edge_shift_ns)
+
+    edge_shift_ns = sequence_ir.edge_shift_ns
+    moved_ns = 0 # Largest edge moved by this pass
+    # Allowance for the floating point error of durations that are not whole numbers
+    tolerance_ns = 1e-9
+
+    def copy_nodes(nodes:list)->list:
+        # Plain instructions can be shared between loop bodies and passes so they are copied before they are changed
+        return [node if type(node) == InstructionLoop else [node[0],node[1]] for node in nodes]
+
+    def is_plain(nodes:list,ind:int)->bool:
+        return 0 <= ind < len(nodes) and type(nodes[ind]) != InstructionLoop
+
+    def remaining_passes(loop:InstructionLoop)->list:
+        # The nodes of a loop after one of its passes is written out
+        if loop.repetitions > 2:
+            return copy_nodes(_loop_nodes(loop.repetitions-1,loop.body))
+        return copy_nodes(loop.body)*(loop.repetitions-1)
+
+    def fixed_run(run:list)->tuple:
+        """Moves the edges inside a run of plain instructions whose first and last edge stay in place. The earliest and latest time 
+        of every edge are found from both ends and each edge is then put as close to where it was as those allow
+
+        Returns:
+            tuple[list,float]: the fixed instructions and the largest edge shift or None when the run can not be fixed
+        """
+        edges_ns = [0]
+        for duration_ns, _ in run:
+            edges_ns.append(edges_ns[-1]+duration_ns)
+        last = len(run)
+
+        earliest_ns = [0]*(last+1)
+        for ind in range(1,last+1):
+            earliest_ns[ind] = max(edges_ns[ind] if ind == last else edges_ns[ind]-maximum_edge_shift_ns,earliest_ns[ind-1]+minimum_duration_ns)
+        latest_ns = [edges_ns[last]]*(last+1)
+        for ind in range(last-1,-1,-1):
+            latest_ns[ind] = min(edges_ns[ind] if ind == 0 else edges_ns[ind]+maximum_edge_shift_ns,latest_ns[ind+1]-minimum_duration_ns)
+
+        if any(earliest_ns[ind] > latest_ns[ind]+tolerance_ns for ind in range(last+1)):
+            return None
+
+        moved_edges_ns = [0]
+        for ind in range(1,last):
+            moved_edges_ns.append(max(min(max(edges_ns[ind],earliest_ns[ind]),latest_ns[ind]),moved_edges_ns[-1]+minimum_duration_ns))
+        moved_edges_ns.append(edges_ns[last])
+
+        fixed = [[moved_edges_ns[ind+1]-moved_edges_ns[ind],run[ind][1]] for ind in range(last)]
+        return fixed, max(abs(moved-edge) for moved, edge in zip(moved_edges_ns,edges_ns))
+
+    def enforce(nodes:list)->list:
+        nonlocal moved_ns
+
+        # The loop bodies are fixed last so a written out pass is moved from where its edges were and the shifts do not add up
+        nodes = copy_nodes(nodes)
+
+        def run_bounds(ind:int)->tuple:
+            # The start and end of the run of plain instructions around an index
+            start = ind
+            while is_plain(nodes,start-1):
+                start = start - 1
+            end = ind
+            while is_plain(nodes,end):
+                end = end + 1
+            return start, end
+
+        ind = 0
+        while ind < len(nodes):
+            if not is_plain(nodes,ind):
+                ind = ind + 1
+                continue
+
+            start, end = run_bounds(ind)
+            if all(node[0] >= minimum_duration_ns-tolerance_ns for node in nodes[start:end]):
+                ind = end
+                continue
+
+            result = fixed_run(nodes[start:end])
+            if result == None and (start > 0 or end < len(nodes)):
+                # A pass of each loop next to the run is written out so the edges inside those passes can move as well
+                before = remaining_passes(nodes[start-1])+copy_nodes(nodes[start-1].body) if start > 0 else []
+                after = copy_nodes(nodes[end].body)+remaining_passes(nodes[end]) if end < len(nodes) else []
+                run = nodes[start:end]
+                nodes[max(start-1,0):end+1] = before+run+after
+                start, end = run_bounds(max(start-1,0)+len(before))
+                result = fixed_run(nodes[start:end])
+
+            if result == None:
+                short_ns = min(node[0] for node in nodes[start:end])
+                raise ValueError(f"An instruction of {short_ns} ns is shorter than the minimum of {minimum_duration_ns} ns and can not be fixed "
+                                 f"without moving an edge by more than {maximum_edge_shift_ns} ns")
+
+            run, shift_ns = result
+            nodes[start:end] = run
+            moved_ns = max(moved_ns,shift_ns)
+            ind = start+len(run)
+
+        fixed = []
+        for node in nodes:
+            if type(node) == InstructionLoop:
+                fixed.extend(copy_nodes(_loop_nodes(node.repetitions,enforce(node.body))))
+            else:
+                fixed.append(node)
+        return fixed
+
+    instructions = enforce(sequence_ir.instructions)
+    return SequenceIr(instructions=instructions,rounding_error_ns=sequence_ir.rounding_error_ns,edge_shift_ns=max(edge_shift_ns,moved_ns))
+
+def optimize(sequence_ir:SequenceIr,clock_period_ns:float=None,minimum_duration_ns:float=None,maximum_edge_shift_ns:float=0)->SequenceIr:
+    """Runs the standard passes. Zero length steps are dropped, neighboring instructions with the same output are merged,
+    the durations are rounded to the clock when a clock period is given and instructions shorter than the minimum duration are
+    fixed when a minimum is given. Merging first means a split step is only rounded once
+
+    Args:
+        sequence_ir (SequenceIr): instructions to clean up
+        clock_period_ns (float, optional): period of the pulse generator clock. Defaults to None which does not round.
+        minimum_duration_ns (float, optional): shortest instruction of the pulse generator. Defaults to None which allows any length.
+        maximum_edge_shift_ns (float, optional): Largest time an edge can be moved to fix a short instruction. Defaults to 0 which raises on any short instruction.
+
+    Returns:
+        SequenceIr: the optimized instructions
+    """
+    sequence_ir = merge_identical_states(drop_zero_length(sequence_ir))
+    if clock_period_ns != None:
+        sequence_ir = quantize_to_clock(sequence_ir,clock_period_ns=clock_period_ns)
+    if minimum_duration_ns != None:
+        sequence_ir = enforce_minimum_length(sequence_ir,minimum_duration_ns=minimum_duration_ns,maximum_edge_shift_ns=maximum_edge_shift_ns,
+                                             clock_period_ns=clock_period_ns)
+    return sequence_ir
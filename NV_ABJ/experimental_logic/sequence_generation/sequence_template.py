@@ -0,0 +1,122 @@
+"""Sweeps like a Rabi measurement build the same sequence many times where only one or two durations change. The times of every
+edge in a sequence are a sum of the step durations minus the device delays so they are affine in the swept values. As long as the
+order of the edges does not change the instructions keep the same device masks and only their durations move along a straight
+line. A template compiles the sequence once at a reference point and once for each swept value to find those lines and every
+other sweep point is then a single array expression. The points are SequenceIr that a pulse generator writes its program from,
+like SpbiclPulseBlaster.generate_compiled
+"""
+__all__ = ["SequenceTemplate"]
+import numpy as np
+
+from NV_ABJ.experimental_logic.sequence_generation.sequence_generation import Sequence, SequenceIr
+
+class SequenceTemplate:
+
+    def __init__(self,generate_sequence,wrapped:bool=True,numpy_engine:bool=False,**fixed_parameters):
+        """Template of a sequence where some of the parameters of generate_sequence are swept
+
+        Args:
+            generate_sequence (callable): Function that returns a Sequence from keyword arguments like RabiIq().generate_sequence.
+            It must only change durations with the swept values and not add or remove steps
+            wrapped (bool, optional): If the delays before the start are wrapped around to the end of the sequence. Defaults to True.
+            numpy_engine (bool, optional): Uses the array backed linear time engine for the compiles. Defaults to False.
+            **fixed_parameters: keyword arguments of generate_sequence that are the same for every sweep point
+        """
+        self.generate_sequence = generate_sequence
+        self.wrapped = wrapped
+        self.numpy_engine = numpy_engine
+        self.fixed_parameters = fixed_parameters
+
+        # The duration slots for each set of swept parameter names
+        self.duration_slots = {}
+        self.compiled_points = 0 # How many sweep points needed a full compile
+
+    def compile_point(self,**sweep_parameters)->list:
+        """Compiles a single sweep point fully
+
+        Returns:
+            list[list]: [duration_ns, device mask] for every instruction
+        """
+        self.compiled_points = self.compiled_points + 1
+        sequence:Sequence = self.generate_sequence(**self.fixed_parameters,**sweep_parameters)
+        return sequence.instruction_tree(wrapped=self.wrapped,maximum_loop_depth=0,numpy_engine=self.numpy_engine)
+
+    def _compile_slots(self,sweep_values:dict):
+        """Finds the reference durations and how much each duration changes per unit of each swept parameter
+
+        Returns:
+            tuple: (reference values, reference durations, dictionary of duration slopes, masks) or None when the instructions change
+            between the compiled points
+        """
+        # The middle of the sweep is used as the reference because the ends are often special like a tau of zero 
+        reference_index = len(next(iter(sweep_values.values())))//2
+        reference_values = {name:values[reference_index].item() for name,values in sweep_values.items()}
+        reference_instructions = self.compile_point(**reference_values)
+        reference_durations = np.array([instruction[0] for instruction in reference_instructions],dtype=np.float64)
+        masks = [instruction[1] for instruction in reference_instructions]
+
+        duration_slopes = {}
+        for name,values in sweep_values.items():
+            # The slope is measured with the closest point that has a different value
+            if len(changed := np.flatnonzero(values != values[reference_index])) == 0:
+                duration_slopes[name] = np.zeros(len(reference_durations))
+                continue
+
+            step_value = values[changed[np.argmin(np.abs(changed-reference_index))]].item()
+            try:
+                step_instructions = self.compile_point(**(reference_values | {name:step_value}))
+            except ValueError:
+                return None
+
+            if [instruction[1] for instruction in step_instructions] != masks:
+                return None
+
+            step_durations = np.array([instruction[0] for instruction in step_instructions],dtype=np.float64)
+            duration_slopes[name] = (step_durations-reference_durations)/(step_value-reference_values[name])
+
+        return reference_values, reference_durations, duration_slopes, masks
+
+    def bind(self,**sweep_values)->list:
+        """Gets the instructions for every sweep point. Points where the order of the edges would change are compiled fully. The 
+        points are not rounded to a clock, a pulse generator does that when it writes the program of a point
+
+            points = RabiIq().sequence_template(**fixed_parameters).bind(tau_time_s=taus)
+            pulse_blaster.load(pulse_blaster.generate_compiled(points[0]))
+
+        Args:
+            **sweep_values: keyword arguments of generate_sequence with a list or array of values, every list must have the same length
+
+        Returns:
+            list[SequenceIr]: the [duration_ns, device mask] instructions of every sweep point, every point has its own lists
+        """
+        sweep_values = {name:np.atleast_1d(np.asarray(values,dtype=np.float64)) for name,values in sweep_values.items()}
+        number_of_points = {len(values) for values in sweep_values.values()}
+        if len(number_of_points) != 1:
+            raise ValueError(f"Every swept parameter must have the same number of points you entered:{number_of_points}")
+        number_of_points = number_of_points.pop()
+
+        names = tuple(sorted(sweep_values))
+        if names not in self.duration_slots:
+            self.duration_slots[names] = self._compile_slots(sweep_values)
+        slots = self.duration_slots[names]
+
+        if slots != None:
+            reference_values, reference_durations, duration_slopes, masks = slots
+            durations = np.tile(reference_durations,(number_of_points,1))
+            for name,values in sweep_values.items():
+                durations += np.outer(values-reference_values[name],duration_slopes[name])
+
+            # A duration that is no longer positive means edges have crossed so the instructions are different
+            valid_points = np.all(durations > 0,axis=1)
+        else:
+            valid_points = np.zeros(number_of_points,dtype=bool)
+
+        points = []
+        for ind in range(number_of_points):
+            if valid_points[ind]:
+                instructions = [[duration,mask] for duration,mask in zip(durations[ind].tolist(),masks)]
+            else:
+                instructions = self.compile_point(**{name:values[ind].item() for name,values in sweep_values.items()})
+            points.append(SequenceIr(instructions=instructions))
+
+        return points
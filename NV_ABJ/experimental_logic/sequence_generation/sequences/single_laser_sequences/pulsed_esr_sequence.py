@@ -2,6 +2,7 @@ import numpy.typing as npt
 import numpy as np
 
 from NV_ABJ.abstract_interfaces.measurement_sequence import MeasurementSequence
+from NV_ABJ.abstract_interfaces.photon_counter import ReadoutGateMap
 from NV_ABJ.experimental_logic.sequence_generation.sequence_generation import *
 from NV_ABJ.abstract_interfaces.microwave_source import MicrowaveSource
 from NV_ABJ.abstract_interfaces.pulse_generator import PulseGenerator
@@ -42,8 +43,16 @@ class PulsedESR(MeasurementSequence):
             rf_source.prime_sinusoidal_rf(frequency_list_hz=frequency_list_hz, rf_amplitude_dbm=rf_amplitude_dbm)
             rf_source.iterate_next_waveform()
     
+    def readout_gate_map(self)->ReadoutGateMap:
+        """The signal readout is followed by the reference readout and each has a trigger at its start and end"""
+        return ReadoutGateMap.paired(["signal","reference"])
+
     def counts_to_raw_counts(self, counts:tuple, *args, **kwargs)->tuple[npt.NDArray,npt.NDArray]:
         """Pulsed ESR Seq every bin is the same iteration so this is simply where we just get the counts even minus odd indexes. It then separates the dark and signal"""
+        # Counts from ReadoutGateMap.demultiplex already have a column for the signal and the reference
+        if np.ndim(counts) == 2:
+            return counts[:,0],counts[:,1]
+
         signal = np.array(counts[::2])
         reference = np.array(counts[1::2])
 
@@ -3,16 +3,20 @@ __all__ = ["NiPhotonCounterDaqControlled"]
 # Numpy is used for array allocation and fast math operations here
 import numpy as np
 from numpy.typing import NDArray
+from collections import OrderedDict
+import queue
 
 # National instruments daq imports 
 import nidaqmx
-from nidaqmx.constants import CountDirection, Edge, AcquisitionType, TaskMode,TriggerType, READ_ALL_AVAILABLE
+from nidaqmx.constants import CountDirection, Edge, AcquisitionType, TaskMode,TriggerType
+from nidaqmx.stream_readers import CounterReader
 
 # importing abstract class
-from NV_ABJ.abstract_interfaces.photon_counter import PhotonCounter
+from NV_ABJ.abstract_interfaces.photon_counter import PhotonCounter, ReadoutGateMap
 class NiPhotonCounterDaqControlled(PhotonCounter):
 
-    def __init__(self,device_name:str,counter_pfi:str,trigger_pfi:str,ctr:str = "ctr0",port:str  = "port0",number_of_clock_cycles:int = 2,timeout_waiting_for_data_s:int = 60):
+    def __init__(self,device_name:str,counter_pfi:str,trigger_pfi:str,ctr:str = "ctr0",port:str  = "port0",number_of_clock_cycles:int = 2,timeout_waiting_for_data_s:int = 60,
+                 maximum_cached_dwell_times:int = 4):
         """This class is an implementation for a national instruments daq to count the number of photons that we are receiving during an experiment 
         It requires you to define the device name, counter, and the trigger. This works on the premise that the photon counter outputs a digital signal high every time a 
         photon is acquired such that this class can count the digital highs and return them as the photons received 
@@ -25,8 +29,14 @@ class NiPhotonCounterDaqControlled(PhotonCounter):
             port (str, optional): This is a digital internal port for counting cycles. If you have multiple counters running simultaneously on the same device you may need to change this to an available "port#". Defaults to "port0".
             number_of_clock_cycles (int, optional): This is the number of clock cycles when sampling data. We need at least two cycles. Defaults to 2.
             timeout_waiting_for_data (float, optional): This is how long the daq will wait for a trigger in this case the trigger is internal and will be activated once loaded. Defaults to 60.
+            maximum_cached_dwell_times (int, optional): How many dwell times keep their configured tasks so switching back to one does not create the tasks again. The tasks of every dwell time use the same counter and port so only the current ones are committed, the others are unreserved and committed again when they are switched to. Defaults to 4.
 
+        Raises:
+            ValueError: The tasks of at least the current dwell time have to be kept so the number of cached dwell times must be at least one
         """
+        if maximum_cached_dwell_times < 1:
+            raise ValueError(f"The number of cached dwell times must be at least one you entered:{maximum_cached_dwell_times}")
+
         self.device_name = device_name
         self.counter_pfi = counter_pfi
         self.trigger_pfi = trigger_pfi
@@ -35,7 +45,7 @@ class NiPhotonCounterDaqControlled(PhotonCounter):
         self.port = port
         self.number_of_clock_cycles = number_of_clock_cycles
         self.timeout_waiting_for_data_s = timeout_waiting_for_data_s
-
+        self.maximum_cached_dwell_times = maximum_cached_dwell_times
 
     def get_counts_raw(self,dwell_time_s:float) -> int:
         """get_counts_raw nominally you can call it simply with 
@@ -65,52 +75,86 @@ class NiPhotonCounterDaqControlled(PhotonCounter):
         # Opens if not preloaded or if the dwell time changes 
         if self._load_self_triggered or self._dwell_time_s != dwell_time_s:
 
-            #If the task is already open we want to close the previous one so we can update it
-            if self.samp_clk_task != None:
-                try:
-                    self.samp_clk_task.close()
-                except:
-                    pass
-                self.samp_clk_task = None
-
-            if self.read_task != None:
-                try:
-                    self.read_task.close()
-                except:
-                    pass
-                self.read_task = None
-
-            # Creating tasks to run
-            self.read_task = nidaqmx.Task() 
-            self.samp_clk_task =  nidaqmx.Task()
+            # The previous tasks give up the counter and port so the tasks of this dwell time can be committed
+            self._release_self_triggered_tasks()
+
+            if dwell_time_s in self._task_pool:
+                # The tasks of a recent dwell time are already configured so they only have to be committed again
+                self._task_pool.move_to_end(dwell_time_s)
+                self.samp_clk_task, self.read_task = self._task_pool[dwell_time_s]
+            else:
+                # The least recently used dwell times are closed before the new tasks are added so the new tasks are never closed
+                while self._task_pool and len(self._task_pool) >= self.maximum_cached_dwell_times:
+                    _, evicted_tasks = self._task_pool.popitem(last=False)
+                    for task in evicted_tasks:
+                        try:
+                            task.close()
+                        except:
+                            pass
+
+                self.samp_clk_task, self.read_task = self._configured_tasks(dwell_time_s)
+                self._task_pool[dwell_time_s] = (self.samp_clk_task,self.read_task)
+
+            # Saves task to device 
+            self.samp_clk_task.control(TaskMode.TASK_COMMIT)
+            self.read_task.control(TaskMode.TASK_COMMIT)
+
+            self._load_self_triggered = False
+            self._dwell_time_s = dwell_time_s
+
+        # Starting the timing task and the reading tasks
+        self.samp_clk_task.start()
+        self.read_task.start()
+    
+        # Getting the amount of counts for all cycles, the last sample is the count at the end of the dwell time
+        samples = self._sample_buffer(self.number_of_clock_cycles)
+        CounterReader(self.read_task.in_stream).read_many_sample_uint32(samples,number_of_samples_per_channel=self.number_of_clock_cycles,
+                                                                        timeout=self.timeout_waiting_for_data_s)
+        edge_counts = int(samples[-1])
+        self.read_task.wait_until_done()
+
+        self.read_task.stop()
+        self.samp_clk_task.stop()
 
+        # Returning the final number of counts 
+        return edge_counts       
+
+    def _configured_tasks(self,dwell_time_s:float)->tuple:
+        """Creates the sample clock and read tasks of get_counts_raw for a dwell time without committing them
+
+        Returns:
+            tuple[nidaqmx.Task,nidaqmx.Task]: the sample clock task and the read task
+        """
+        # Creating tasks to run
+        read_task = nidaqmx.Task() 
+        samp_clk_task =  nidaqmx.Task()
+
+        try:
             # Creating a digital channel that will set the sampling speed for the taken data
             # This is the task that determines how long we sample for so if we have a rate of 100 Hz and take 10 samples
             # The time spent collect photons is 0.1 seconds 
-            self.samp_clk_task.di_channels.add_di_chan(f"{self.device_name}/{self.port}")
+            samp_clk_task.di_channels.add_di_chan(f"{self.device_name}/{self.port}")
 
             # Determining the maximum sample rate linked to the clock frequency
-            self.max_sampling_rate = self.samp_clk_task.timing.samp_clk_max_rate
-        
+            self.max_sampling_rate = samp_clk_task.timing.samp_clk_max_rate
+    
             # Default triggering steps
-            self.samp_clk_task.triggers.start_trigger.trig_type = TriggerType.DIGITAL_EDGE
-            self.samp_clk_task.triggers.start_trigger.dig_edge_edge = Edge.RISING
-            
-
+            samp_clk_task.triggers.start_trigger.trig_type = TriggerType.DIGITAL_EDGE
+            samp_clk_task.triggers.start_trigger.dig_edge_edge = Edge.RISING
 
             # This is connecting a counter to the reading data task 
-            self.read_task.ci_channels.add_ci_count_edges_chan(f"{self.device_name}/{self.ctr}",
+            read_task.ci_channels.add_ci_count_edges_chan(f"{self.device_name}/{self.ctr}",
                                                         edge=Edge.RISING,
                                                         initial_count=0,
                                                         count_direction=CountDirection.COUNT_UP)
-            
+        
             # We want to count the edges at the pfi provided 
-            self.read_task.ci_channels.all.ci_count_edges_term = f"/{self.device_name}/{self.counter_pfi}"
-            
+            read_task.ci_channels.all.ci_count_edges_term = f"/{self.device_name}/{self.counter_pfi}"
+        
             # We want to take the number of counts at the rising edge of the clock 
-            self.read_task.triggers.arm_start_trigger.trig_type = TriggerType.DIGITAL_EDGE
-            self.read_task.triggers.arm_start_trigger.dig_edge_edge = Edge.RISING
-            self.read_task.triggers.arm_start_trigger.dig_edge_src = f"/{self.device_name}/di/SampleClock"
+            read_task.triggers.arm_start_trigger.trig_type = TriggerType.DIGITAL_EDGE
+            read_task.triggers.arm_start_trigger.dig_edge_edge = Edge.RISING
+            read_task.triggers.arm_start_trigger.dig_edge_src = f"/{self.device_name}/di/SampleClock"
 
             # finding a clock frequency multiplied the number of cycles to convert to seconds the natural time in the daq
             # The dwell time is modified by adding on cycle of clock time this is to account for a starting count and amounts to the fence post error
@@ -120,48 +164,136 @@ class NiPhotonCounterDaqControlled(PhotonCounter):
                 raise ValueError(f"The selected dwell time does not allow for {self.number_of_clock_cycles} clock cycles with a max sample rate of {self.max_sampling_rate}")
 
             # The sample clock is how we measure time it runs the task for the number of clock cycles desired at the clock frequency to get the measured time 
-            self.samp_clk_task.timing.cfg_samp_clk_timing(clock_frequency,
+            samp_clk_task.timing.cfg_samp_clk_timing(clock_frequency,
                                                     sample_mode=AcquisitionType.CONTINUOUS)
 
-            self.samp_clk_task.triggers.start_trigger.dig_edge_src = f"/{self.device_name}/{self.timebase}"
+            samp_clk_task.triggers.start_trigger.dig_edge_src = f"/{self.device_name}/{self.timebase}"
 
-            
+            # We are taking data for this amount of time based on a digital internal clock set to the clock frequency 
+            read_task.timing.cfg_samp_clk_timing(rate = clock_frequency,
+                                                source=f"/{self.device_name}/di/SampleClock",
+                                                active_edge=Edge.RISING,
+                                                sample_mode=AcquisitionType.FINITE,
+                                                samps_per_chan=self.number_of_clock_cycles)
+        except:
+            # Tasks that could not be configured are closed so they do not hold the counter
+            read_task.close()
+            samp_clk_task.close()
+            raise
 
+        return samp_clk_task, read_task
 
+    def get_counts_raw_line(self,number_of_pixels:int,dwell_time_s:float)->NDArray[np.int64]:
+        """Takes the counts of a whole line of pixels in a single buffered read. The counter is sampled by the sample clock running
+        at the dwell rate so the tasks are only started once for the line instead of once for every pixel
+        
+            line_counts = photon_counter.get_counts_raw_line(number_of_pixels,dwell_time_s)
 
-            # We are taking data for this amount of time based on a digital internal clock set to the clock frequency 
+        Args:
+            number_of_pixels (int): how many dwell times are taken one after the other
+            dwell_time_s (float): This is the amount of time in seconds that we collect photons for every pixel
+
+        Raises:
+            ValueError: The dwell time is shorter than the max sampling rate allows
+
+        Returns:
+            NDArray[np.int64]: the raw number of counts during every dwell time
+        """
+        if not self._load_ext_triggered:
+
+            if self.ext_trig_read_task != None:
+                self.ext_trig_read_task.close()
+                self.ext_trig_read_task = None
+
+            self._load_ext_triggered = True
+
+        # The line uses the same counter and port as get_counts_raw so those tasks give them up while a line is taken
+        if self._line_configuration != (number_of_pixels,dwell_time_s):
+
+            self._release_self_triggered_tasks()
+
+            self.read_task = nidaqmx.Task() 
+            self.samp_clk_task =  nidaqmx.Task()
+
+            # The sample clock ticks once every dwell time and the counter is read on every tick
+            self.samp_clk_task.di_channels.add_di_chan(f"{self.device_name}/{self.port}")
+            self.max_sampling_rate = self.samp_clk_task.timing.samp_clk_max_rate
+
+            clock_frequency = 1/dwell_time_s
+            if clock_frequency > self.max_sampling_rate:
+                raise ValueError(f"The selected dwell time is shorter than a sample with a max sample rate of {self.max_sampling_rate}")
+
+            self.samp_clk_task.triggers.start_trigger.trig_type = TriggerType.DIGITAL_EDGE
+            self.samp_clk_task.triggers.start_trigger.dig_edge_edge = Edge.RISING
+            self.samp_clk_task.timing.cfg_samp_clk_timing(clock_frequency,
+                                                    sample_mode=AcquisitionType.CONTINUOUS)
+            self.samp_clk_task.triggers.start_trigger.dig_edge_src = f"/{self.device_name}/{self.timebase}"
+
+            self.read_task.ci_channels.add_ci_count_edges_chan(f"{self.device_name}/{self.ctr}",
+                                                        edge=Edge.RISING,
+                                                        initial_count=0,
+                                                        count_direction=CountDirection.COUNT_UP)
+            self.read_task.ci_channels.all.ci_count_edges_term = f"/{self.device_name}/{self.counter_pfi}"
+            self.read_task.triggers.arm_start_trigger.trig_type = TriggerType.DIGITAL_EDGE
+            self.read_task.triggers.arm_start_trigger.dig_edge_edge = Edge.RISING
+            self.read_task.triggers.arm_start_trigger.dig_edge_src = f"/{self.device_name}/di/SampleClock"
+
+            # One more sample than pixels is taken so every pixel is the difference of two samples
             self.read_task.timing.cfg_samp_clk_timing(rate = clock_frequency,
                                                 source=f"/{self.device_name}/di/SampleClock",
                                                 active_edge=Edge.RISING,
                                                 sample_mode=AcquisitionType.FINITE,
-                                                samps_per_chan=self.number_of_clock_cycles)
+                                                samps_per_chan=number_of_pixels+1)
             
-            # Saves task to device 
             self.samp_clk_task.control(TaskMode.TASK_COMMIT)
             self.read_task.control(TaskMode.TASK_COMMIT)
 
             self._load_self_triggered = False
-            self._dwell_time_s = dwell_time_s
- 
-
-
+            self._line_configuration = (number_of_pixels,dwell_time_s)
 
-        # Setting the default amount of counts to 0 
-        edge_counts = 0
-
-        # Starting the timing task and the reading tasks
         self.samp_clk_task.start()
         self.read_task.start()
-    
-        # Getting the amount of counts for all cycles 
-        edge_counts = self.read_task.read(READ_ALL_AVAILABLE,timeout=self.timeout_waiting_for_data_s)[-1]
-        self.read_task.wait_until_done()
+
+        # The read waits for the whole line on top of the usual timeout
+        samples = self._sample_buffer(number_of_pixels+1)
+        CounterReader(self.read_task.in_stream).read_many_sample_uint32(samples,number_of_samples_per_channel=number_of_pixels+1,
+                                                                        timeout=self.timeout_waiting_for_data_s+number_of_pixels*dwell_time_s)
 
         self.read_task.stop()
         self.samp_clk_task.stop()
 
-        # Returning the final number of counts 
-        return edge_counts       
+        # The counter is unsigned 32 bit so the difference is still right when the counter rolls over
+        return np.diff(samples).astype(np.int64)
+
+    def _release_self_triggered_tasks(self):
+        """Frees the counter and port held by the sample clock and read tasks. The tasks of every dwell time and line share the 
+        counter and port so only one pair can be committed at a time. The tasks of a dwell time in the pool are unreserved with 
+        TASK_UNRESERVE, they keep their configuration and are committed again every time that dwell time is switched to which 
+        is much faster than creating them. The tasks of a line are closed
+        """
+        pooled = self._dwell_time_s in self._task_pool
+        for task in (self.read_task,self.samp_clk_task):
+            if task == None:
+                continue
+            try:
+                if pooled:
+                    task.control(TaskMode.TASK_UNRESERVE)
+                else:
+                    task.close()
+            except:
+                # A pooled task that can not be unreserved is closed and configured again the next time it is needed
+                if pooled:
+                    for pooled_task in self._task_pool.pop(self._dwell_time_s):
+                        try:
+                            pooled_task.close()
+                        except:
+                            pass
+                    pooled = False
+
+        self.read_task = None
+        self.samp_clk_task = None
+        self._dwell_time_s = None
+        self._line_configuration = None
     
     def get_counts_raw_when_triggered(self, number_of_data_taking_cycles:int, continuous_line:bool = False, double_samples = True)-> NDArray[np.int64]:
         """get_counts_raw nominally you can call it simply with 
@@ -178,17 +310,186 @@ class NiPhotonCounterDaqControlled(PhotonCounter):
         Returns:
             int: the raw number of counts that the photon counter has output 
         """
-        if not self._load_self_triggered:
-
-            if self.read_task != None:
-                self.read_task.close()
-                self.read_task = None
-                self._dwell_time_s = None
+        self._prepare_ext_triggered_task()
+        
+        if double_samples:
+            number_of_data_taking_cycles = number_of_data_taking_cycles*2
             
-            if self.samp_clk_task != None:
-                self.samp_clk_task.close()
-                self.samp_clk_task = None
+        # The samples are read straight into a reused buffer instead of a list
+        samples = self._sample_buffer(number_of_data_taking_cycles)
+        self.ext_trig_read_task.start()
+        CounterReader(self.ext_trig_read_task.in_stream).read_many_sample_uint32(samples,number_of_samples_per_channel=number_of_data_taking_cycles,
+                                                                                 timeout=self.timeout_waiting_for_data_s)
+        self.ext_trig_read_task.stop()
+
+        if not continuous_line:
+            # The difference of every pair is written over the end sample of the pair so only the returned counts are allocated
+            np.subtract(samples[1::2],samples[::2],out=samples[1::2])
+            list_counts = samples[1::2].astype(np.int64)
+        else:
+            list_counts = samples.astype(np.int64)
+
+        return list_counts
+
+    def get_counts_raw_gated(self,number_of_repetitions:int,gate_map:ReadoutGateMap)->NDArray[np.int64]:
+        """Takes the counts of every readout gate of a triggered sequence. The counter is sampled on every readout edge and the samples
+        are split into the gates of every repetition at once
+        
+            gate_map = measurement_sequence.readout_gate_map()
+            gate_counts = photon_counter.get_counts_raw_gated(number_of_repetitions,gate_map)
+            signal = gate_map.channels(gate_counts)["signal"]
+
+        Args:
+            number_of_repetitions (int): how many times the sequence is run
+            gate_map (ReadoutGateMap): how many edges every repetition has and which edges start and end every gate
+
+        Returns:
+            NDArray[np.int64]: counts with a row for every repetition and a column for every gate of the gate map
+        """
+        self._prepare_ext_triggered_task()
+
+        number_of_samples = number_of_repetitions*gate_map.edges_per_repetition
+        samples = self._sample_buffer(number_of_samples)
+        self.ext_trig_read_task.start()
+        CounterReader(self.ext_trig_read_task.in_stream).read_many_sample_uint32(samples,number_of_samples_per_channel=number_of_samples,
+                                                                                 timeout=self.timeout_waiting_for_data_s)
+        self.ext_trig_read_task.stop()
+
+        return gate_map.demultiplex(samples)
+
+    def _sample_buffer(self,number_of_samples:int)->NDArray[np.uint32]:
+        """Counter samples are read into the same buffer on every call so a read does not allocate. The buffer only grows when
+        more samples are read than ever before, the returned counts are always copied out of it
+
+        Returns:
+            NDArray[np.uint32]: the first number_of_samples of the buffer
+        """
+        if self._samples.size < number_of_samples:
+            self._samples = np.zeros(number_of_samples,dtype=np.uint32)
+        return self._samples[:number_of_samples]
+
+    def get_counts_raw_when_triggered_stream(self,number_of_data_taking_cycles:int,cycles_per_chunk:int = 10000,continuous_line:bool = False,
+                                             double_samples = True,number_of_buffered_chunks:int = 8,consumer = None,gate_map:ReadoutGateMap = None):
+        """Streams the counts of get_counts_raw_when_triggered in chunks so long runs can be summed while the data is taken. The driver
+        reads every chunk into a preallocated ring buffer as soon as it is acquired so the memory does not grow with the number of cycles
+        
+            summed_counts = 0
+            for counts in photon_counter.get_counts_raw_when_triggered_stream(number_of_data_taking_cycles):
+                summed_counts = summed_counts + counts.sum()
+
+        Args:
+            number_of_data_taking_cycles (int): This is the number of cycles when samples will be taken
+            cycles_per_chunk (int, optional): How many cycles are in every chunk. Defaults to 10000.
+            continuous_line (bool, optional): Defaults to False. This is false if you want the counts between two points and true if you want the counts at every trigger
+            double_samples (bool, optional): Every cycle has two triggers. Defaults to True.
+            number_of_buffered_chunks (int, optional): How many chunks the ring buffer holds before the chunks are used. Defaults to 8.
+            consumer (callable, optional): Called with the counts of every chunk until all cycles are taken. Defaults to None which returns the chunks instead.
+            gate_map (ReadoutGateMap, optional): Every cycle is a repetition of the gate map and every chunk is split into its gates like 
+            get_counts_raw_gated. Defaults to None which uses continuous_line and double_samples.
+
+        Raises:
+            ValueError: The counts between two points need an even number of samples in every chunk and in total
+            BufferError: The chunks are not used before the ring buffer is full
+            TimeoutError: A chunk is not acquired within the timeout waiting for data
 
+        Returns:
+            Generator[NDArray[np.int64]]: the counts of every chunk in order when no consumer is given. The acquisition starts when the 
+            first chunk is asked for and is stopped when the generator finishes or is closed
+        """
+        if gate_map != None:
+            samples_per_cycle = gate_map.edges_per_repetition
+        else:
+            samples_per_cycle = 2 if double_samples else 1
+        samples_per_chunk = cycles_per_chunk*samples_per_cycle
+        number_of_full_chunks, remaining_samples = divmod(number_of_data_taking_cycles*samples_per_cycle,samples_per_chunk)
+
+        # Every pair of samples has to be in the same chunk for the counts between two points
+        if gate_map == None and not continuous_line and (samples_per_chunk % 2 != 0 or remaining_samples % 2 != 0):
+            raise ValueError(f"The counts between two points need an even number of samples in every chunk and in total you entered "
+                             f"{samples_per_chunk} samples per chunk and {number_of_data_taking_cycles*samples_per_cycle} samples")
+
+        self._prepare_ext_triggered_task()
+
+        # The counter values are unsigned 32 bit so a difference is still right when the counter rolls over
+        ring_buffer = np.zeros((number_of_buffered_chunks,samples_per_chunk),dtype=np.uint32)
+        reader = CounterReader(self.ext_trig_read_task.in_stream)
+        # Ring buffer slots that are filled or an error from the driver thread
+        filled_slots = queue.Queue()
+        chunks_read = 0
+        chunks_used = 0
+
+        def chunk_acquired(task_handle,every_n_samples_event_type,number_of_samples,callback_data)->int:
+            # This runs on a thread of the driver every time another chunk of samples is in the buffer of the daq
+            nonlocal chunks_read
+            if chunks_read >= number_of_full_chunks:
+                return 0
+            if chunks_read-chunks_used >= number_of_buffered_chunks:
+                filled_slots.put(BufferError(f"The chunks were not used before the {number_of_buffered_chunks} buffered chunks were full"))
+                chunks_read = number_of_full_chunks
+                return 0
+
+            try:
+                reader.read_many_sample_uint32(ring_buffer[chunks_read % number_of_buffered_chunks],
+                                               number_of_samples_per_channel=samples_per_chunk,timeout=0)
+            except Exception as error:
+                filled_slots.put(error)
+                chunks_read = number_of_full_chunks
+                return 0
+
+            filled_slots.put(chunks_read % number_of_buffered_chunks)
+            chunks_read = chunks_read + 1
+            return 0
+
+        def chunk_counts(samples:NDArray[np.uint32])->NDArray[np.int64]:
+            if gate_map != None:
+                return gate_map.demultiplex(samples)
+            if not continuous_line:
+                return (samples[1::2]-samples[::2]).astype(np.int64)
+            return samples.astype(np.int64)
+
+        def chunks():
+            nonlocal chunks_used
+            # The callback can only be registered while the task is stopped
+            self.ext_trig_read_task.register_every_n_samples_acquired_into_buffer_event(samples_per_chunk,chunk_acquired)
+            try:
+                self.ext_trig_read_task.start()
+                for _ in range(number_of_full_chunks):
+                    try:
+                        slot = filled_slots.get(timeout=self.timeout_waiting_for_data_s)
+                    except queue.Empty:
+                        raise TimeoutError(f"No data was taken for {self.timeout_waiting_for_data_s} s")
+                    if isinstance(slot,Exception):
+                        raise slot
+
+                    # The counts are a new array so the slot can be filled again as soon as they are found
+                    counts = chunk_counts(ring_buffer[slot])
+                    chunks_used = chunks_used + 1
+                    yield counts
+
+                # The last samples do not fill a chunk so they are read directly once every full chunk is used
+                if remaining_samples > 0:
+                    reader.read_many_sample_uint32(ring_buffer[0,:remaining_samples],number_of_samples_per_channel=remaining_samples,
+                                                   timeout=self.timeout_waiting_for_data_s)
+                    yield chunk_counts(ring_buffer[0,:remaining_samples])
+            finally:
+                self.ext_trig_read_task.stop()
+                self.ext_trig_read_task.register_every_n_samples_acquired_into_buffer_event(samples_per_chunk,None)
+
+        if consumer == None:
+            return chunks()
+
+        # The chunks are closed even if the consumer fails so the task is always stopped
+        streamed_chunks = chunks()
+        try:
+            for counts in streamed_chunks:
+                consumer(counts)
+        finally:
+            streamed_chunks.close()
+
+    def _prepare_ext_triggered_task(self):
+        """Frees the counter from the sample clock tasks and creates the task that samples the counter on every trigger if it is not loaded"""
+        if not self._load_self_triggered:
+            self._release_self_triggered_tasks()
             self._load_self_triggered = True
 
         if self._load_ext_triggered:
@@ -208,20 +509,6 @@ class NiPhotonCounterDaqControlled(PhotonCounter):
             channel.ci_count_edges_term = f"/{self.device_name}/{self.counter_pfi}"
             self.ext_trig_read_task.control(TaskMode.TASK_COMMIT)
             self._load_ext_triggered = False
-        
-        if double_samples:
-            number_of_data_taking_cycles = number_of_data_taking_cycles*2
-            
-        self.ext_trig_read_task.start()
-        edge_counts = self.ext_trig_read_task.read(number_of_samples_per_channel=number_of_data_taking_cycles,timeout=self.timeout_waiting_for_data_s)
-        self.ext_trig_read_task.stop()
-
-        if not continuous_line:
-            list_counts = np.array(edge_counts[1::2])-np.array(edge_counts[::2])
-        else:
-            list_counts = edge_counts
-
-        return list_counts
 
     
     def make_connection(self):
@@ -249,6 +536,9 @@ class NiPhotonCounterDaqControlled(PhotonCounter):
         self.read_task = None
         self.ext_trig_read_task = None
         self._dwell_time_s = None
+        self._line_configuration = None # (number of pixels, dwell time s) the tasks are set up for when they take a line
+        self._task_pool = OrderedDict() # dwell time s: (sample clock task, read task) of the most recently used dwell times, only the current ones are committed
+        self._samples = np.zeros(0,dtype=np.uint32) # Reused buffer the counter samples are read into
 
 
     def close_connection(self):
@@ -257,13 +547,14 @@ class NiPhotonCounterDaqControlled(PhotonCounter):
         self._load_self_triggered = True
         self._load_ext_triggered = True
 
-        if self.read_task != None:
-            self.read_task.close()
-            self.read_task = None
-        
-        if self.samp_clk_task != None:
-            self.samp_clk_task.close()
-            self.samp_clk_task = None
+        self._release_self_triggered_tasks()
+
+        # The configured tasks of every dwell time are closed
+        for pooled_tasks in self._task_pool.values():
+            for task in pooled_tasks:
+                task.close()
+        self._task_pool.clear()
+        self._samples = np.zeros(0,dtype=np.uint32)
         
         if self.ext_trig_read_task != None:
             self.ext_trig_read_task.close()
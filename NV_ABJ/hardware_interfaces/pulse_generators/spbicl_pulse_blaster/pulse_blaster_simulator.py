@@ -0,0 +1,267 @@
+"""Runs pulse blaster programs in the text format of SpbiclPulseBlaster.generate_sequence without a board. A program is parsed into
+instructions and executed with the loop counters of the board so the compiled timing can be checked against the sequence it came
+from. The iterate functions are generators so a program with a loop of a million repetitions is never expanded in memory and the
+period is found from the program without running it at all
+"""
+__all__ = ["PulseBlasterInstruction","SimulatedProgram","parse_program","program_period_ns","iterate_program","iterate_state_changes",
+           "simulate_program","sequence_timeline"]
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from NV_ABJ.experimental_logic.sequence_generation.sequence_generation import Sequence
+
+# Nanoseconds in each duration unit of the program text
+_DURATION_UNITS_NS = {"ns":1,"us":1e3,"ms":1e6,"s":1e9}
+# Flow control opcodes that are understood, wait is run as continue because there is no trigger
+_OPCODES = {"continue","loop","end_loop","branch","long_delay","stop","wait"}
+
+@dataclass
+class PulseBlasterInstruction:
+    """A single instruction of a pulse blaster program"""
+    output_mask:int # Bit n is set when the port at address n is high, the fixed high bits of the word are removed
+    duration_ns:float # How long the instruction lasts, a long_delay lasts this times its data
+    opcode:str = "continue" # flow control of the instruction
+    data:object = None # loop or long_delay count or the label that end_loop and branch go to
+    label:str = None
+
+@dataclass
+class SimulatedProgram:
+    """Output of every port of a program over one period"""
+    period_ns:float
+    channel_edges:dict = field(default_factory=dict) # address: (rising edge times ns, falling edge times ns) of every port that is ever high
+
+    def matches(self,other,tolerance_ns:float=0)->bool:
+        """If both have the same period and the same edges on every port within the tolerance
+
+        Args:
+            other (SimulatedProgram): timeline to compare against like the one from sequence_timeline
+            tolerance_ns (float, optional): Largest difference of any time. Defaults to 0.
+        """
+        if abs(self.period_ns-other.period_ns) > tolerance_ns or self.channel_edges.keys() != other.channel_edges.keys():
+            return False
+
+        for address, (rising_ns, falling_ns) in self.channel_edges.items():
+            other_rising_ns, other_falling_ns = other.channel_edges[address]
+            if len(rising_ns) != len(other_rising_ns) or len(falling_ns) != len(other_falling_ns):
+                return False
+            if np.any(np.abs(rising_ns-other_rising_ns) > tolerance_ns) or np.any(np.abs(falling_ns-other_falling_ns) > tolerance_ns):
+                return False
+        return True
+
+def parse_program(program_text:str)->list:
+    """Parses the text of a program into instructions
+
+    Args:
+        program_text (str): program in the format of SpbiclPulseBlaster.generate_sequence
+
+    Raises:
+        ValueError: A line can not be parsed
+
+    Returns:
+        list[PulseBlasterInstruction]: the instructions in the order they are programmed
+    """
+    instructions = []
+    for line in program_text.splitlines():
+        if line.strip() == "":
+            continue
+
+        label = None
+        if ":" in line.split(",")[0]:
+            label, line = line.split(":",1)
+            label = label.strip()
+
+        parts = [part.strip() for part in line.split(",")]
+        if len(parts) < 2 or not parts[0].startswith("0b"):
+            raise ValueError(f"Could not parse the program line:{line}")
+
+        word = parts[0][2:].replace(" ","")
+        output_mask = int(word,2) & ((1 << (len(word)-3))-1)
+
+        duration, unit = parts[1].split()
+        if unit not in _DURATION_UNITS_NS:
+            raise ValueError(f"The duration unit must be one of {list(_DURATION_UNITS_NS)} you entered:{unit}")
+        duration_ns = float(duration)*_DURATION_UNITS_NS[unit]
+
+        opcode = parts[2].lower() if len(parts) > 2 else "continue"
+        if opcode not in _OPCODES:
+            raise ValueError(f"The opcode must be one of {sorted(_OPCODES)} you entered:{opcode}")
+        data = None
+        if len(parts) > 3:
+            data = int(parts[3]) if opcode in ("loop","long_delay") else parts[3]
+
+        instructions.append(PulseBlasterInstruction(output_mask=output_mask,duration_ns=duration_ns,opcode=opcode,data=data,label=label))
+    return instructions
+
+def _instructions(program)->list:
+    return parse_program(program) if type(program) == str else program
+
+def _label_addresses(instructions:list)->dict:
+    label_addresses = {}
+    for ind, instruction in enumerate(instructions):
+        if instruction.label != None:
+            label_addresses.setdefault(instruction.label,ind)
+    return label_addresses
+
+def program_period_ns(program)->float:
+    """Length of one period of a program found from the loop counts without running the loops
+
+    Args:
+        program (str or list[PulseBlasterInstruction]): program text or parsed instructions
+
+    Returns:
+        float: time from the first instruction until the program branches back to the start or stops
+    """
+    instructions = _instructions(program)
+
+    # Each open loop keeps its count and the length of its body so far
+    loop_stack = [[1,0]]
+    for instruction in instructions:
+        if instruction.opcode == "loop":
+            loop_stack.append([instruction.data,0])
+
+        loop_stack[-1][1] = loop_stack[-1][1] + instruction.duration_ns*(instruction.data if instruction.opcode == "long_delay" else 1)
+
+        if instruction.opcode == "end_loop":
+            repetitions, body_duration_ns = loop_stack.pop()
+            loop_stack[-1][1] = loop_stack[-1][1] + repetitions*body_duration_ns
+        elif instruction.opcode in ("branch","stop"):
+            break
+
+    if len(loop_stack) != 1:
+        raise ValueError("The program has a loop that is not ended")
+    return loop_stack[0][1]
+
+def iterate_program(program):
+    """Runs a program for one period one instruction at a time
+
+    Args:
+        program (str or list[PulseBlasterInstruction]): program text or parsed instructions
+
+    Raises:
+        ValueError: The program does not end with a branch to the first instruction or a stop
+
+    Yields:
+        tuple[float,float,int]: start time ns, duration ns and output mask of every instruction that is run
+    """
+    instructions = _instructions(program)
+    label_addresses = _label_addresses(instructions)
+
+    time_ns = 0
+    address = 0
+    # Each open loop keeps the address of its loop instruction and how many passes are left
+    loop_stack = []
+    while address < len(instructions):
+        instruction = instructions[address]
+
+        if instruction.opcode == "loop" and not (loop_stack and loop_stack[-1][0] == address):
+            loop_stack.append([address,instruction.data])
+
+        duration_ns = instruction.duration_ns*(instruction.data if instruction.opcode == "long_delay" else 1)
+        yield time_ns, duration_ns, instruction.output_mask
+        time_ns = time_ns + duration_ns
+
+        if instruction.opcode == "end_loop":
+            if len(loop_stack) == 0 or loop_stack[-1][0] != label_addresses.get(instruction.data):
+                raise ValueError(f"The end_loop at instruction {address} does not end the innermost loop")
+            loop_stack[-1][1] = loop_stack[-1][1] - 1
+            if loop_stack[-1][1] > 0:
+                address = loop_stack[-1][0]
+                continue
+            loop_stack.pop()
+
+        elif instruction.opcode == "branch":
+            if label_addresses.get(instruction.data) != 0:
+                raise ValueError(f"Only a branch back to the first instruction can be simulated, instruction {address} branches to:{instruction.data}")
+            return
+
+        elif instruction.opcode == "stop":
+            return
+
+        address = address + 1
+
+    raise ValueError("The program ran past its last instruction without a branch or stop")
+
+def iterate_state_changes(program):
+    """Runs a program for one period and only yields when the output changes
+
+    Args:
+        program (str or list[PulseBlasterInstruction]): program text or parsed instructions
+
+    Yields:
+        tuple[float,int]: time ns and the output mask from that time on, the first is always at time zero
+    """
+    previous_mask = None
+    for time_ns, _, output_mask in iterate_program(program):
+        if output_mask != previous_mask:
+            yield time_ns, output_mask
+            previous_mask = output_mask
+
+def _timeline(change_times_ns:list,change_masks:list,period_ns:float)->SimulatedProgram:
+    """Converts the output changes of one period into the edges of every port. The output is periodic so a port that is high at
+    the start and at the end of the period does not have an edge at time zero
+    """
+    change_times_ns = np.array(change_times_ns,dtype=np.float64)
+    change_masks = np.array(change_masks,dtype=np.uint64)
+
+    channel_edges = {}
+    all_ports = int(np.bitwise_or.reduce(change_masks)) if len(change_masks) > 0 else 0
+    address = 0
+    while all_ports >> address:
+        if (all_ports >> address) & 1:
+            levels = ((change_masks >> np.uint64(address)) & np.uint64(1)).astype(bool)
+            previous_levels = np.roll(levels,1)
+            channel_edges[address] = (change_times_ns[levels & ~previous_levels],change_times_ns[~levels & previous_levels])
+        address = address + 1
+
+    return SimulatedProgram(period_ns=period_ns,channel_edges=channel_edges)
+
+def simulate_program(program)->SimulatedProgram:
+    """Runs a program for one period and finds the edges of every port. Only the changes of the output are kept in memory
+
+    Args:
+        program (str or list[PulseBlasterInstruction]): program text or parsed instructions
+
+    Returns:
+        SimulatedProgram: the period and the edges of every port
+    """
+    instructions = _instructions(program)
+
+    change_times_ns = []
+    change_masks = []
+    for time_ns, output_mask in iterate_state_changes(instructions):
+        change_times_ns.append(time_ns)
+        change_masks.append(output_mask)
+
+    return _timeline(change_times_ns,change_masks,period_ns=program_period_ns(instructions))
+
+def sequence_timeline(sequence:Sequence,wrapped:bool=True)->SimulatedProgram:
+    """The edges of every port that a sequence should produce from Sequence.linear_time_sequence so a compiled program can be checked
+    with simulate_program(...).matches(sequence_timeline(...))
+
+    Args:
+        sequence (Sequence): the sequence the program was generated from including any controlled devices
+        wrapped (bool, optional): If the delays before the start are wrapped around to the end of the sequence. Defaults to True.
+
+    Returns:
+        SimulatedProgram: the period and the edges of every port
+    """
+    sequence_devices, step_times_ns = sequence.linear_time_sequence(wrapped=wrapped)
+    step_times_ns = sorted(step_times_ns)
+    time_index = {time_ns:ind for ind,time_ns in enumerate(step_times_ns[:-1])}
+
+    # The on times are the step times the output is high at with inverted outputs already applied
+    masks = [0]*(len(step_times_ns)-1)
+    for address, sequence_device in sequence_devices.items():
+        for time_ns in sequence_device["on_times_ns"]:
+            if (ind := time_index.get(time_ns)) != None:
+                masks[ind] = masks[ind] | (1 << address)
+
+    change_times_ns = []
+    change_masks = []
+    for ind, mask in enumerate(masks):
+        if ind == 0 or mask != masks[ind-1]:
+            change_times_ns.append(step_times_ns[ind]-step_times_ns[0])
+            change_masks.append(mask)
+
+    return _timeline(change_times_ns,change_masks,period_ns=step_times_ns[-1]-step_times_ns[0])
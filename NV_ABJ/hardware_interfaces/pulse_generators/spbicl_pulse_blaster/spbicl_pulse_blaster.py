@@ -1,61 +1,83 @@
 import subprocess
+import hashlib
 from tempfile import TemporaryDirectory
+import warnings
 from os.path import join
-import multiprocessing
-import time
+from dataclasses import dataclass
+import numpy as np
 # Importing abstract class and units 
 from NV_ABJ import PulseGenerator,seconds
 
 # Importing sequence 
-from NV_ABJ.experimental_logic.sequence_generation.sequence_generation import Sequence, SequenceDevice
-
+from NV_ABJ.experimental_logic.sequence_generation.sequence_generation import Sequence, SequenceDevice, InstructionLoop, SequenceIr, mask_to_addresses
+from NV_ABJ.experimental_logic.sequence_generation.sequence_ir import optimize
+
+# Program that holds the outputs constant, the output word is the only thing that changes
+_STATIC_PROGRAM_TEMPLATE = ("Start: 0b{address_line}, 500 ms\n"
+                            "       0b{address_line}, 500 ms, branch, Start\n")
+
+@dataclass
+class _TriggerWait:
+    """Instruction of a playlist that holds the outputs until the pulse blaster is triggered"""
+    duration_ns:float
+    device_mask:int
+
+def _peel_loops(instructions:list,first:bool=False,last:bool=True)->list:
+    """Writes out one pass of a loop at the start or end of the instructions so they start or end on a plain instruction. A loop
+    instruction can not also start an outer loop, end an outer loop or branch. The body of a loop always starts and ends on a plain
+    instruction so a single pass is enough
+
+    Returns:
+        list: a new list of the instructions, the given list is not changed
+    """
+    def remaining_passes(loop:InstructionLoop)->list:
+        if loop.repetitions > 2:
+            return [InstructionLoop(repetitions=loop.repetitions-1,body=loop.body)]
+        return list(loop.body)*(loop.repetitions-1)
+
+    instructions = list(instructions)
+    if last and len(instructions) > 0 and type(instructions[-1]) == InstructionLoop:
+        last_loop = instructions.pop()
+        instructions = instructions + remaining_passes(last_loop) + list(last_loop.body)
+    if first and len(instructions) > 0 and type(instructions[0]) == InstructionLoop:
+        first_loop = instructions[0]
+        instructions = list(first_loop.body) + remaining_passes(first_loop) + instructions[1:]
+    return instructions
 
 class SpbiclPulseBlaster(PulseGenerator):
-    def __init__(self,spbicl_path:str=None,controlled_devices:list=None,clock_frequency_megahertz:int=500, maximum_step_time_s:float = 5,available_ports:int=23):
+    def __init__(self,spbicl_path:str=None,controlled_devices:list=None,clock_frequency_megahertz:int=500, maximum_step_time_s:float = 5,available_ports:int=23,
+                 maximum_loop_depth:int=8,maximum_loop_repetitions:int=1048576,minimum_instruction_cycles:int=6,maximum_edge_shift_ns:float=0):
         """This class interfaces with the pulse blaster using the command line interpreter provided by 
         SpinCore as an exe "spbicl.exe" 
 
         Args:
             spbicl_path (str, optional): path to the spbicl.exe program. When set to None you must have the spbicl in your enviroment variables 
             clock_frequency_megahertz (float, optional): What the pulse blaster will be set to. Defaults to 500.
-            maximum_step_time_s (float, optional): This is the maximum time a step can take if it is longer it will be broken into n steps 
+            maximum_step_time_s (float, optional): This is the maximum time a single instruction can take, longer steps are written as a long_delay of maximum length instructions 
             available_ports (int, optional): How many bits the pulse blaster can control. Defaults to 23
+            maximum_loop_depth (int, optional): How many loops can be nested inside of each other on the board. Defaults to 8
+            maximum_loop_repetitions (int, optional): The largest count of a loop which is a 20 bit counter on the board. Defaults to 1048576
+            minimum_instruction_cycles (int, optional): Clock cycles of the shortest instruction the board can run. Defaults to 6
+            maximum_edge_shift_ns (float, optional): Largest time an edge can be moved to make a short instruction as long as the minimum, 
+            a sequence that needs a larger shift raises a ValueError and a smaller shift gives a warning. Defaults to 0 which raises on 
+            any instruction shorter than the minimum so the pulse lengths are never changed without asking
         """
         self.spbicl_path = spbicl_path
         self.clock_frequency_megahertz = clock_frequency_megahertz
         self.maximum_step_time_s = maximum_step_time_s
         self.available_ports = available_ports
+        self.maximum_loop_depth = maximum_loop_depth
+        self.maximum_loop_repetitions = maximum_loop_repetitions
         self.controlled_devices = controlled_devices
+        self.minimum_instruction_cycles = minimum_instruction_cycles
+        self.maximum_edge_shift_ns = maximum_edge_shift_ns
+        self.rounding_error_ns = 0 # How much rounding to the clock changed the length of the last generated sequence
+        self.edge_shift_ns = 0 # Largest time an edge was moved to make every instruction of the last generated sequence long enough
         self._locked_commands = False
     
-    def _start_asynchronous_worker(self,delayed_s:float):
-        # Wait for a time
-        print("Waiting Time")
-        time.sleep(delayed_s)
-
-        # Call start function
-        self.start()
-        print("Starting Function")
-
-
-
-    def start_asynchronous(self, delayed_s:float)->None:
-        """ This function calls the start function after the specified amount of time
-        This is used so that the timing of the first pulse can start after the counters are loaded.
-        This allows for the timing of the devices to not be inhibited for determining when the first pulse 
-        was performed. N
-
-        Needed for non-uniform pulses a.k.a. pulses with multiple different readouts 
-        
-        Args:
-            delayed_s(float): How long the function will wait before starting the pulse blaster
-        """
-        start_async = multiprocessing.Process(target=self._start_asynchronous_worker, args=(delayed_s,))
-        start_async.start()
-
     def make_connection(self):
-        # This is handled by spbicl.exe
-        pass
+        # This is handled by spbicl.exe but the board may have been programmed since the last connection
+        self.invalidate_loaded_program()
     def close_connection(self):
         # This is handled by spbicl.exe
         pass
@@ -66,7 +88,9 @@ class SpbiclPulseBlaster(PulseGenerator):
         spin core file format 
 
         Args:
-            sequence(str): string formatted in the style of a sequence file. Loading a empty string will clear the pulse blaster
+            sequence(str): string formatted in the style of a sequence file. Loading a empty string will clear the pulse blaster. 
+            An iterable of lines like generate_sequence_lines is written straight to the file without building the whole text. 
+            If the same program is already on the pulse blaster it is not loaded again
 
         example of sequence:
         
@@ -76,13 +100,31 @@ class SpbiclPulseBlaster(PulseGenerator):
         Returns:
             int: This is zero that indicates correct loading and -1 if it failed to load to the device other errors may have different numbers
         """  
+        # The program is the same when the text and clock frequency are the same
+        fingerprint = hashlib.sha256(f"{self.clock_frequency_megahertz}\n".encode())
+        if type(sequence) == str:
+            fingerprint.update(sequence.encode())
+            if fingerprint.hexdigest() == self._loaded_fingerprint:
+                return 0
+
         # Creates a temporary directory 
         with TemporaryDirectory(prefix="pulse_sequence_") as temp_directory:
             sequence_file_path = join(temp_directory,"__temporary_pulse_blaster_loading_sequence__.pb")
 
             # writing the pulse sequence into the directory it has to close before we can use the file in the SpinCore CLI
             with open(sequence_file_path,"w") as file:
-                file.write(sequence)
+                if type(sequence) == str:
+                    file.write(sequence)
+                else:
+                    # Streamed lines are only known once they are written so only the load command is skipped
+                    for line in sequence:
+                        file.write(line)
+                        fingerprint.update(line.encode())
+
+            if fingerprint.hexdigest() == self._loaded_fingerprint:
+                return 0
+            # If the load fails it is not known what is on the board
+            self._loaded_fingerprint = None
 
             # Running the load command for spincore cli
             command = f"spbicl load {str(sequence_file_path)} {str(self.clock_frequency_megahertz)}"
@@ -99,6 +141,8 @@ class SpbiclPulseBlaster(PulseGenerator):
         elif response == 4294967295:
             raise ValueError("Incorrect formatting in file or command structure")
         else:
+            if response == 0:
+                self._loaded_fingerprint = fingerprint.hexdigest()
             return response
         
     def start(self)->int:
@@ -163,6 +207,8 @@ class SpbiclPulseBlaster(PulseGenerator):
         empty_sequence = "label: 0b0000 0000 0000 0000 0000 0000, 500 ms, branch, label"
 
         if not self._locked_commands:
+            # Clearing always reaches the board even if the empty sequence is thought to be loaded
+            self.invalidate_loaded_program()
             response = self.load(sequence=empty_sequence)
             return response   
         
@@ -170,7 +216,8 @@ class SpbiclPulseBlaster(PulseGenerator):
             raise Warning("To clear sequence you must stop the sequence")
 
     def update_devices(self, devices:list)->int:
-        """Takes a list of sequence controlled devices and creates a sequence loads it into the pulse blaster and starts it 
+        """Takes a list of sequence controlled devices and holds their outputs on or off. The states are converted straight into a 
+        single output word that is loaded with the static output program so no sequence is compiled
 
         Args:
             devices (list): This is a list of sequence controlled devices 
@@ -180,155 +227,357 @@ class SpbiclPulseBlaster(PulseGenerator):
             measurement 
 
         Returns:
-            int: _description_
+            int: This is zero that indicates correct starting
         """
         if not self._locked_commands:
-            seq = Sequence()
-            # Uses a default timing of 1 this will be replaces later but prevents the duration error 
-            devices_on = []
-            for dev in devices:
-                seq.devices.add(dev.config)
-                if dev.device_status:
-                    devices_on.append(dev)
-
-            seq.add_step(devices=devices_on, duration_ns=1e9)
-
-            if self.controlled_devices != None:
-                seq.add_devices(self.controlled_devices)
-
-            seq_text = self.generate_sequence(seq)
-            # If no devices are on we want to clear the output
-            if len(devices_on) == 0:
-                self.clear()
-
-            self.load(sequence=seq_text)
+            self.load(sequence=self.static_sequence(self.static_output_mask(devices)))
             response = self.start()
             return response
 
         else:
             raise Warning("To update devices you must stop the sequence")
 
-    
+    def static_output_mask(self,devices:list)->int:
+        """The device mask that holds every device in its state. An inverted output is high when its device is off and the 
+        controlled devices that are not given are off
+
+        Args:
+            devices (list): sequence controlled devices where device_status is True for the devices that are on
+
+        Returns:
+            int: the device mask, see addresses_to_mask
+        """
+        device_states = {dev.config:dev.device_status for dev in devices}
+        if self.controlled_devices != None:
+            for dev in self.controlled_devices:
+                device_states.setdefault(dev.config,False)
+
+        device_mask = 0
+        for config, device_status in device_states.items():
+            # Devices without an address are not connected to the pulse blaster
+            if config.address != None and device_status != config.inverted_output:
+                device_mask = device_mask | (1 << config.address)
+        return device_mask
+
+    def static_sequence(self,device_mask:int)->str:
+        """The static output program for a device mask which is two instructions with the same output that branch back to the start
+
+        Args:
+            device_mask (int): the devices that are high, see static_output_mask
+
+        Returns:
+            str: the program that can be loaded into the pulse blaster
+        """
+        return _STATIC_PROGRAM_TEMPLATE.format(address_line=self.masks_to_lines([device_mask])[0])
+
+    def masks_to_lines(self,device_masks:list)->list:
+        """Converts device masks into the binary output words of the pulse blaster. The three highest bits are always set and 
+        the rest of the word is one bit for every port with the port at address 0 as the last bit. Every distinct mask is 
+        converted once with array operations
+
+        Args:
+            device_masks (list[int]): masks where bit n is set when the device at address n is on, see addresses_to_mask
+
+        Raises:
+            ValueError: A device address is outside of the ports of the pulse blaster
+
+        Returns:
+            list[str]: the output word of every mask without the 0b prefix
+        """
+        number_of_ports = self.available_ports-2
+        unique_masks = list(dict.fromkeys(device_masks))
+
+        outside_addresses = set()
+        for device_mask in unique_masks:
+            outside_addresses.update(mask_to_addresses(device_mask >> number_of_ports))
+        if outside_addresses:
+            outside_addresses = sorted(address+number_of_ports for address in outside_addresses)
+            raise ValueError(f"The device addresses must be from 0 to {number_of_ports-1} you entered:{outside_addresses}")
+
+        # Every row is the ascii digits of a word, the fixed bits followed by the ports from the highest address to address 0
+        shifts = np.arange(number_of_ports-1,-1,-1,dtype=np.uint64)
+        port_bits = (np.array(unique_masks,dtype=np.uint64)[:,None] >> shifts) & np.uint64(1)
+        digits = np.empty((len(unique_masks),number_of_ports+3),dtype=np.uint8)
+        digits[:,:3] = ord("1")
+        digits[:,3:] = port_bits.astype(np.uint8)+ord("0")
+        unique_lines = [word.decode() for word in digits.view(f"S{number_of_ports+3}").ravel().tolist()]
+
+        lines_by_mask = dict(zip(unique_masks,unique_lines))
+        return [lines_by_mask[device_mask] for device_mask in device_masks]
+
     def generate_sequence(self,sequence_class:Sequence,wrapped=True,allow_subroutine=True)->str:
         """This function takes the sequence class and converts it into a format that can be interpreted by the pulse blaster 
 
         Args:
             sequence_class (Sequence): A sequence of the devices and times you wish to add
+            wrapped (bool, optional): If the delays before the start are wrapped around to the end of the sequence. Defaults to True.
+            allow_subroutine (bool, optional): Writes repeated instructions as loops that can be nested up to maximum_loop_depth. Defaults to True.
 
         Returns:
             str: This returns a string that can be used to load the sequence into the pulse blaster 
             This command is going to commonly be followed by load(sequence) they are kept separate because load 
             is a more general function and you may want to generate sequences and save them without 
         """       
-        sequence_text = ""
-        
-        # If the user has defined all controlled devices and would like to have the pulse blaster control for inverted ports
-        if self.controlled_devices != None:
-            sequence_class.add_devices(self.controlled_devices)
+        return "".join(self.generate_sequence_lines(sequence_class=sequence_class,wrapped=wrapped,allow_subroutine=allow_subroutine))
 
-        # Gets a linear time sequence from the sequence generation class
-        instructions, sub_routines = sequence_class.instructions(wrapped=wrapped,allow_subroutine=allow_subroutine)
+    def generate_sequence_lines(self,sequence_class:Sequence,wrapped=True,allow_subroutine=True):
+        """Yields the lines of the program one at a time so long programs are written in linear time. The lines can be given 
+        straight to load which writes them to the program file
 
-        sequence_length = len(instructions)-1
+        Args:
+            sequence_class (Sequence): A sequence of the devices and times you wish to add
+            wrapped (bool, optional): If the delays before the start are wrapped around to the end of the sequence. Defaults to True.
+            allow_subroutine (bool, optional): Writes repeated instructions as loops that can be nested up to maximum_loop_depth. Defaults to True.
 
-        def addresses_to_line(device_addresses:list):
-            binary = 0
-            for dev_add in device_addresses:
-                binary = binary + pow(10,dev_add)              
+        Yields:
+            str: a line of the program ending in a new line
+        """
+        program_instructions = self.program_instructions(sequence_class=sequence_class,wrapped=wrapped,allow_subroutine=allow_subroutine)
+        return self._program_lines(program_instructions)
 
-            address_line = str(111)+str(binary).zfill(self.available_ports-2)
-            return address_line
+    def _program_lines(self,program_instructions:list):
+        """Yields the text of every instruction, see program_instructions"""
+        address_lines = self.masks_to_lines([instruction[2] for instruction in program_instructions])
 
-        for ind, seq in enumerate(instructions):
-            
-            # Checks if it is not a sub routine requiring a more complex process
-            if not instructions[seq][0]:
-                duration_ns = instructions[seq][1][0]
-            
-                address_line = addresses_to_line(device_addresses=instructions[seq][1][1])
+        for (label, duration, _, flow_control), address_line in zip(program_instructions,address_lines):
+            starting_condition = "       " if label == None else f"{label}: "
+            end_condition = "" if flow_control == None else "".join(f", {flow_data}" for flow_data in flow_control)
+            yield f"{starting_condition}0b{address_line}, {duration} ns{end_condition}\n"
+
+    def generate_playlist(self,sequences:list,repetitions:int=1,wait_for_trigger:bool=False,wrapped=True,allow_subroutine=True,wait_duration_ns:float=100)->str:
+        """Puts the sequences of every sweep point into a single program so a whole sweep runs from one load. Each point is looped 
+        for the given repetitions and the next point starts when it finishes or, with wait_for_trigger, when the pulse blaster is 
+        triggered. After the last point the program branches back to the first point
+
+        Args:
+            sequences (list[Sequence]): the sequence of every sweep point in the order they are run
+            repetitions (int, optional): How many times each point is run before the next point. Defaults to 1.
+            wait_for_trigger (bool, optional): Waits for a trigger before every point. Defaults to False.
+            wrapped (bool, optional): If the delays before the start are wrapped around to the end of each sequence. Defaults to True.
+            allow_subroutine (bool, optional): Writes repeated instructions in each point as loops. Defaults to True.
+            wait_duration_ns (float, optional): How long the outputs are held after the trigger before the point starts. Defaults to 100.
+
+        Returns:
+            str: This returns a string that can be used to load the playlist into the pulse blaster 
+        """
+        return "".join(self._program_lines(self.playlist_instructions(sequences=sequences,repetitions=repetitions,wait_for_trigger=wait_for_trigger,
+                                                                      wrapped=wrapped,allow_subroutine=allow_subroutine,wait_duration_ns=wait_duration_ns)))
+
+    def playlist_instructions(self,sequences:list,repetitions:int=1,wait_for_trigger:bool=False,wrapped=True,allow_subroutine=True,wait_duration_ns:float=100)->list:
+        """Compiles the sequences of a playlist into the instructions of the board, see generate_playlist and program_instructions
 
+        Returns:
+            list[tuple]: (label or None, duration_ns, device mask, flow control) for every instruction
+        """
+        if len(sequences) == 0:
+            raise ValueError("A playlist must contain at least one sequence")
+        if repetitions < 1:
+            raise ValueError(f"The repetitions must be greater than or equal to one you entered:{repetitions}")
+
+        # The loop of the repetitions takes one level of the loops of the board
+        maximum_loop_depth = self.maximum_loop_depth if allow_subroutine else 0
+        if repetitions > 1:
+            if self.maximum_loop_depth < 1:
+                raise ValueError("Repeating the points of a playlist needs a maximum loop depth of at least one")
+            maximum_loop_depth = max(maximum_loop_depth-1,0)
+
+        rounding_error_ns = 0
+        edge_shift_ns = 0
+        instructions = []
+        for ind, sequence_class in enumerate(sequences):
+            if self.controlled_devices != None:
+                sequence_class.add_devices(self.controlled_devices)
+
+            sequence_ir = sequence_class.compile(wrapped=wrapped,maximum_loop_depth=maximum_loop_depth,maximum_loop_repetitions=self.maximum_loop_repetitions,
+                                                 clock_period_ns=1e3/self.clock_frequency_megahertz,minimum_duration_ns=self.minimum_duration_ns(),
+                                                 maximum_edge_shift_ns=self.maximum_edge_shift_ns)
+            rounding_error_ns = rounding_error_ns + sequence_ir.rounding_error_ns*repetitions
+            edge_shift_ns = max(edge_shift_ns,sequence_ir.edge_shift_ns)
+
+            if wait_for_trigger:
+                # Every output is off while waiting which means the inverted outputs are high
+                idle_mask = 0
+                for device in sequence_class.devices:
+                    if device.inverted_output:
+                        idle_mask = idle_mask | (1 << device.address)
+
+                # A wait can not be the first instruction of a program
                 if ind == 0:
-                    starting_condition = "Start: "  
-                else:
-                    starting_condition = "       "
+                    instructions.append([wait_duration_ns,idle_mask])
+                instructions.append(_TriggerWait(duration_ns=wait_duration_ns,device_mask=idle_mask))
+
+            if repetitions == 1:
+                instructions.extend(sequence_ir.instructions)
+                continue
+
+            # A loop has to start and end on a plain instruction and large counts are split into consecutive loops
+            body = _peel_loops(sequence_ir.instructions,first=True,last=True)
+            if len(body) == 1:
+                instructions.append([body[0][0]*repetitions,body[0][1]])
+                continue
+            remaining_repetitions = repetitions
+            while remaining_repetitions > 0:
+                loop_repetitions = min(remaining_repetitions,self.maximum_loop_repetitions)
+                instructions.extend([InstructionLoop(repetitions=loop_repetitions,body=body)] if loop_repetitions > 1 else body)
+                remaining_repetitions = remaining_repetitions - loop_repetitions
+
+        self.rounding_error_ns = rounding_error_ns
+        self._set_edge_shift(edge_shift_ns)
+        return self._program_from_nodes(_peel_loops(instructions,first=False,last=True))
+
+    def program_instructions(self,sequence_class:Sequence,wrapped=True,allow_subroutine=True)->list:
+        """Compiles the sequence into the instructions of the board in the order they are programmed. Loops are flattened into
+        loop and end_loop flow control and steps longer than the maximum step time are written as a long_delay
 
-                if ind == sequence_length:
-                    end_condition = ", branch, Start"
-                else:
-                    end_condition = ""
-
-                if sequence_length == 0:
-                    duration = self.maximum_step_time_s/seconds.ns.value
-                
-                if duration_ns > self.maximum_step_time_s/seconds.ns.value:
-                    if (remainder_duration := int(duration_ns%(self.maximum_step_time_s/seconds.ns.value))) == 0:
-                        duration = self.maximum_step_time_s/seconds.ns.value
-                        duration_ns = duration_ns - (self.maximum_step_time_s/seconds.ns.value)
-                    else:
-                        duration = remainder_duration
-                else:
-                    duration = duration_ns
-               
-                line = f"{starting_condition}0b{address_line}, {duration} ns{end_condition}\n"
-                sequence_text = sequence_text + line
+        Args:
+            sequence_class (Sequence): A sequence of the devices and times you wish to add
+            wrapped (bool, optional): If the delays before the start are wrapped around to the end of the sequence. Defaults to True.
+            allow_subroutine (bool, optional): Writes repeated instructions as loops that can be nested up to maximum_loop_depth. Defaults to True.
 
-                while duration_ns > self.maximum_step_time_s/seconds.ns.value:
-                    duration_ns = duration_ns - self.maximum_step_time_s/seconds.ns.value
-                    line = f"       0b{address_line}, {self.maximum_step_time_s/seconds.ns.value} ns\n"
-                    sequence_text = sequence_text + line
+        Returns:
+            list[tuple]: (label or None, duration_ns, device mask, flow control) for every instruction. The flow control is None to continue
+            or a tuple of the opcode and its data like ("loop", 10), ("end_loop", "Loop3"), ("branch", "Start") and ("long_delay", 12) 
+            which runs the instruction for 12 times its duration. A wait for a trigger is ("wait",) without data
+        """
+        # If the user has defined all controlled devices and would like to have the pulse blaster control for inverted ports
+        if self.controlled_devices != None:
+            sequence_class.add_devices(self.controlled_devices)
 
-            # We need to add the sub routines 
-            else:
-                sub_routine = sub_routines[instructions[seq][1]]
-                repetitions = instructions[seq][2]
-
-                sr_len = len(sub_routine)-1
-
-                for sr_ind,sr in enumerate(sub_routine):
-                    
-                    duration_ns = sr[0]
-
-                    address_line = addresses_to_line(device_addresses=sr[1])
-
-                    if ind == 0 and sr_ind == 0:
-                        starting_condition = "Start: "
-                    else:
-                        starting_condition = "       "
-
-                    if sr_ind == 0:
-                        end_condition = f", loop, {repetitions}"
-                    else:
-                        end_condition = ""
-                    
-                    if sr_ind == sr_len:
-                        end_condition = ", end_loop"
-
-                    if ind == sequence_length and sr_ind == sr_len:
-                        end_condition = end_condition + ", branch, Start"
-
-                    if sequence_length == 0:
-                        duration = self.maximum_step_time_s/seconds.ns.value
-                    
-                    if duration_ns > self.maximum_step_time_s/seconds.ns.value:
-                        if (remainder_duration := int(duration_ns%(self.maximum_step_time_s/seconds.ns.value))) == 0:
-                            duration = self.maximum_step_time_s/seconds.ns.value
-                            duration_ns = duration_ns - (self.maximum_step_time_s/seconds.ns.value)
-                        else:
-                            duration = remainder_duration
-                    else:
-                        duration = duration_ns
-
-                
-                    line = f"{starting_condition}0b{address_line}, {duration} ns{end_condition}\n"
-                    sequence_text = sequence_text + line
-
-                    while duration_ns > self.maximum_step_time_s/seconds.ns.value:
-                        duration_ns = duration_ns - self.maximum_step_time_s/seconds.ns.value
-                        line = f"       0b{address_line}, {self.maximum_step_time_s/seconds.ns.value} ns\n"
-                        sequence_text = sequence_text + line
+        # Compiles the sequence with redundant instructions removed, the durations rounded to the clock and no instruction shorter than the 
+        # board can run, without loops allowed the instructions are flat
+        sequence_ir = sequence_class.compile(wrapped=wrapped,maximum_loop_depth=self.maximum_loop_depth if allow_subroutine else 0,
+                                             maximum_loop_repetitions=self.maximum_loop_repetitions,clock_period_ns=1e3/self.clock_frequency_megahertz,
+                                             minimum_duration_ns=self.minimum_duration_ns(),maximum_edge_shift_ns=self.maximum_edge_shift_ns)
+        self.rounding_error_ns = sequence_ir.rounding_error_ns
+        self._set_edge_shift(sequence_ir.edge_shift_ns)
+
+        # The last instruction branches back to the start so it can not also be the end of a loop
+        return self._program_from_nodes(_peel_loops(sequence_ir.instructions,first=False,last=True))
+
+    def generate_compiled(self,sequence_ir:SequenceIr)->str:
+        """Writes the program of instructions that are already compiled like the points of a SequenceTemplate, see compiled_instructions
+
+        Args:
+            sequence_ir (SequenceIr): [duration_ns, device mask] instructions and loops in the order they are run
+
+        Returns:
+            str: This returns a string that can be used to load the sequence into the pulse blaster 
+        """
+        return "".join(self._program_lines(self.compiled_instructions(sequence_ir)))
 
+    def compiled_instructions(self,sequence_ir:SequenceIr)->list:
+        """Turns instructions that are already compiled into the instructions of the board. The durations are rounded to the clock and 
+        short instructions are fixed the same way as program_instructions. The masks are written as they are so the controlled 
+        devices have to be in the sequences the instructions were compiled from
+
+        Returns:
+            list[tuple]: (label or None, duration_ns, device mask, flow control) for every instruction, see program_instructions
+        """
+        sequence_ir = optimize(sequence_ir,clock_period_ns=1e3/self.clock_frequency_megahertz,minimum_duration_ns=self.minimum_duration_ns(),
+                               maximum_edge_shift_ns=self.maximum_edge_shift_ns)
+        self.rounding_error_ns = sequence_ir.rounding_error_ns
+        self._set_edge_shift(sequence_ir.edge_shift_ns)
+        return self._program_from_nodes(_peel_loops(sequence_ir.instructions,first=False,last=True))
+
+    def minimum_duration_ns(self)->float:
+        """Length of the shortest instruction the board can run"""
+        return self.minimum_instruction_cycles*1e3/self.clock_frequency_megahertz
+
+    def _set_edge_shift(self,edge_shift_ns:float):
+        """Keeps the edge shift of the last generated sequence and warns when an edge was moved, the compile can come from the cache
+        so this is checked on every generated sequence"""
+        self.edge_shift_ns = edge_shift_ns
+        if edge_shift_ns > 0:
+            warnings.warn(f"Instructions shorter than the minimum of {self.minimum_duration_ns()} ns were fixed by moving edges by up to {edge_shift_ns} ns")
+
+    def _program_from_nodes(self,instructions:list)->list:
+        """Flattens instructions that end on a plain instruction into the instructions of the board, see program_instructions
+
+        Args:
+            instructions (list): [duration_ns, device mask] instructions, InstructionLoop and _TriggerWait in the order they are run
+        """
+        # The unit conversion is only done once instead of for every instruction, the long steps are split in whole clock cycles so
+        # every part is written as an exact duration
+        clock_period_ns = 1e3/self.clock_frequency_megahertz
+        maximum_step_cycles = int(self.maximum_step_time_s/seconds.ns.value/clock_period_ns+1e-6)
+        minimum_duration_ns = self.minimum_duration_ns()
+
+        def cycles_to_ns(clock_cycles:int)->float:
+            # Whole numbers are kept as integers so they are written the same way as the rounded durations
+            duration_ns = clock_cycles*clock_period_ns
+            return int(duration_ns) if float(duration_ns).is_integer() else duration_ns
+
+        maximum_step_time_ns = cycles_to_ns(maximum_step_cycles)
+
+        # Flattening the loops into [duration_ns, device mask, label, starting flow control, ending flow control]
+        program_lines = []
+        def add_instructions(nodes:list):
+            for node in nodes:
+                if type(node) == InstructionLoop:
+                    first_line = len(program_lines)
+                    add_instructions(node.body)
+
+                    label = "Start" if first_line == 0 else f"Loop{first_line}"
+                    program_lines[first_line][2] = label
+                    program_lines[first_line][3] = ("loop",node.repetitions)
+                    program_lines[-1][4] = ("end_loop",label)
+                elif type(node) == _TriggerWait:
+                    program_lines.append([node.duration_ns,node.device_mask,None,("wait",),None])
+                else:
+                    program_lines.append([node[0],node[1],None,None,None])
+
+        add_instructions(instructions)
+        program_lines[0][2] = "Start"
+        program_lines[-1][4] = ("branch","Start")
+
+        def split_duration(duration_ns:float,plain_first:bool,plain_last:bool)->list:
+            # Steps longer than the maximum step time are broken into a remainder followed by maximum length steps. The maximum length
+            # steps are a single long_delay instruction so a long step only takes a few instructions whatever its length. A loop 
+            # start, loop end or branch can not be on a long_delay so a plain maximum length step is kept for them
+            if duration_ns <= maximum_step_time_ns:
+                return [(duration_ns,1)]
             
-        return sequence_text
+            # The durations are already rounded to the clock so this does not change the length of the step
+            number_of_maximum_steps, remainder_cycles = divmod(round(duration_ns/clock_period_ns),maximum_step_cycles)
+            parts = []
+            if remainder_cycles != 0:
+                if cycles_to_ns(remainder_cycles) < minimum_duration_ns:
+                    # A remainder shorter than the board can run is combined with a maximum length step and split into two halves
+                    first_cycles = (remainder_cycles+maximum_step_cycles)//2
+                    parts.extend([(cycles_to_ns(first_cycles),1),(cycles_to_ns(remainder_cycles+maximum_step_cycles-first_cycles),1)])
+                    number_of_maximum_steps = number_of_maximum_steps - 1
+                else:
+                    parts.append((cycles_to_ns(remainder_cycles),1))
+            elif plain_first and number_of_maximum_steps > 1:
+                parts.append((maximum_step_time_ns,1))
+                number_of_maximum_steps = number_of_maximum_steps - 1
+
+            last_parts = []
+            if plain_last and number_of_maximum_steps > 1:
+                last_parts.append((maximum_step_time_ns,1))
+                number_of_maximum_steps = number_of_maximum_steps - 1
+
+            # The long_delay count has the same 20 bit limit as a loop counter
+            while number_of_maximum_steps > 0:
+                repetitions = min(number_of_maximum_steps,self.maximum_loop_repetitions)
+                parts.append((maximum_step_time_ns,repetitions))
+                number_of_maximum_steps = number_of_maximum_steps - repetitions
+            return parts + last_parts
+
+        program_instructions = []
+        for duration_ns, device_mask, label, starting_flow, ending_flow in program_lines:
+            parts = split_duration(duration_ns,plain_first=starting_flow != None,plain_last=ending_flow != None)
+
+            for ind, (duration, repetitions) in enumerate(parts):
+                # A loop has to start on the first part of a step and any loop end or branch has to be on the last part
+                flow_controls = [flow for flow in ((starting_flow if ind == 0 else None),(ending_flow if ind == len(parts)-1 else None),
+                                                   (("long_delay",repetitions) if repetitions > 1 else None)) if flow != None]
+                if len(flow_controls) > 1:
+                    raise ValueError(f"An instruction can only have a single flow control it was given:{flow_controls}")
+
+                program_instructions.append((label if ind == 0 else None,duration,device_mask,flow_controls[0] if flow_controls else None))
+
+        return program_instructions
         
  
 
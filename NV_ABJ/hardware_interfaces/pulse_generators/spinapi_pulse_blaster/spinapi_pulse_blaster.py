@@ -0,0 +1,300 @@
+import ctypes
+import ctypes.util
+import hashlib
+import sys
+
+# Importing sequence
+from NV_ABJ.experimental_logic.sequence_generation.sequence_generation import Sequence, SequenceIr
+from NV_ABJ.hardware_interfaces.pulse_generators.spbicl_pulse_blaster.spbicl_pulse_blaster import SpbiclPulseBlaster
+
+# Opcodes of the pulse blaster instructions from the SpinAPI header spinapi.h
+SPINAPI_OPCODES = {"continue":0,"stop":1,"loop":2,"end_loop":3,"jsr":4,"rts":5,"branch":6,"long_delay":7,"wait":8}
+PULSE_PROGRAM = 0
+
+def load_spinapi(library_path:str=None):
+    """Loads the SpinAPI shared library and declares the argument types of the functions that are used
+
+    Args:
+        library_path (str, optional): path to spinapi64.dll or libspinapi.so. Defaults to None which searches the system library path
+
+    Returns:
+        ctypes.CDLL: the SpinAPI library
+    """
+    if library_path == None:
+        library_name = "spinapi64" if sys.maxsize > 2**32 and sys.platform == "win32" else "spinapi"
+        if (library_path := ctypes.util.find_library(library_name)) == None:
+            raise FileNotFoundError(f"Could not find the SpinAPI library {library_name} install SpinAPI or give the path to the library")
+
+    spinapi = ctypes.CDLL(library_path)
+    spinapi.pb_init.restype = ctypes.c_int
+    spinapi.pb_close.restype = ctypes.c_int
+    spinapi.pb_core_clock.argtypes = [ctypes.c_double]
+    spinapi.pb_core_clock.restype = None
+    spinapi.pb_start_programming.argtypes = [ctypes.c_int]
+    spinapi.pb_start_programming.restype = ctypes.c_int
+    spinapi.pb_inst_pbonly.argtypes = [ctypes.c_uint,ctypes.c_int,ctypes.c_int,ctypes.c_double]
+    spinapi.pb_inst_pbonly.restype = ctypes.c_int
+    spinapi.pb_stop_programming.restype = ctypes.c_int
+    spinapi.pb_start.restype = ctypes.c_int
+    spinapi.pb_stop.restype = ctypes.c_int
+    spinapi.pb_reset.restype = ctypes.c_int
+    spinapi.pb_get_error.restype = ctypes.c_char_p
+    return spinapi
+
+class SimulatedSpinapi:
+
+    def __init__(self):
+        """Stand in for the SpinAPI library that keeps the programmed instructions in memory so the pulse blaster can be used
+        without a board. It has the same functions and return values as the parts of the library that are used
+        """
+        self.initialized = False
+        self.running = False
+        self.clock_frequency_megahertz = None
+        self.instructions = [] # (flags, opcode, data, duration_ns) of the loaded program
+        self._programming = None
+        self._error = b""
+
+    def _fail(self,message:str)->int:
+        self._error = message.encode()
+        return -1
+
+    def pb_get_error(self)->bytes:
+        return self._error
+
+    def pb_init(self)->int:
+        self.initialized = True
+        return 0
+
+    def pb_close(self)->int:
+        self.initialized = False
+        self.running = False
+        return 0
+
+    def pb_core_clock(self,clock_frequency_megahertz:float):
+        self.clock_frequency_megahertz = clock_frequency_megahertz
+
+    def pb_start_programming(self,device:int)->int:
+        if not self.initialized:
+            return self._fail("Board is not initialized")
+        self._programming = []
+        return 0
+
+    def pb_inst_pbonly(self,flags:int,opcode:int,data:int,duration_ns:float)->int:
+        if self._programming == None:
+            return self._fail("Programming was not started")
+        if opcode not in SPINAPI_OPCODES.values():
+            return self._fail(f"Unknown opcode {opcode}")
+        self._programming.append((flags,opcode,data,duration_ns))
+        return len(self._programming)-1
+
+    def pb_stop_programming(self)->int:
+        if self._programming == None:
+            return self._fail("Programming was not started")
+        self.instructions = self._programming
+        self._programming = None
+        return 0
+
+    def pb_start(self)->int:
+        if not self.initialized:
+            return self._fail("Board is not initialized")
+        self.running = True
+        return 0
+
+    def pb_stop(self)->int:
+        self.running = False
+        return 0
+
+    def pb_reset(self)->int:
+        self.running = False
+        return 0
+
+class SpinapiPulseBlaster(SpbiclPulseBlaster):
+    def __init__(self,library_path:str=None,spinapi=None,controlled_devices:list=None,clock_frequency_megahertz:int=500,maximum_step_time_s:float=5,
+                 available_ports:int=23,maximum_loop_depth:int=8,maximum_loop_repetitions:int=1048576,minimum_instruction_cycles:int=6,
+                 maximum_edge_shift_ns:float=0):
+        """This class programs the pulse blaster through the SpinAPI shared library in the same process. Loading a sequence does not
+        start a new program or write a file so updating the devices is much faster than with SpbiclPulseBlaster. The sequences are
+        compiled the same way as SpbiclPulseBlaster
+
+        Args:
+            library_path (str, optional): path to the SpinAPI library. Defaults to None which searches the system library path
+            spinapi (optional): An already loaded library or SimulatedSpinapi to test without a board. Defaults to None which loads the library
+            from library_path when the connection is made
+            clock_frequency_megahertz (float, optional): What the pulse blaster will be set to. Defaults to 500.
+            maximum_step_time_s (float, optional): This is the maximum time a single instruction can take, longer steps are written as a long_delay of maximum length instructions
+            available_ports (int, optional): How many bits the pulse blaster can control. Defaults to 23
+            maximum_loop_depth (int, optional): How many loops can be nested inside of each other on the board. Defaults to 8
+            maximum_loop_repetitions (int, optional): The largest count of a loop which is a 20 bit counter on the board. Defaults to 1048576
+            minimum_instruction_cycles (int, optional): Clock cycles of the shortest instruction the board can run. Defaults to 6
+            maximum_edge_shift_ns (float, optional): Largest time an edge can be moved to make a short instruction as long as the minimum. 
+            Defaults to 0 which raises on any instruction shorter than the minimum
+        """
+        super().__init__(controlled_devices=controlled_devices,clock_frequency_megahertz=clock_frequency_megahertz,
+                         maximum_step_time_s=maximum_step_time_s,available_ports=available_ports,
+                         maximum_loop_depth=maximum_loop_depth,maximum_loop_repetitions=maximum_loop_repetitions,
+                         minimum_instruction_cycles=minimum_instruction_cycles,maximum_edge_shift_ns=maximum_edge_shift_ns)
+        self.library_path = library_path
+        self.spinapi = spinapi
+        self._connected = False
+
+    def _check(self,response:int,message:str)->int:
+        if response < 0:
+            raise Exception(f"{message}: {self.spinapi.pb_get_error().decode()}")
+        return response
+
+    def make_connection(self):
+        if self.spinapi == None:
+            self.spinapi = load_spinapi(self.library_path)
+        # The board may have been programmed since the last connection
+        self.invalidate_loaded_program()
+        self._check(self.spinapi.pb_init(),"Failed to connect to pulse blaster")
+        self.spinapi.pb_core_clock(float(self.clock_frequency_megahertz))
+        self._connected = True
+
+    def close_connection(self):
+        if self._connected:
+            self._check(self.spinapi.pb_close(),"Failed to close pulse blaster")
+            self.invalidate_loaded_program()
+            self._connected = False
+            self._locked_commands = False
+
+    def generate_sequence(self,sequence_class:Sequence,wrapped=True,allow_subroutine=True)->list:
+        """This function takes the sequence class and converts it into the instructions that are programmed into the pulse blaster
+
+        Args:
+            sequence_class (Sequence): A sequence of the devices and times you wish to add
+            wrapped (bool, optional): If the delays before the start are wrapped around to the end of the sequence. Defaults to True.
+            allow_subroutine (bool, optional): Writes repeated instructions as loops that can be nested up to maximum_loop_depth. Defaults to True.
+
+        Returns:
+            list[tuple]: (flags, opcode, data, duration_ns) for every instruction which is the arguments of pb_inst_pbonly.
+            The data of end_loop and branch is the index of the instruction they go to
+        """
+        program_instructions = self.program_instructions(sequence_class=sequence_class,wrapped=wrapped,allow_subroutine=allow_subroutine)
+        return self._spinapi_instructions(program_instructions)
+
+    def generate_playlist(self,sequences:list,repetitions:int=1,wait_for_trigger:bool=False,wrapped=True,allow_subroutine=True,wait_duration_ns:float=100)->list:
+        """Puts the sequences of every sweep point into a single program so a whole sweep runs from one load, see 
+        SpbiclPulseBlaster.generate_playlist
+
+        Returns:
+            list[tuple]: (flags, opcode, data, duration_ns) for every instruction which is the arguments of pb_inst_pbonly
+        """
+        return self._spinapi_instructions(self.playlist_instructions(sequences=sequences,repetitions=repetitions,wait_for_trigger=wait_for_trigger,
+                                                                     wrapped=wrapped,allow_subroutine=allow_subroutine,wait_duration_ns=wait_duration_ns))
+
+    def generate_compiled(self,sequence_ir:SequenceIr)->list:
+        """Converts instructions that are already compiled like the points of a SequenceTemplate, see SpbiclPulseBlaster.compiled_instructions
+
+        Returns:
+            list[tuple]: (flags, opcode, data, duration_ns) for every instruction which is the arguments of pb_inst_pbonly
+        """
+        return self._spinapi_instructions(self.compiled_instructions(sequence_ir))
+
+    def _spinapi_instructions(self,program_instructions:list)->list:
+        """Converts the instructions of the board into the arguments of pb_inst_pbonly, see program_instructions"""
+        # The output words are the same bits as the program text
+        flags = [int(address_line,2) for address_line in self.masks_to_lines([instruction[2] for instruction in program_instructions])]
+
+        label_indexes = {}
+        for ind, (label, _, _, _) in enumerate(program_instructions):
+            if label != None:
+                label_indexes.setdefault(label,ind)
+
+        instructions = []
+        for (_, duration, _, flow_control), instruction_flags in zip(program_instructions,flags):
+            if flow_control == None or flow_control[0] == "wait":
+                opcode = "continue" if flow_control == None else "wait"
+                instructions.append((instruction_flags,SPINAPI_OPCODES[opcode],0,duration))
+            elif flow_control[0] in ("loop","long_delay"):
+                instructions.append((instruction_flags,SPINAPI_OPCODES[flow_control[0]],flow_control[1],duration))
+            else:
+                instructions.append((instruction_flags,SPINAPI_OPCODES[flow_control[0]],label_indexes[flow_control[1]],duration))
+        return instructions
+
+    def static_sequence(self,device_mask:int)->list:
+        """The static output program for a device mask which is two instructions with the same output that branch back to the start
+
+        Args:
+            device_mask (int): the devices that are high, see static_output_mask
+
+        Returns:
+            list[tuple]: the instructions that can be loaded into the pulse blaster
+        """
+        flags = int(self.masks_to_lines([device_mask])[0],2)
+        return [(flags,SPINAPI_OPCODES["continue"],0,500e6),(flags,SPINAPI_OPCODES["branch"],0,500e6)]
+
+    def load(self,sequence:list)->int:
+        """Programs a list of instructions into the pulse blaster
+
+        Args:
+            sequence (list[tuple]): (flags, opcode, data, duration_ns) for every instruction, see generate_sequence. If the same 
+            program is already on the pulse blaster it is not loaded again
+
+        Returns:
+            int: This is zero that indicates correct loading
+        """
+        if not self._connected:
+            self.make_connection()
+
+        sequence = [(int(flags),int(opcode),int(data),float(duration_ns)) for flags, opcode, data, duration_ns in sequence]
+        fingerprint = hashlib.sha256(repr((self.clock_frequency_megahertz,sequence)).encode()).hexdigest()
+        if fingerprint == self._loaded_fingerprint:
+            return 0
+
+        # If programming fails it is not known what is on the board
+        self._loaded_fingerprint = None
+        self._check(self.spinapi.pb_start_programming(PULSE_PROGRAM),"Failed to load program to pulse blaster")
+        for flags, opcode, data, duration_ns in sequence:
+            self._check(self.spinapi.pb_inst_pbonly(flags,opcode,data,duration_ns),"Failed to load program to pulse blaster")
+        self._check(self.spinapi.pb_stop_programming(),"Failed to load program to pulse blaster")
+        self._loaded_fingerprint = fingerprint
+        return 0
+
+    def start(self)->int:
+        """
+        starts the loaded sequence
+
+        Returns:
+            int: This is zero that indicates correct starting
+        """
+        if not self._connected:
+            self.make_connection()
+
+        # The board has to be reset so the program starts from the first instruction
+        self._check(self.spinapi.pb_reset(),"Failed to start program to pulse blaster")
+        self._check(self.spinapi.pb_start(),"Failed to start program to pulse blaster")
+
+        # Prevents updating devices until stopped
+        self._locked_commands = True
+        return 0
+
+    def stop(self)->int:
+        """
+        stops pulseblaster sets all values to zero
+
+        Returns:
+            int: This is zero that indicates correct stopping
+        """
+        if not self._connected:
+            self.make_connection()
+
+        self._check(self.spinapi.pb_stop(),"Failed to stop program to pulse blaster")
+
+        # Unlocks commands for other items
+        self._locked_commands = False
+        return 0
+
+    def clear(self)->int:
+        """
+        To clear we load a single instruction with every output off that branches to itself
+
+        Returns:
+            int: This is zero that indicates correct loading
+        """
+        if not self._locked_commands:
+            # Clearing always reaches the board even if the empty sequence is thought to be loaded
+            self.invalidate_loaded_program()
+            return self.load(sequence=[(0,SPINAPI_OPCODES["branch"],0,500e6)])
+        else:
+            raise Warning("To clear sequence you must stop the sequence")
@@ -0,0 +1,47 @@
+"""Times Sequence.instructions with loop compression for growing sequences. The time per instruction should stay roughly
+constant as the number of instructions grows if the repeat finder is close to linear
+
+    python benchmarks/loop_compression_benchmark.py
+"""
+import time
+
+from NV_ABJ.experimental_logic.sequence_generation.sequence_generation import Sequence, SequenceDevice
+
+def xy8_sequence(number_of_instructions:int)->Sequence:
+    """Repeated blocks of pi pulses with a readout every 64 pulses so there are both loops and plain instructions"""
+    laser = SequenceDevice(address=0,device_label="Laser")
+    readout = SequenceDevice(address=1,device_label="Readout")
+    rf_x = SequenceDevice(address=2,device_label="RF X")
+    rf_y = SequenceDevice(address=3,device_label="RF Y")
+
+    seq = Sequence()
+    added = 0
+    while added < number_of_instructions:
+        seq.add_step(2000,[laser])
+        seq.add_step(1000+added,[])
+        for pulse in [rf_x,rf_y,rf_x,rf_y,rf_y,rf_x,rf_y,rf_x]*8:
+            seq.add_step(50,[pulse])
+            seq.add_step(200,[])
+        seq.add_step(300,[laser,readout])
+        added = added + 3 + 128
+    return seq
+
+def no_repeat_sequence(number_of_instructions:int)->Sequence:
+    """A device that is on every other step with different off times, nothing can be looped but the token repeats often"""
+    laser = SequenceDevice(address=0,device_label="Laser")
+
+    seq = Sequence()
+    for ind in range(number_of_instructions//2):
+        seq.add_step(100,[laser])
+        seq.add_step(100+ind,[])
+    return seq
+
+if __name__ == "__main__":
+    print(f"{'sequence':>12} {'instructions':>12} {'compressed':>10} {'time (s)':>10} {'us/instruction':>15}")
+    for name, generator in [("xy8",xy8_sequence),("no repeats",no_repeat_sequence)]:
+        for number_of_instructions in [500,1000,2000,4000,8000,16000,32000]:
+            seq = generator(number_of_instructions)
+            start = time.perf_counter()
+            instructions, sub_routines = seq.instructions()
+            elapsed = time.perf_counter()-start
+            print(f"{name:>12} {len(seq.steps):>12} {len(instructions):>10} {elapsed:>10.4f} {elapsed/len(seq.steps)*1e6:>15.2f}")
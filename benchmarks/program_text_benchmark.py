@@ -0,0 +1,71 @@
+"""Times writing the program text of the pulse blaster for programs with up to 50k instructions. The compile is cached before
+the timing so only the text is measured. The lines are joined into a string, streamed straight into a file and, for comparison,
+added to a string one at a time like the writer used to do
+
+    python benchmarks/program_text_benchmark.py
+    python benchmarks/program_text_benchmark.py --instructions 10000 50000 100000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from NV_ABJ.experimental_logic.sequence_generation.sequence_generation import Sequence, SequenceDevice
+from NV_ABJ.hardware_interfaces.pulse_generators.spbicl_pulse_blaster.spbicl_pulse_blaster import SpbiclPulseBlaster
+
+INSTRUCTION_COUNTS = [5000,10000,20000,50000]
+
+def unlooped_sequence(number_of_instructions:int)->Sequence:
+    """Every step has a different duration and alternates between the devices so none of the instructions can be looped or merged"""
+    laser = SequenceDevice(address=0,device_label="Laser")
+    rf = SequenceDevice(address=2,device_label="RF")
+
+    seq = Sequence()
+    for ind in range(number_of_instructions):
+        seq.add_step(20+2*ind,[laser] if ind % 2 == 0 else [rf])
+    return seq
+
+def concatenated_text(pulse_blaster:SpbiclPulseBlaster,seq:Sequence)->str:
+    """The text built one line at a time which copies the whole string for every line"""
+    sequence_text = ""
+    for line in pulse_blaster.generate_sequence_lines(seq):
+        sequence_text = sequence_text + line
+        # A second reference stops the interpreter from resizing the string in place
+        previous_text = sequence_text
+    return sequence_text
+
+def streamed_file(pulse_blaster:SpbiclPulseBlaster,seq:Sequence,file_path:str):
+    """The lines written to a program file without building the text"""
+    with open(file_path,"w") as file:
+        file.writelines(pulse_blaster.generate_sequence_lines(seq))
+
+def measure(function)->float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter()-start
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--instructions",type=int,nargs="+",default=INSTRUCTION_COUNTS,help="Number of instructions of each program")
+    arguments = parser.parse_args()
+
+    pulse_blaster = SpbiclPulseBlaster()
+
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        file_path = os.path.join(temporary_directory,"program.pb")
+
+        print(f"{'instructions':>12} {'joined (s)':>12} {'streamed (s)':>13} {'concatenated (s)':>17} {'us/instruction':>15}")
+        for number_of_instructions in arguments.instructions:
+            seq = unlooped_sequence(number_of_instructions)
+            # Fills the compile cache so the timing is only the text
+            text = pulse_blaster.generate_sequence(seq)
+
+            joined = measure(lambda: pulse_blaster.generate_sequence(seq))
+            streamed = measure(lambda: streamed_file(pulse_blaster,seq,file_path))
+            concatenated = measure(lambda: concatenated_text(pulse_blaster,seq))
+
+            with open(file_path) as file:
+                if file.read() != text:
+                    raise RuntimeError("The streamed program is different from the joined program")
+
+            print(f"{number_of_instructions:>12} {joined:>12.4f} {streamed:>13.4f} {concatenated:>17.4f} {joined/number_of_instructions*1e6:>15.2f}")
@@ -0,0 +1,142 @@
+"""Times every stage of compiling a sequence for the pulse blaster on synthetic sequences from 10 to 100k steps. Each stage is run
+once for the wall time and once more under tracemalloc for the peak memory so the tracing does not slow down the timing, the 
+compiled sequence cache is cleared before every run. The scaling exponent of each stage is fit over the larger sizes, a stage 
+that is linear has an exponent close to 1
+
+    python benchmarks/sequence_compilation_benchmark.py
+    python benchmarks/sequence_compilation_benchmark.py --maximum-steps 10000 --maximum-exponent 1.5
+
+With --maximum-exponent the script exits with an error when any stage scales worse than the given exponent. With --check-timing every
+generated program is run on the pulse blaster simulator and compared with the linear time sequence so the whole compile path is
+checked without a board
+"""
+import argparse
+import itertools
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from NV_ABJ.experimental_logic.sequence_generation.sequence_generation import Sequence, SequenceSubset, SequenceDevice
+from NV_ABJ.experimental_logic.sequence_generation.sequence_cache import compiled_sequence_cache
+from NV_ABJ.hardware_interfaces.pulse_generators.spbicl_pulse_blaster.spbicl_pulse_blaster import SpbiclPulseBlaster
+from NV_ABJ.hardware_interfaces.pulse_generators.spbicl_pulse_blaster.pulse_blaster_simulator import simulate_program, sequence_timeline
+
+STEP_COUNTS = [10,100,1000,10000,100000]
+
+def synthetic_sequence(number_of_steps:int,delayed:bool,inverted:bool,subsets:bool)->Sequence:
+    """Signal and reference blocks like a rabi with a different tau for every block so only the subsets can be looped
+
+    Args:
+        number_of_steps (int): Roughly how many steps the sequence has when every subset is written out
+        delayed (bool): The laser and rf have delays to on
+        inverted (bool): A shutter with an inverted output is open during the readouts
+        subsets (bool): Each rabi block has a looped SequenceSubset of pi pulses
+    """
+    laser = SequenceDevice(address=0,delayed_to_on_ns=500 if delayed else 0,device_label="Laser")
+    readout = SequenceDevice(address=1,device_label="Readout")
+    rf = SequenceDevice(address=2,delayed_to_on_ns=30 if delayed else 0,device_label="RF")
+    shutter = SequenceDevice(address=3,inverted_output=inverted,device_label="Shutter")
+
+    seq = Sequence()
+    steps = 0
+    block = 0
+    while steps < number_of_steps:
+        seq.add_step(2000,[laser])
+        seq.add_step(1000,[])
+        seq.add_step(20+2*(block % 500),[rf])
+        seq.add_step(1000,[])
+        seq.add_step(300,[laser,readout,shutter])
+        steps = steps + 5
+
+        if subsets and steps < number_of_steps:
+            pulses = SequenceSubset(loop_steps=9)
+            pulses.add_step(50,[rf])
+            pulses.add_step(200,[])
+            seq.add_sub_sequence(pulses)
+            steps = steps + 20
+
+        seq.add_step(1000,[])
+        seq.add_step(300,[laser,readout])
+        steps = steps + 2
+        block = block + 1
+    return seq
+
+def stages(seq:Sequence,pulse_blaster:SpbiclPulseBlaster,wrapped:bool,numpy_engine:bool)->dict:
+    """The stages of the compile path in the order they run before a measurement"""
+    # The instructions of the board are found once here so the text stage only times writing the program text
+    program_instructions = pulse_blaster.program_instructions(seq,wrapped=wrapped)
+
+    def text_generation():
+        "".join(pulse_blaster._program_lines(program_instructions))
+
+    return {
+        "linear_time_sequence": lambda: seq.linear_time_sequence(wrapped=wrapped,numpy_engine=numpy_engine),
+        "instructions": lambda: seq.instructions(wrapped=wrapped,numpy_engine=numpy_engine,use_cache=False),
+        "compile": lambda: seq.compile(wrapped=wrapped,
+                                       maximum_loop_depth=pulse_blaster.maximum_loop_depth,
+                                       maximum_loop_repetitions=pulse_blaster.maximum_loop_repetitions,
+                                       clock_period_ns=1e3/pulse_blaster.clock_frequency_megahertz,
+                                       numpy_engine=numpy_engine,
+                                       minimum_duration_ns=pulse_blaster.minimum_duration_ns(),
+                                       maximum_edge_shift_ns=pulse_blaster.maximum_edge_shift_ns),
+        "text_generation": text_generation,
+    }
+
+def measure(stage)->tuple:
+    """Wall time in seconds and peak memory in MB of a stage. The compiled sequence cache is cleared before both runs so neither
+    run is a cache hit of the other or of an earlier stage"""
+    compiled_sequence_cache.clear()
+    start = time.perf_counter()
+    stage()
+    elapsed = time.perf_counter()-start
+
+    compiled_sequence_cache.clear()
+    tracemalloc.start()
+    stage()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak/1e6
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--maximum-steps",type=int,default=STEP_COUNTS[-1],help="Largest number of steps to run")
+    parser.add_argument("--numpy-engine",action="store_true",help="Uses the array backed linear time engine")
+    parser.add_argument("--maximum-exponent",type=float,default=None,help="Fails when a stage scales worse than this exponent")
+    parser.add_argument("--check-timing",action="store_true",help="Simulates every program and compares it with the linear time sequence")
+    arguments = parser.parse_args()
+
+    step_counts = [count for count in STEP_COUNTS if count <= arguments.maximum_steps]
+    pulse_blaster = SpbiclPulseBlaster()
+    failures = []
+
+    print(f"{'delayed':>8} {'inverted':>8} {'subsets':>8} {'wrapped':>8} {'steps':>8} {'stage':>22} {'time (s)':>10} {'us/step':>10} {'peak (MB)':>10}")
+    for delayed, inverted, subsets, wrapped in itertools.product([False,True],repeat=4):
+        times = {}
+        for number_of_steps in step_counts:
+            seq = synthetic_sequence(number_of_steps,delayed=delayed,inverted=inverted,subsets=subsets)
+
+            for name, stage in stages(seq,pulse_blaster,wrapped=wrapped,numpy_engine=arguments.numpy_engine).items():
+                elapsed, peak = measure(stage)
+                times.setdefault(name,[]).append(elapsed)
+                print(f"{delayed!s:>8} {inverted!s:>8} {subsets!s:>8} {wrapped!s:>8} {number_of_steps:>8} {name:>22} {elapsed:>10.4f} {elapsed/number_of_steps*1e6:>10.2f} {peak:>10.2f}")
+
+            if arguments.check_timing:
+                # Rounding to the clock can move every edge by up to the total rounding error, no edge is moved for short instructions
+                simulated = simulate_program(pulse_blaster.generate_sequence(seq,wrapped=wrapped))
+                if not simulated.matches(sequence_timeline(seq,wrapped=wrapped),tolerance_ns=abs(pulse_blaster.rounding_error_ns)+1e-6):
+                    failures.append(f"delayed={delayed} inverted={inverted} subsets={subsets} wrapped={wrapped} steps={number_of_steps}: simulated timing differs")
+
+        # Small sequences are dominated by fixed costs so the exponent is fit over the larger sizes
+        fitted_counts = [count for count in step_counts if count >= 1000]
+        if len(fitted_counts) >= 2:
+            for name, stage_times in times.items():
+                exponent = np.polyfit(np.log(fitted_counts),np.log(stage_times[-len(fitted_counts):]),1)[0]
+                print(f"{'':>44}{name:>22} scaling exponent {exponent:.2f}")
+                if arguments.maximum_exponent != None and exponent > arguments.maximum_exponent:
+                    failures.append(f"delayed={delayed} inverted={inverted} subsets={subsets} wrapped={wrapped} {name}: {exponent:.2f}")
+
+    if failures:
+        print("Failed checks:\n\t"+"\n\t".join(failures))
+        sys.exit(1)
@@ -0,0 +1,116 @@
+import random
+
+import pytest
+
+from NV_ABJ.experimental_logic.sequence_generation.sequence_generation import DelayConflict, Sequence, SequenceDevice, SequenceRepeat, SequenceSubset
+
+def test_delayed_turn_on_before_the_last_turn_off_is_a_conflict():
+    laser = SequenceDevice(address=0)
+    microwave = SequenceDevice(address=2,delayed_to_on_ns=30)
+    seq = Sequence()
+    seq.add_step(100,[microwave])
+    seq.add_step(20,[])
+    seq.add_step(50,[microwave])
+    seq.add_step(500,[laser])
+
+    # The microwave has to be turned on 30 ns before step 2 which is 10 ns before it was turned off
+    assert seq.delay_conflicts() == [DelayConflict(device=microwave.config,step_index=2,on_time_ns=90,previous_off_time_ns=100)]
+
+def test_wrapped_delay_conflicts_with_the_end_of_the_sequence():
+    microwave = SequenceDevice(address=2,delayed_to_on_ns=30)
+    seq = Sequence()
+    seq.add_step(20,[microwave])
+    seq.add_step(100,[])
+    seq.add_step(20,[microwave])
+    seq.add_step(10,[])
+
+    # The turn on of the first step is wrapped to 30 ns before the end while the microwave is still on
+    assert seq.delay_conflicts() == [DelayConflict(device=microwave.config,step_index=0,on_time_ns=120,previous_off_time_ns=140)]
+    assert seq.delay_conflicts(wrapped=False) == []
+    seq.validate_delays(wrapped=False)
+
+def test_conflicts_of_every_device_are_ordered_by_the_step():
+    laser = SequenceDevice(address=0,delayed_to_on_ns=150)
+    microwave = SequenceDevice(address=2,delayed_to_on_ns=30)
+    seq = Sequence()
+    seq.add_step(100,[laser,microwave])
+    seq.add_step(20,[])
+    seq.add_step(100,[microwave])
+    seq.add_step(20,[])
+    seq.add_step(100,[laser])
+    seq.add_step(1000,[])
+
+    assert [(conflict.step_index, conflict.device.address) for conflict in seq.delay_conflicts()] == [(2,2),(4,0)]
+
+def test_conflicts_in_a_repeat_have_the_times_of_the_written_out_sequence():
+    laser = SequenceDevice(address=0)
+    microwave = SequenceDevice(address=2,delayed_to_on_ns=30)
+    pulses = SequenceSubset(loop_steps=10)
+    pulses.add_step(40,[microwave])
+    pulses.add_step(20,[])
+
+    seq = Sequence()
+    seq.add_step(100,[laser])
+    seq.add_sub_sequence(pulses)
+    seq.add_step(300,[laser])
+
+    written_out = Sequence()
+    written_out.add_step(100,[laser])
+    for _ in range(11):
+        written_out.add_step(40,[microwave])
+        written_out.add_step(20,[])
+    written_out.add_step(300,[laser])
+
+    # Only the repetitions near the start and the end of the repeat are reported and they are the same as when it is written out
+    conflicts = seq.delay_conflicts()
+    assert [conflict.step_index for conflict in conflicts] == [3,5,19,21]
+    expected = {conflict.step_index:conflict for conflict in written_out.delay_conflicts()}
+    assert conflicts == [expected[conflict.step_index] for conflict in conflicts]
+
+@pytest.mark.parametrize("seed",range(10))
+def test_conflicts_of_random_repeats_are_in_the_written_out_sequence(seed):
+    generator = random.Random(seed)
+    devices = [SequenceDevice(address=address,delayed_to_on_ns=generator.choice([0,20,50])) for address in range(3)]
+    for _ in range(20):
+        seq = Sequence()
+        for _ in range(generator.randint(1,5)):
+            if generator.random() < 0.4:
+                subset = SequenceSubset(loop_steps=generator.randint(1,12))
+                for _ in range(generator.randint(1,3)):
+                    subset.add_step(generator.choice([10,20,50]),generator.sample(devices,generator.randint(0,2)))
+                seq.add_sub_sequence(subset)
+            else:
+                seq.add_step(generator.choice([10,20,50,100]),generator.sample(devices,generator.randint(0,2)))
+
+        written_out = Sequence()
+        for step in seq.steps:
+            for duration_ns, configurations in (step.steps*step.repetitions if type(step) == SequenceRepeat else [step]):
+                written_out.add_step(duration_ns,[device for device in devices if device.config in configurations])
+
+        for wrapped in (True,False):
+            expected = written_out.delay_conflicts(wrapped=wrapped)
+            conflicts = seq.delay_conflicts(wrapped=wrapped)
+            assert set(conflicts) <= set(expected)
+            assert (conflicts == []) == (expected == [])
+
+def test_validate_delays_raises_with_every_conflict():
+    microwave = SequenceDevice(address=2,delayed_to_on_ns=30)
+    seq = Sequence()
+    seq.add_step(100,[microwave])
+    seq.add_step(20,[])
+    seq.add_step(50,[microwave])
+    seq.add_step(10,[])
+    seq.add_step(50,[microwave])
+    seq.add_step(200,[])
+
+    with pytest.raises(ValueError,match="Conflicts:2") as error:
+        seq.validate_delays()
+    assert "Index:2 On:90 ns Previously off:100 ns" in str(error.value)
+    assert "Index:4 On:150 ns Previously off:170 ns" in str(error.value)
+
+def test_sequence_without_conflicts_is_valid():
+    assert Sequence().delay_conflicts() == []
+    seq = Sequence()
+    seq.add_step(100,[SequenceDevice(address=2,delayed_to_on_ns=30)])
+    seq.add_step(200,[])
+    seq.validate_delays()
@@ -0,0 +1,66 @@
+import random
+
+import pytest
+
+from NV_ABJ.experimental_logic.sequence_generation.sequence_generation import Sequence, SequenceDevice, SequenceSubset
+
+def on_times(seq:Sequence,wrapped:bool=True,numpy_engine:bool=False)->tuple:
+    sequence_devices, step_times_ns = seq.linear_time_sequence(wrapped=wrapped,numpy_engine=numpy_engine)
+    return {address:sequence_device["on_times_ns"] for address, sequence_device in sequence_devices.items()}, list(step_times_ns)
+
+def random_sequence(generator:random.Random)->Sequence:
+    devices = [SequenceDevice(address=address,delayed_to_on_ns=generator.choice([0,0,10,30]),inverted_output=generator.random() < 0.2)
+               for address in range(4)]
+    seq = Sequence()
+    for _ in range(generator.randint(1,8)):
+        if generator.random() < 0.2:
+            subset = SequenceSubset(loop_steps=generator.randint(1,4))
+            for _ in range(generator.randint(1,3)):
+                subset.add_step(generator.choice([10,20,50]),generator.sample(devices,generator.randint(0,3)))
+            seq.add_sub_sequence(subset)
+        else:
+            seq.add_step(generator.choice([10,20,50,100]),generator.sample(devices,generator.randint(0,3)))
+    return seq
+
+def test_device_turned_on_with_a_delay_stays_on():
+    laser = SequenceDevice(address=0)
+    microwave = SequenceDevice(address=1,delayed_to_on_ns=10)
+    seq = Sequence()
+    seq.add_step(50,[])
+    seq.add_step(10,[laser])
+    seq.add_step(40,[laser,microwave])
+
+    # The microwave is turned on 10 ns early with the laser and is on for the whole last step
+    expected = ({0:{50,60},1:{50,60}},[0,50,60,100])
+    assert on_times(seq) == expected
+    assert on_times(seq,numpy_engine=True) == expected
+
+def test_delay_wrapped_from_the_start_keeps_the_device_on():
+    first = SequenceDevice(address=1,delayed_to_on_ns=10)
+    second = SequenceDevice(address=2,delayed_to_on_ns=10)
+    seq = Sequence()
+    seq.add_step(10,[first])
+    seq.add_step(100,[first,second])
+
+    expected = ({1:{0,10},2:{0,10}},[0,10,110])
+    assert on_times(seq) == expected
+    assert on_times(seq,numpy_engine=True) == expected
+
+@pytest.mark.parametrize("seed",range(20))
+def test_engines_give_the_same_timeline(seed):
+    generator = random.Random(seed)
+    checked = 0
+    while checked < 20:
+        seq = random_sequence(generator)
+        wrapped = generator.random() < 0.6
+        try:
+            expected = on_times(seq,wrapped=wrapped,numpy_engine=True)
+        except ValueError:
+            # Both engines raise on the same delay conflicts
+            with pytest.raises(ValueError):
+                on_times(seq,wrapped=wrapped)
+            continue
+
+        assert on_times(seq,wrapped=wrapped) == expected
+        assert seq.instruction_tree(wrapped=wrapped,use_cache=False) == seq.instruction_tree(wrapped=wrapped,numpy_engine=True,use_cache=False)
+        checked = checked + 1
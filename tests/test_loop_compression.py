@@ -0,0 +1,97 @@
+import random
+
+import numpy as np
+import pytest
+
+from NV_ABJ.experimental_logic.sequence_generation.loop_compression import intern_tokens, find_repeated_blocks, build_loop_tree
+
+def expand(tree:list)->list:
+    """The tokens of a loop tree with every loop written out"""
+    tokens = []
+    for node in tree:
+        if type(node) == tuple:
+            tokens.extend(expand(node[1])*node[0])
+        else:
+            tokens.append(node)
+    return tokens
+
+def depth(tree:list)->int:
+    return max([depth(node[1])+1 for node in tree if type(node) == tuple],default=0)
+
+def test_intern_tokens_gives_equal_items_the_same_token():
+    tokens, unique_items = intern_tokens([[10,1],[20,0],[10,1],[30,1]],key=lambda line: (line[0],line[1]))
+
+    assert tokens.tolist() == [0,1,0,2]
+    assert unique_items == [[10,1],[20,0],[30,1]]
+
+def test_find_repeated_blocks_covers_the_tokens_in_order():
+    tokens, _ = intern_tokens(list("abababcxyxyxyxyc"))
+
+    assert find_repeated_blocks(tokens) == [(0,2,3),(6,1,1),(7,2,4),(15,1,1)]
+
+def test_find_repeated_blocks_keeps_the_minimum_block_length():
+    tokens = np.array([0,0,0,1,2,1,2])
+
+    assert find_repeated_blocks(tokens) == [(0,1,1),(1,1,1),(2,1,1),(3,2,2)]
+    assert find_repeated_blocks(tokens,minimum_block_length=1)[0] == (0,1,3)
+
+@pytest.mark.parametrize("seed",range(5))
+def test_repeated_blocks_of_random_tokens_expand_to_the_tokens(seed):
+    generator = random.Random(seed)
+    tokens = []
+    for _ in range(50):
+        block = [generator.randrange(4) for _ in range(generator.randint(1,5))]
+        tokens.extend(block*generator.randint(1,4))
+
+    expanded = []
+    for start, length, repetitions in find_repeated_blocks(np.array(tokens)):
+        assert start == len(expanded)
+        expanded.extend(tokens[start:start+length]*repetitions)
+    assert expanded == tokens
+
+def test_find_repeated_blocks_only_bounds_blocks_on_allowed_tokens():
+    tokens = np.array([0,1,2]*4)
+    can_bound_block = tokens != 2
+
+    for start, length, repetitions in find_repeated_blocks(tokens,can_bound_block=can_bound_block):
+        if repetitions > 1:
+            assert can_bound_block[start] and can_bound_block[start+length-1]
+
+def test_find_repeated_blocks_can_maximize_saving():
+    # The shortest block is the first two tokens but the whole group of six is repeated more
+    tokens = np.array(([0,1]*2+[0,2])*5)
+
+    assert find_repeated_blocks(tokens)[0] == (0,2,2)
+    assert find_repeated_blocks(tokens,maximize_saving=True)[0] == (0,6,5)
+
+def test_build_loop_tree_nests_loops():
+    tokens = np.array(([0,1]*3+[2])*4)
+    tree = build_loop_tree(tokens)
+
+    assert expand(tree) == tokens.tolist()
+    assert depth(tree) == 2
+
+def test_build_loop_tree_keeps_the_maximum_depth_and_repetitions():
+    tokens = np.array(([0,1]*3+[2])*4)
+    assert depth(build_loop_tree(tokens,maximum_depth=1)) == 1
+
+    tree = build_loop_tree(np.array([0,1]*10),maximum_repetitions=4)
+    assert tree == [(4,[0,1]),(4,[0,1]),(2,[0,1])]
+
+@pytest.mark.parametrize("seed",range(5))
+def test_build_loop_tree_of_random_tokens_expands_to_the_tokens(seed):
+    generator = random.Random(seed)
+    tokens = []
+    for _ in range(50):
+        block = [generator.randrange(4) for _ in range(generator.randint(1,5))]
+        tokens.extend(block*generator.randint(1,4))
+
+    tree = build_loop_tree(np.array(tokens),maximum_depth=3,maximum_repetitions=3)
+    assert expand(tree) == tokens
+    assert depth(tree) <= 3
+
+    def loops(tree:list)->list:
+        return [loop for node in tree if type(node) == tuple for loop in [node]+loops(node[1])]
+    assert all(repetitions <= 3 for repetitions, _ in loops(tree))
+    # A pulse generator loop starts and ends on a plain instruction
+    assert all(type(body[0]) != tuple and type(body[-1]) != tuple for _, body in loops(tree))
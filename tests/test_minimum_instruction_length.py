@@ -0,0 +1,139 @@
+import random
+import warnings
+
+import pytest
+
+from NV_ABJ.experimental_logic.sequence_generation.sequence_generation import Sequence, SequenceDevice, SequenceSubset
+from NV_ABJ.experimental_logic.sequence_generation.sequence_ir import InstructionLoop, SequenceIr, enforce_minimum_length
+from NV_ABJ.hardware_interfaces.pulse_generators.spbicl_pulse_blaster.spbicl_pulse_blaster import SpbiclPulseBlaster
+from NV_ABJ.hardware_interfaces.pulse_generators.spbicl_pulse_blaster.pulse_blaster_simulator import parse_program, simulate_program, sequence_timeline
+
+def assert_timing_kept(pulse_blaster:SpbiclPulseBlaster,seq:Sequence,wrapped:bool=True):
+    """Every instruction is long enough and the simulated program has every edge of the sequence within the edge shift"""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        program = pulse_blaster.generate_sequence(seq,wrapped=wrapped)
+    assert all(instruction.duration_ns >= pulse_blaster.minimum_duration_ns() for instruction in parse_program(program))
+    assert pulse_blaster.edge_shift_ns <= pulse_blaster.maximum_edge_shift_ns
+    assert simulate_program(program).matches(sequence_timeline(seq,wrapped=wrapped),tolerance_ns=pulse_blaster.edge_shift_ns+1e-6)
+
+def test_short_pulse_borrows_time_from_its_neighbors():
+    laser = SequenceDevice(address=0)
+    seq = Sequence()
+    seq.add_step(100,[])
+    seq.add_step(4,[laser])
+    seq.add_step(100,[])
+
+    pulse_blaster = SpbiclPulseBlaster(maximum_edge_shift_ns=10)
+    assert_timing_kept(pulse_blaster,seq)
+    assert pulse_blaster.edge_shift_ns == 8
+
+def test_short_pulse_raises_by_default():
+    laser = SequenceDevice(address=0)
+    seq = Sequence()
+    seq.add_step(100,[])
+    seq.add_step(4,[laser])
+    seq.add_step(100,[])
+
+    with pytest.raises(ValueError):
+        SpbiclPulseBlaster().generate_sequence(seq)
+
+def test_moved_edges_give_a_warning():
+    laser = SequenceDevice(address=0)
+    seq = Sequence()
+    seq.add_step(100,[])
+    seq.add_step(4,[laser])
+    seq.add_step(100,[])
+
+    with pytest.warns(UserWarning,match="moving edges by up to 8 ns"):
+        SpbiclPulseBlaster(maximum_edge_shift_ns=10).generate_sequence(seq)
+
+    # A sequence that is already long enough does not warn
+    seq = Sequence()
+    seq.add_step(100,[])
+    seq.add_step(20,[laser])
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        SpbiclPulseBlaster(maximum_edge_shift_ns=10).generate_sequence(seq)
+
+def test_short_instructions_are_never_merged_away():
+    # There is not enough time for three instructions so the pulse of dev1 can not be kept
+    dev0 = SequenceDevice(address=0)
+    dev1 = SequenceDevice(address=1)
+    seq = Sequence()
+    seq.add_step(6,[dev1])
+    seq.add_step(4,[dev0])
+    seq.add_step(20,[])
+
+    with pytest.raises(ValueError):
+        SpbiclPulseBlaster().generate_sequence(seq)
+
+def test_gap_inside_a_looped_subset_is_kept():
+    dev1 = SequenceDevice(address=1)
+    seq = Sequence()
+    seq.add_step(1000,[])
+    pulses = SequenceSubset(loop_steps=4)
+    pulses.add_step(100,[dev1])
+    pulses.add_step(10,[])
+    pulses.add_step(30,[dev1])
+    pulses.add_step(200,[])
+    seq.add_sub_sequence(pulses)
+
+    pulse_blaster = SpbiclPulseBlaster(maximum_edge_shift_ns=10)
+    assert_timing_kept(pulse_blaster,seq)
+    # Every pass of the subset has two pulses of dev1
+    with pytest.warns(UserWarning):
+        rising_edges, falling_edges = simulate_program(pulse_blaster.generate_sequence(seq)).channel_edges[1]
+    assert len(rising_edges) == len(falling_edges) == len(sequence_timeline(seq).channel_edges[1][0])
+    assert len(rising_edges) > pulses.loop_steps
+
+def test_shift_larger_than_the_maximum_raises():
+    laser = SequenceDevice(address=0)
+    seq = Sequence()
+    seq.add_step(100,[])
+    seq.add_step(4,[laser])
+    seq.add_step(100,[])
+
+    with pytest.raises(ValueError):
+        SpbiclPulseBlaster(maximum_edge_shift_ns=2).generate_sequence(seq)
+
+def test_short_instruction_between_loops_uses_a_written_out_pass():
+    instructions = [InstructionLoop(repetitions=3,body=[[20,1],[20,0]]),[4,2],InstructionLoop(repetitions=3,body=[[20,1],[20,0]])]
+    fixed = enforce_minimum_length(SequenceIr(instructions=instructions),minimum_duration_ns=12,maximum_edge_shift_ns=10)
+
+    assert fixed.duration_ns() == SequenceIr(instructions=instructions).duration_ns()
+    assert fixed.edge_shift_ns == 8
+    assert [2] == [node[1] for node in fixed.instructions if type(node) != InstructionLoop and node[1] == 2]
+    # The instructions that were given are not changed
+    assert instructions[1] == [4,2]
+
+@pytest.mark.parametrize("seed",range(5))
+def test_random_sequences_keep_every_edge(seed):
+    generator = random.Random(seed)
+    checked = 0
+    while checked < 20:
+        devices = [SequenceDevice(address=address,delayed_to_on_ns=generator.choice([0,0,4,30]),inverted_output=generator.random() < 0.2)
+                   for address in generator.sample(range(21),4)]
+        seq = Sequence()
+        for _ in range(generator.randint(1,20)):
+            if generator.random() < 0.25:
+                subset = SequenceSubset(loop_steps=generator.randint(1,5))
+                for _ in range(generator.randint(1,4)):
+                    subset.add_step(generator.choice([8,20,50,100]),generator.sample(devices,generator.randint(0,3)))
+                seq.add_sub_sequence(subset)
+            else:
+                seq.add_step(generator.choice([6,10,20,100,1000]),generator.sample(devices,generator.randint(0,3)))
+
+        wrapped = generator.random() < 0.7
+        pulse_blaster = SpbiclPulseBlaster(maximum_loop_depth=generator.choice([0,1,8]),maximum_edge_shift_ns=10)
+        try:
+            sequence_timeline(seq,wrapped=wrapped)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                pulse_blaster.generate_sequence(seq,wrapped=wrapped)
+        except ValueError:
+            # Overlapping delays and instructions that can not be fixed within the maximum edge shift are errors
+            continue
+
+        assert_timing_kept(pulse_blaster,seq,wrapped=wrapped)
+        checked = checked + 1
@@ -0,0 +1,242 @@
+import enum
+import importlib
+import sys
+import types
+from unittest import mock
+
+import numpy as np
+import pytest
+
+from NV_ABJ.abstract_interfaces.photon_counter import ReadoutGateMap
+
+class FakeTask:
+    """Stand in for nidaqmx.Task. Committing reserves the counter and port of the device so a task that is committed while the
+    tasks of another configuration still hold them fails like it does on a daq. The counter goes up by a known number of
+    counts for every sample so the counts can be checked
+    """
+    # Number of tasks that can hold the counter and port at once, the sample clock task and the read task
+    maximum_reserved = 2
+    # Counter value at the first sample after a start, close to the top so the counter rolls over
+    initial_count = 2**32-50
+
+    def __init__(self):
+        FakeTask.created.append(self)
+        self.ci_channels = mock.MagicMock()
+        self.di_channels = mock.MagicMock()
+        self.triggers = mock.MagicMock()
+        self.timing = mock.MagicMock(samp_clk_max_rate=1e6)
+        self.in_stream = self
+        self.reserved = False
+        self.running = False
+        self.closed = False
+        self.callback = None
+        self.samples_per_event = None
+        self.samples_taken = 0
+
+    def control(self,mode):
+        assert not self.closed
+        if mode == FakeTaskMode.TASK_COMMIT and not self.reserved:
+            if sum(task.reserved for task in FakeTask.created) >= FakeTask.maximum_reserved:
+                raise RuntimeError("The counter is reserved by another task")
+            self.reserved = True
+        elif mode == FakeTaskMode.TASK_UNRESERVE:
+            self.reserved = False
+
+    def start(self):
+        assert not self.closed and not self.running
+        self.control(FakeTaskMode.TASK_COMMIT)
+        self.running = True
+        self.samples_taken = 0
+        # The driver calls back once for every chunk, here all of the chunks are already acquired when the task starts
+        if self.callback != None:
+            for _ in range(FakeTask.events_per_start):
+                self.callback(0,0,self.samples_per_event,None)
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        self.reserved = False
+        self.running = False
+        self.closed = True
+
+    def wait_until_done(self,timeout=None):
+        pass
+
+    def register_every_n_samples_acquired_into_buffer_event(self,sample_interval,callback_method):
+        assert not self.running
+        self.samples_per_event = sample_interval
+        self.callback = callback_method
+
+class FakeTaskMode(enum.Enum):
+    TASK_COMMIT = 0
+    TASK_UNRESERVE = 1
+
+def counter_values(first_sample:int,number_of_samples:int)->np.ndarray:
+    """The counter has sample_index%7 counts between a sample and the next one"""
+    counts = np.cumsum(np.concatenate(([0],np.arange(first_sample+number_of_samples-1) % 7)))[first_sample:]
+    return ((FakeTask.initial_count+counts) % 2**32).astype(np.uint32)
+
+class FakeCounterReader:
+    def __init__(self,in_stream:FakeTask):
+        self.task = in_stream
+
+    def read_many_sample_uint32(self,data,number_of_samples_per_channel,timeout=10):
+        assert self.task.running and not self.task.closed
+        data[:number_of_samples_per_channel] = counter_values(self.task.samples_taken,number_of_samples_per_channel)
+        self.task.samples_taken = self.task.samples_taken + number_of_samples_per_channel
+        return number_of_samples_per_channel
+
+@pytest.fixture
+def photon_counter_module(monkeypatch):
+    """The photon counter module imported with a fake nidaqmx so it runs without the driver"""
+    nidaqmx = types.ModuleType("nidaqmx")
+    nidaqmx.Task = FakeTask
+    nidaqmx.constants = types.ModuleType("nidaqmx.constants")
+    for name in ("CountDirection","Edge","AcquisitionType","TriggerType"):
+        setattr(nidaqmx.constants,name,mock.MagicMock())
+    nidaqmx.constants.TaskMode = FakeTaskMode
+    nidaqmx.stream_readers = types.ModuleType("nidaqmx.stream_readers")
+    nidaqmx.stream_readers.CounterReader = FakeCounterReader
+    nidaqmx.system = types.ModuleType("nidaqmx.system")
+    nidaqmx.system.device = types.SimpleNamespace(Device=lambda device_name: types.SimpleNamespace(ci_max_timebase=100e6))
+
+    for name, module in {"nidaqmx":nidaqmx,"nidaqmx.constants":nidaqmx.constants,"nidaqmx.stream_readers":nidaqmx.stream_readers,
+                         "nidaqmx.system":nidaqmx.system}.items():
+        monkeypatch.setitem(sys.modules,name,module)
+    module_name = "NV_ABJ.hardware_interfaces.photon_counter.ni_daq_counters.ni_photon_counter_daq_controlled"
+    monkeypatch.delitem(sys.modules,module_name,raising=False)
+
+    monkeypatch.setattr(FakeTask,"created",[],raising=False)
+    monkeypatch.setattr(FakeTask,"events_per_start",0,raising=False)
+    return importlib.import_module(module_name)
+
+@pytest.fixture
+def photon_counter(photon_counter_module):
+    photon_counter = photon_counter_module.NiPhotonCounterDaqControlled(device_name="Dev1",counter_pfi="pfi0",trigger_pfi="pfi1",
+                                                                        maximum_cached_dwell_times=2)
+    photon_counter.make_connection()
+    yield photon_counter
+    photon_counter.close_connection()
+
+def test_counts_of_a_dwell_time(photon_counter):
+    # The last of the two samples is the counts of the dwell time
+    assert photon_counter.get_counts_raw(0.01) == int(counter_values(0,2)[-1])
+
+def test_pooled_dwell_times_are_not_configured_again(photon_counter):
+    for dwell_time_s in (0.01,0.02,0.01,0.02,0.01):
+        photon_counter.get_counts_raw(dwell_time_s)
+
+    # Two tasks for each dwell time and none of them were closed while they were used
+    assert len(FakeTask.created) == 4
+    assert not any(task.closed for task in FakeTask.created)
+
+def test_least_recently_used_dwell_time_is_closed(photon_counter):
+    for dwell_time_s in (0.01,0.02,0.03):
+        photon_counter.get_counts_raw(dwell_time_s)
+
+    assert list(photon_counter._task_pool) == [0.02,0.03]
+    assert [task.closed for task in FakeTask.created] == [True,True,False,False,False,False]
+
+def test_single_cached_dwell_time_never_closes_the_current_tasks(photon_counter_module):
+    photon_counter = photon_counter_module.NiPhotonCounterDaqControlled(device_name="Dev1",counter_pfi="pfi0",trigger_pfi="pfi1",
+                                                                        maximum_cached_dwell_times=1)
+    photon_counter.make_connection()
+    for dwell_time_s in (0.01,0.02,0.01):
+        assert photon_counter.get_counts_raw(dwell_time_s) == int(counter_values(0,2)[-1])
+    assert list(photon_counter._task_pool) == [0.01]
+
+    with pytest.raises(ValueError):
+        photon_counter_module.NiPhotonCounterDaqControlled(device_name="Dev1",counter_pfi="pfi0",trigger_pfi="pfi1",maximum_cached_dwell_times=0)
+
+def test_counts_of_a_line(photon_counter):
+    counts = photon_counter.get_counts_raw_line(30,0.001)
+
+    # One more sample than pixels is read and the counter rolls over during the line
+    samples = counter_values(0,31)
+    assert samples[-1] < samples[0]
+    assert counts.dtype == np.int64
+    assert counts.tolist() == [ind % 7 for ind in range(30)]
+    assert counts.tolist() == (samples[1:]-samples[:-1]).astype(np.int64).tolist()
+
+def test_same_line_reuses_its_tasks(photon_counter):
+    photon_counter.get_counts_raw_line(10,0.001)
+    photon_counter.get_counts_raw_line(10,0.001)
+    assert len(FakeTask.created) == 2 and not any(task.closed for task in FakeTask.created)
+
+    # A different line is configured again and the tasks of the last line are closed
+    photon_counter.get_counts_raw_line(20,0.001)
+    assert [task.closed for task in FakeTask.created] == [True,True,False,False]
+
+def test_line_between_pooled_dwell_times(photon_counter):
+    photon_counter.get_counts_raw(0.01)
+    assert photon_counter.get_counts_raw_line(10,0.001).tolist() == np.diff(counter_values(0,11)).astype(np.int64).tolist()
+    assert photon_counter.get_counts_raw(0.01) == int(counter_values(0,2)[-1])
+
+    # The pooled tasks are only unreserved for the line so they are used again after it
+    assert len(FakeTask.created) == 4
+    assert [task.closed for task in FakeTask.created] == [False,False,True,True]
+
+def test_line_dwell_time_shorter_than_a_sample_raises(photon_counter):
+    with pytest.raises(ValueError):
+        photon_counter.get_counts_raw_line(10,1e-7)
+
+def test_triggered_counts_after_pooled_dwell_times(photon_counter):
+    photon_counter.get_counts_raw(0.01)
+    counts = photon_counter.get_counts_raw_when_triggered(5)
+
+    samples = counter_values(0,10)
+    assert counts.tolist() == (samples[1::2]-samples[::2]).astype(np.int64).tolist()
+
+@pytest.mark.parametrize("continuous_line,double_samples",[(False,True),(True,False),(True,True),(False,False)])
+def test_streamed_chunks_are_the_triggered_counts(photon_counter,continuous_line,double_samples):
+    number_of_data_taking_cycles = 50
+    FakeTask.events_per_start = 3
+    chunks = photon_counter.get_counts_raw_when_triggered_stream(number_of_data_taking_cycles,cycles_per_chunk=16,continuous_line=continuous_line,
+                                                                 double_samples=double_samples)
+
+    # Nothing is started until the first chunk is asked for
+    assert photon_counter.ext_trig_read_task.callback == None and not photon_counter.ext_trig_read_task.running
+    streamed = [counts.copy() for counts in chunks]
+
+    samples = counter_values(0,number_of_data_taking_cycles*(2 if double_samples else 1))
+    expected = samples.astype(np.int64) if continuous_line else (samples[1::2]-samples[::2]).astype(np.int64)
+    assert np.concatenate(streamed).tolist() == expected.tolist()
+    assert photon_counter.ext_trig_read_task.callback == None and not photon_counter.ext_trig_read_task.running
+
+def test_streamed_chunks_to_a_consumer(photon_counter):
+    FakeTask.events_per_start = 4
+    streamed = []
+    photon_counter.get_counts_raw_when_triggered_stream(40,cycles_per_chunk=10,consumer=lambda counts: streamed.append(counts.copy()))
+
+    samples = counter_values(0,80)
+    assert np.concatenate(streamed).tolist() == (samples[1::2]-samples[::2]).tolist()
+    assert not photon_counter.ext_trig_read_task.running
+
+def test_streamed_chunks_are_split_into_gates(photon_counter):
+    FakeTask.events_per_start = 2
+    gate_map = ReadoutGateMap(edges_per_repetition=3,gates={"signal":(0,1),"reference":(1,2)})
+    streamed = list(photon_counter.get_counts_raw_when_triggered_stream(20,cycles_per_chunk=8,gate_map=gate_map))
+
+    assert [counts.shape for counts in streamed] == [(8,2),(8,2),(4,2)]
+    assert np.concatenate(streamed).tolist() == gate_map.demultiplex(counter_values(0,60)).tolist()
+
+def test_closing_the_stream_stops_the_task(photon_counter):
+    FakeTask.events_per_start = 5
+    chunks = photon_counter.get_counts_raw_when_triggered_stream(50,cycles_per_chunk=10)
+    next(chunks)
+    assert photon_counter.ext_trig_read_task.running
+
+    chunks.close()
+    assert photon_counter.ext_trig_read_task.callback == None and not photon_counter.ext_trig_read_task.running
+
+def test_stream_raises_when_the_buffered_chunks_are_full(photon_counter):
+    FakeTask.events_per_start = 5
+    with pytest.raises(BufferError):
+        list(photon_counter.get_counts_raw_when_triggered_stream(50,cycles_per_chunk=10,number_of_buffered_chunks=2))
+    assert not photon_counter.ext_trig_read_task.running
+
+@pytest.mark.parametrize("number_of_data_taking_cycles,cycles_per_chunk",[(30,5),(31,10)])
+def test_unpaired_samples_raise(photon_counter,number_of_data_taking_cycles,cycles_per_chunk):
+    with pytest.raises(ValueError):
+        photon_counter.get_counts_raw_when_triggered_stream(number_of_data_taking_cycles,cycles_per_chunk=cycles_per_chunk,double_samples=False)
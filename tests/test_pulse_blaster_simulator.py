@@ -0,0 +1,58 @@
+import pytest
+
+from NV_ABJ.experimental_logic.sequence_generation.sequence_generation import Sequence, SequenceDevice, SequenceSubset
+from NV_ABJ.hardware_interfaces.pulse_generators.spbicl_pulse_blaster.pulse_blaster_simulator import (parse_program, program_period_ns,
+                                                                                                      iterate_program, simulate_program,
+                                                                                                      sequence_timeline)
+from NV_ABJ.hardware_interfaces.pulse_generators.spbicl_pulse_blaster.spbicl_pulse_blaster import SpbiclPulseBlaster
+
+PROGRAM = """Start: 0b1110 0000 0000 0000 0000 0001, 100 ns
+Loop1: 0b1110 0000 0000 0000 0000 0010, 20 ns, loop, 3
+       0b1110 0000 0000 0000 0000 0000, 30 ns, end_loop, Loop1
+       0b1110 0000 0000 0000 0000 0000, 1 us, long_delay, 2
+       0b1110 0000 0000 0000 0000 0000, 50 ns, branch, Start
+"""
+
+def test_parse_program_removes_the_fixed_bits():
+    instructions = parse_program(PROGRAM)
+
+    assert [instruction.output_mask for instruction in instructions] == [1,2,0,0,0]
+    assert [instruction.opcode for instruction in instructions] == ["continue","loop","end_loop","long_delay","branch"]
+    assert instructions[1].label == "Loop1" and instructions[1].data == 3
+    assert instructions[3].duration_ns == 1000
+
+    with pytest.raises(ValueError):
+        parse_program("0b1110, 10 ns, jump, Start")
+
+def test_period_is_found_without_running_the_loops():
+    assert program_period_ns(PROGRAM) == 100+3*50+2*1000+50
+    assert sum(duration_ns for _, duration_ns, _ in iterate_program(PROGRAM)) == program_period_ns(PROGRAM)
+
+def test_simulated_edges():
+    simulated = simulate_program(PROGRAM)
+
+    # The output is low at the end of the period so the first port rises at the start
+    assert simulated.channel_edges[0][0].tolist() == [0] and simulated.channel_edges[0][1].tolist() == [100]
+    assert simulated.channel_edges[1][0].tolist() == [100,150,200]
+    assert simulated.channel_edges[1][1].tolist() == [120,170,220]
+
+def test_loop_that_is_not_ended_raises():
+    with pytest.raises(ValueError):
+        simulate_program("Start: 0b1110 0000 0000 0000 0000 0001, 100 ns\nLoop1: 0b1110 0000 0000 0000 0000 0000, 20 ns, loop, 3\n")
+
+@pytest.mark.parametrize("wrapped",[True,False])
+@pytest.mark.parametrize("allow_subroutine",[True,False])
+def test_generated_program_runs_the_sequence(wrapped,allow_subroutine):
+    laser = SequenceDevice(address=0,delayed_to_on_ns=30)
+    microwave = SequenceDevice(address=3,inverted_output=True)
+    seq = Sequence()
+    seq.add_step(1000,[laser])
+    pulses = SequenceSubset(loop_steps=20)
+    pulses.add_step(40,[microwave])
+    pulses.add_step(100,[])
+    seq.add_sub_sequence(pulses)
+    seq.add_step(500,[laser,microwave])
+
+    pulse_blaster = SpbiclPulseBlaster()
+    program = pulse_blaster.generate_sequence(seq,wrapped=wrapped,allow_subroutine=allow_subroutine)
+    assert simulate_program(program).matches(sequence_timeline(seq,wrapped=wrapped),tolerance_ns=abs(pulse_blaster.rounding_error_ns)+1e-6)
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from NV_ABJ.abstract_interfaces.photon_counter import ReadoutGateMap
+
+def test_paired_gates_have_their_own_edges():
+    gate_map = ReadoutGateMap.paired(["signal","reference"])
+
+    assert gate_map.edges_per_repetition == 4
+    assert gate_map.gates == {"signal":(0,1),"reference":(2,3)}
+    assert gate_map.gate_names == ["signal","reference"]
+
+def test_demultiplex_splits_the_samples_into_gates():
+    gate_map = ReadoutGateMap(edges_per_repetition=3,gates={"first":(0,1),"both":(0,2)})
+    edge_counts = np.array([0,5,12,20,21,30],dtype=np.uint32)
+
+    gate_counts = gate_map.demultiplex(edge_counts)
+    assert gate_counts.dtype == np.int64
+    assert gate_counts.tolist() == [[5,12],[1,10]]
+    assert gate_map.channels(gate_counts)["both"].tolist() == [12,10]
+
+def test_demultiplex_is_right_when_the_counter_rolls_over():
+    gate_map = ReadoutGateMap.paired(["signal"])
+    edge_counts = np.array([2**32-3,4],dtype=np.uint32)
+
+    assert gate_map.demultiplex(edge_counts).tolist() == [[7]]
+
+def test_demultiplex_uses_the_current_gates():
+    gate_map = ReadoutGateMap.paired(["signal","reference"])
+    gate_map.gates["signal"] = (1,3)
+
+    assert gate_map.demultiplex(np.array([0,1,4,9],dtype=np.uint32)).tolist() == [[8,5]]
+
+def test_samples_that_are_not_whole_repetitions_raise():
+    with pytest.raises(ValueError):
+        ReadoutGateMap.paired(["signal"]).demultiplex(np.arange(3,dtype=np.uint32))
+
+@pytest.mark.parametrize("edges_per_repetition,gates",[(0,{}),(2,{"signal":(1,0)}),(2,{"signal":(0,2)}),(2,{"signal":(-1,1)})])
+def test_gates_outside_of_the_repetition_raise(edges_per_repetition,gates):
+    with pytest.raises(ValueError):
+        ReadoutGateMap(edges_per_repetition=edges_per_repetition,gates=gates)
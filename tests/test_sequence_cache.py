@@ -0,0 +1,101 @@
+import pytest
+
+from NV_ABJ.experimental_logic.sequence_generation.sequence_cache import CompiledSequenceCache, compiled_sequence_cache
+from NV_ABJ.experimental_logic.sequence_generation.sequence_generation import Sequence, SequenceDevice
+
+def test_repeated_key_is_only_compiled_once():
+    cache = CompiledSequenceCache()
+    compiles = []
+
+    first = cache.get("key",lambda: compiles.append(1) or ["compiled"])
+    second = cache.get("key",lambda: compiles.append(1) or ["compiled"])
+
+    assert first == second
+    assert len(compiles) == 1
+    assert (cache.hits, cache.misses, len(cache)) == (1,1,1)
+
+def test_least_recently_used_key_is_removed():
+    cache = CompiledSequenceCache(maximum_size=2)
+    cache.get("a",lambda: "a")
+    cache.get("b",lambda: "b")
+    cache.get("a",lambda: "a")
+    cache.get("c",lambda: "c")
+
+    # b was used least recently so it is compiled again
+    compiles = []
+    cache.get("b",lambda: compiles.append("b") or "b")
+    cache.get("c",lambda: compiles.append("c") or "c")
+    assert compiles == ["b"]
+    assert len(cache) == 2
+
+def test_changed_result_does_not_change_the_cache():
+    cache = CompiledSequenceCache()
+    first = cache.get("key",lambda: [[100,1],[200,0]])
+    first[0][0] = 0
+    first.append([50,1])
+
+    second = cache.get("key",lambda: None)
+    assert second == [[100,1],[200,0]]
+    assert second is not first and second[0] is not first[0]
+
+def test_cache_of_size_zero_does_not_keep_anything():
+    cache = CompiledSequenceCache(maximum_size=0)
+    cache.get("a",lambda: "a")
+    cache.get("a",lambda: "a")
+
+    assert (cache.hits, cache.misses, len(cache)) == (0,2,0)
+    with pytest.raises(ValueError):
+        CompiledSequenceCache(maximum_size=-1)
+
+def test_clear_resets_the_counters():
+    cache = CompiledSequenceCache()
+    cache.get("a",lambda: "a")
+    cache.get("a",lambda: "a")
+    cache.clear()
+
+    assert (cache.hits, cache.misses, len(cache)) == (0,0,0)
+
+def test_sequence_instructions_use_the_shared_cache():
+    compiled_sequence_cache.clear()
+    laser = SequenceDevice(address=0)
+    seq = Sequence()
+    seq.add_step(100,[laser])
+    seq.add_step(200,[])
+
+    first = seq.instructions()
+    assert seq.instructions() == first
+    assert compiled_sequence_cache.hits == 1
+    seq.instructions(wrapped=False)
+    assert compiled_sequence_cache.misses == 2
+
+    # A changed sequence is compiled again
+    seq.add_step(50,[laser])
+    assert seq.instructions() != first
+    assert seq.instructions(use_cache=False) == seq.instructions()
+
+def test_sequence_compile_uses_the_shared_cache():
+    compiled_sequence_cache.clear()
+    laser = SequenceDevice(address=0)
+    seq = Sequence()
+    seq.add_step(100,[laser])
+    seq.add_step(200,[])
+
+    first = seq.compile(clock_period_ns=2)
+    assert seq.compile(clock_period_ns=2) == first
+    assert compiled_sequence_cache.hits == 1
+    seq.compile(clock_period_ns=4)
+    assert compiled_sequence_cache.misses == 2
+    assert seq.compile(clock_period_ns=2,use_cache=False) == first
+
+def test_changed_compile_does_not_change_the_next_one():
+    compiled_sequence_cache.clear()
+    laser = SequenceDevice(address=0)
+    seq = Sequence()
+    seq.add_step(100,[laser])
+    seq.add_step(200,[])
+
+    first = seq.compile()
+    first.instructions[0][0] = 0
+    first.instructions.append([50,1])
+    assert seq.compile() == seq.compile(use_cache=False)
+    assert seq.instruction_tree() is not seq.instruction_tree()
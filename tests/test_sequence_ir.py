@@ -0,0 +1,65 @@
+import copy
+
+import pytest
+
+from NV_ABJ.experimental_logic.sequence_generation.sequence_ir import (InstructionLoop, SequenceIr, drop_zero_length, merge_identical_states,
+                                                                       quantize_to_clock, optimize)
+
+def test_number_of_instructions_and_duration_count_loops():
+    sequence_ir = SequenceIr(instructions=[[10,1],InstructionLoop(repetitions=3,body=[[20,0],InstructionLoop(repetitions=2,body=[[5,1],[5,0]]),[20,2]])])
+
+    assert sequence_ir.number_of_instructions() == 5
+    assert sequence_ir.duration_ns() == 10+3*(20+2*10+20)
+
+def test_drop_zero_length_rebuilds_loops():
+    sequence_ir = SequenceIr(instructions=[[0,1],[10,2],InstructionLoop(repetitions=4,body=[[5,1],[0,2]])])
+
+    # A loop left with a single instruction becomes one longer instruction
+    assert drop_zero_length(sequence_ir).instructions == [[10,2],[20,1]]
+
+def test_merge_identical_states_does_not_merge_across_loops():
+    loop = InstructionLoop(repetitions=2,body=[[5,1],[5,2],[5,2]])
+    sequence_ir = SequenceIr(instructions=[[10,1],[10,1],loop,[10,2]])
+
+    assert merge_identical_states(sequence_ir).instructions == [[20,1],InstructionLoop(repetitions=2,body=[[5,1],[10,2]]),[10,2]]
+
+def test_quantize_to_clock_adds_up_the_rounding_error():
+    sequence_ir = SequenceIr(instructions=[[3,1],InstructionLoop(repetitions=10,body=[[5,0],[0.4,1]])])
+    quantized = quantize_to_clock(sequence_ir,clock_period_ns=2)
+
+    # A duration is never rounded down to zero
+    assert quantized.instructions == [[4,1],InstructionLoop(repetitions=10,body=[[4,0],[2,1]])]
+    assert quantized.rounding_error_ns == pytest.approx(quantized.duration_ns()-sequence_ir.duration_ns())
+
+    with pytest.raises(ValueError):
+        quantize_to_clock(sequence_ir,clock_period_ns=0)
+
+def test_optimize_runs_every_pass():
+    sequence_ir = SequenceIr(instructions=[[0,2],[5,1],[5,1],[31,0],[5,2],[100,0]])
+    optimized = optimize(sequence_ir,clock_period_ns=2)
+
+    assert optimized.instructions == [[10,1],[32,0],[4,2],[100,0]]
+    assert optimized.rounding_error_ns == optimized.duration_ns()-sequence_ir.duration_ns()
+
+def test_optimize_enforces_the_minimum_duration():
+    sequence_ir = SequenceIr(instructions=[[0,2],[5,1],[5,1],[30,0],[5,2],[100,0]])
+    optimized = optimize(sequence_ir,clock_period_ns=2,minimum_duration_ns=12,maximum_edge_shift_ns=12)
+
+    assert all(node[0] >= 12 and node[0] % 2 == 0 for node in optimized.instructions)
+    assert [node[1] for node in optimized.instructions] == [1,0,2,0]
+    assert optimized.duration_ns() == sequence_ir.duration_ns()+optimized.rounding_error_ns
+    assert 0 < optimized.edge_shift_ns <= 12
+
+    # Without an edge shift allowed a short instruction raises instead of changing the pulse lengths
+    with pytest.raises(ValueError):
+        optimize(sequence_ir,clock_period_ns=2,minimum_duration_ns=12)
+
+@pytest.mark.parametrize("sequence_pass",[drop_zero_length,merge_identical_states,lambda sequence_ir: quantize_to_clock(sequence_ir,2),
+                                          lambda sequence_ir: optimize(sequence_ir,clock_period_ns=2),
+                                          lambda sequence_ir: optimize(sequence_ir,clock_period_ns=2,minimum_duration_ns=12,maximum_edge_shift_ns=12)])
+def test_passes_do_not_modify_their_input(sequence_pass):
+    instructions = [[7,1],[7,1],[0,2],InstructionLoop(repetitions=3,body=[[20,1],[4,2],[20,0]]),[50,0]]
+    original = copy.deepcopy(instructions)
+
+    sequence_pass(SequenceIr(instructions=instructions))
+    assert instructions == original
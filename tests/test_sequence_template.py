@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from NV_ABJ.experimental_logic.sequence_generation.sequence_generation import Sequence, SequenceDevice, SequenceIr
+from NV_ABJ.experimental_logic.sequence_generation.sequence_template import SequenceTemplate
+from NV_ABJ.experimental_logic.sequence_generation.sequences.single_laser_sequences.rabi_iq_sequence import RabiIq
+from NV_ABJ.hardware_interfaces.pulse_generators.spbicl_pulse_blaster.spbicl_pulse_blaster import SpbiclPulseBlaster
+from NV_ABJ.hardware_interfaces.pulse_generators.spinapi_pulse_blaster.spinapi_pulse_blaster import SimulatedSpinapi, SpinapiPulseBlaster
+
+RABI_PARAMETERS = {"depopulation_time_s":1e-6,"iq_time_s":20e-9,"wait_time_s":200e-9,"readout_trigger_duration_s":20e-9,
+                   "readout_time_s":300e-9,"green_pulse_duration_s":2e-6,
+                   "rf_iq_trigger":SequenceDevice(address=3,delayed_to_on_ns=10),"rf_trigger":SequenceDevice(address=2,delayed_to_on_ns=30),
+                   "laser_trigger":SequenceDevice(address=0,delayed_to_on_ns=100),"readout_trigger":SequenceDevice(address=1)}
+
+def crossing_sequence(gap_ns:float)->Sequence:
+    """The delayed microwave turns on while the laser is still on when the gap is shorter than its delay"""
+    laser = SequenceDevice(address=0)
+    microwave = SequenceDevice(address=2,delayed_to_on_ns=100)
+    seq = Sequence()
+    seq.add_step(1000,[laser])
+    seq.add_step(gap_ns,[])
+    seq.add_step(50,[microwave])
+    seq.add_step(500,[])
+    return seq
+
+def test_bound_points_are_the_full_compiles():
+    taus_s = np.arange(1,21)*20e-9
+    template = RabiIq().sequence_template(**RABI_PARAMETERS)
+    points = template.bind(tau_time_s=taus_s)
+
+    # Only the reference and the slope of tau are compiled
+    assert template.compiled_points == 2
+    pulse_blaster = SpbiclPulseBlaster()
+    for tau_s, point in zip(taus_s,points):
+        assert type(point) == SequenceIr
+        seq = RabiIq().generate_sequence(tau_time_s=tau_s.item(),**RABI_PARAMETERS)
+        assert pulse_blaster.generate_compiled(point) == pulse_blaster.generate_sequence(seq,allow_subroutine=False)
+
+def test_points_that_lose_an_instruction_are_compiled_fully():
+    taus_s = np.array([0,20e-9,40e-9,60e-9])
+    template = RabiIq().sequence_template(**RABI_PARAMETERS)
+    points = template.bind(tau_time_s=taus_s)
+
+    # A tau of zero has a duration of zero on the line so it is the only point that is compiled again
+    assert template.compiled_points == 3
+    pulse_blaster = SpbiclPulseBlaster()
+    for tau_s, point in zip(taus_s,points):
+        seq = RabiIq().generate_sequence(tau_time_s=tau_s.item(),**RABI_PARAMETERS)
+        assert pulse_blaster.generate_compiled(point) == pulse_blaster.generate_sequence(seq,allow_subroutine=False)
+
+def test_points_with_different_masks_are_compiled_fully():
+    gaps_ns = [20,60,120,200]
+    template = SequenceTemplate(crossing_sequence)
+    points = template.bind(gap_ns=gaps_ns)
+
+    # The slope point has different masks than the reference so every point is compiled
+    assert template.compiled_points == 2+len(gaps_ns)
+    for gap_ns, point in zip(gaps_ns,points):
+        assert point.instructions == crossing_sequence(gap_ns).instruction_tree(maximum_loop_depth=0)
+
+def test_fully_compiled_points_are_copies():
+    template = SequenceTemplate(crossing_sequence)
+    first, second = template.bind(gap_ns=[20,200])
+    assert template.compiled_points == 4
+    first.instructions[0][0] = 0
+
+    # The compiles of the sequences are cached but a changed point does not change the cache
+    assert template.bind(gap_ns=[20,200])[0].instructions == crossing_sequence(20).instruction_tree(maximum_loop_depth=0)
+    assert first.instructions is not second.instructions
+
+def test_spinapi_loads_a_bound_point():
+    pulse_blaster = SpinapiPulseBlaster(spinapi=SimulatedSpinapi())
+    point = RabiIq().sequence_template(**RABI_PARAMETERS).bind(tau_time_s=[40e-9,60e-9])[1]
+    pulse_blaster.load(pulse_blaster.generate_compiled(point))
+
+    seq = RabiIq().generate_sequence(tau_time_s=60e-9,**RABI_PARAMETERS)
+    assert pulse_blaster.spinapi.instructions == pulse_blaster.generate_sequence(seq,allow_subroutine=False)
+
+def test_swept_values_must_have_the_same_length():
+    with pytest.raises(ValueError):
+        SequenceTemplate(crossing_sequence).bind(gap_ns=[20,40],other=[1])
@@ -0,0 +1,162 @@
+import random
+
+import pytest
+
+from NV_ABJ.experimental_logic.sequence_generation.sequence_generation import Sequence, SequenceDevice, SequenceSubset
+from NV_ABJ.hardware_interfaces.pulse_generators.spbicl_pulse_blaster.pulse_blaster_simulator import (parse_program, iterate_program, simulate_program,
+                                                                                                      sequence_timeline)
+from NV_ABJ.hardware_interfaces.pulse_generators.spbicl_pulse_blaster.spbicl_pulse_blaster import SpbiclPulseBlaster
+
+def assert_runs_the_sequence(program:str,seq:Sequence):
+    """Every duration is written as a whole number of nanoseconds and the simulated program has exactly the edges of the sequence"""
+    assert "." not in program
+    assert simulate_program(program).matches(sequence_timeline(seq))
+
+@pytest.mark.parametrize("long_duration_ns",[60_000_000_000,60e9])
+def test_long_step_is_a_long_delay(long_duration_ns):
+    laser = SequenceDevice(address=0)
+    seq = Sequence()
+    seq.add_step(100,[laser])
+    seq.add_step(long_duration_ns,[])
+    seq.add_step(100,[laser])
+
+    program = SpbiclPulseBlaster().generate_sequence(seq)
+    assert "0b111000000000000000000000, 5000000000 ns, long_delay, 12\n" in program
+    assert_runs_the_sequence(program,seq)
+
+@pytest.mark.parametrize("last_duration_ns",[12_300_000_000,12.3e9])
+def test_long_last_step_ends_on_a_plain_instruction(last_duration_ns):
+    laser = SequenceDevice(address=0)
+    seq = Sequence()
+    seq.add_step(100,[laser])
+    seq.add_step(last_duration_ns,[])
+
+    program = SpbiclPulseBlaster().generate_sequence(seq)
+    # The branch back to the start can not be on a long_delay so the last maximum length step is written on its own
+    assert program.splitlines()[1:] == ["       0b111000000000000000000000, 2300000000 ns",
+                                        "       0b111000000000000000000000, 5000000000 ns",
+                                        "       0b111000000000000000000000, 5000000000 ns, branch, Start"]
+    assert_runs_the_sequence(program,seq)
+
+def test_short_remainder_of_a_long_step_is_split_with_a_maximum_step():
+    laser = SequenceDevice(address=0)
+    seq = Sequence()
+    seq.add_step(100,[laser])
+    seq.add_step(20_000_000_004,[])
+    seq.add_step(100,[laser])
+
+    pulse_blaster = SpbiclPulseBlaster()
+    program = pulse_blaster.generate_sequence(seq)
+    assert all(instruction.duration_ns >= pulse_blaster.minimum_duration_ns() for instruction in parse_program(program))
+    assert_runs_the_sequence(program,seq)
+
+def output_word(device_mask:int,available_ports:int=23)->str:
+    """Output word of a mask written one bit at a time, the three highest bits are always set"""
+    return "111"+"".join("1" if device_mask >> address & 1 else "0" for address in range(available_ports-3,-1,-1))
+
+@pytest.mark.parametrize("available_ports",[23,10])
+def test_masks_are_converted_to_output_words(available_ports):
+    generator = random.Random(available_ports)
+    device_masks = [generator.randrange(1 << (available_ports-2)) for _ in range(50)]
+    device_masks = device_masks+device_masks[:10]+[0,(1 << (available_ports-2))-1]
+
+    lines = SpbiclPulseBlaster(available_ports=available_ports).masks_to_lines(device_masks)
+    assert lines == [output_word(device_mask,available_ports) for device_mask in device_masks]
+
+def test_addresses_outside_of_the_ports_raise():
+    pulse_blaster = SpbiclPulseBlaster()
+    assert pulse_blaster.masks_to_lines([1 << 20]) == ["1111"+"0"*20]
+    with pytest.raises(ValueError,match=r"\[21, 23\]"):
+        pulse_blaster.masks_to_lines([1,(1 << 21) | (1 << 23) | 1])
+
+    seq = Sequence()
+    seq.add_step(100,[SequenceDevice(address=21)])
+    with pytest.raises(ValueError):
+        pulse_blaster.generate_sequence(seq)
+
+@pytest.mark.parametrize("allow_subroutine",[True,False])
+def test_program_lines_have_the_output_word_of_every_instruction(allow_subroutine):
+    seq = rabi_point(40)
+    seq.add_step(200,[SequenceDevice(address=20)])
+    pulse_blaster = SpbiclPulseBlaster()
+
+    instructions = pulse_blaster.program_instructions(seq,allow_subroutine=allow_subroutine)
+    lines = list(pulse_blaster.generate_sequence_lines(seq,allow_subroutine=allow_subroutine))
+    assert len(lines) == len(instructions)
+    for line, (_, _, device_mask, _) in zip(lines,instructions):
+        assert f"0b{output_word(device_mask)}, " in line
+    assert "".join(lines) == pulse_blaster.generate_sequence(seq,allow_subroutine=allow_subroutine)
+
+def rabi_point(tau_ns:int,loop_last:bool=False)->Sequence:
+    laser = SequenceDevice(address=0)
+    microwave = SequenceDevice(address=2)
+    shutter = SequenceDevice(address=3,inverted_output=True)
+    seq = Sequence()
+    seq.add_step(1000,[laser])
+    seq.add_step(200,[])
+    seq.add_step(tau_ns,[microwave])
+    pulses = SequenceSubset(loop_steps=4)
+    pulses.add_step(40,[microwave])
+    pulses.add_step(60,[])
+    if loop_last:
+        seq.add_step(300,[laser,shutter])
+        seq.add_sub_sequence(pulses)
+    else:
+        seq.add_sub_sequence(pulses)
+        seq.add_step(300,[laser,shutter])
+    return seq
+
+def output_changes(instructions)->list:
+    """(time ns, output mask) every time the output changes from (start time ns, duration ns, output mask) instructions"""
+    changes = []
+    for time_ns, _, output_mask in instructions:
+        if len(changes) == 0 or changes[-1][1] != output_mask:
+            changes.append((time_ns,output_mask))
+    return changes
+
+def playlist_instructions(points:list,repetitions:int=1,wait_duration_ns:int=None,idle_mask:int=0):
+    """The instructions a playlist should run, each point is run on its own repetitions times after waiting when a wait is given"""
+    time_ns = 0
+    for ind, point in enumerate(points):
+        if wait_duration_ns != None:
+            # The first point also has the plain instruction the program starts with before its wait
+            wait_ns = 2*wait_duration_ns if ind == 0 else wait_duration_ns
+            yield time_ns, wait_ns, idle_mask
+            time_ns = time_ns + wait_ns
+
+        for _ in range(repetitions):
+            for _, duration_ns, output_mask in iterate_program(SpbiclPulseBlaster().generate_sequence(point)):
+                yield time_ns, duration_ns, output_mask
+                time_ns = time_ns + duration_ns
+
+def test_playlist_waits_for_a_trigger_before_every_point():
+    points = [rabi_point(tau_ns) for tau_ns in (20,40,60)]
+    program = SpbiclPulseBlaster().generate_playlist(points,wait_for_trigger=True,wait_duration_ns=100)
+
+    instructions = parse_program(program)
+    # A wait can not be the first instruction so the program starts on a plain instruction
+    assert instructions[0].opcode == "continue"
+    assert [instruction.opcode for instruction in instructions].count("wait") == len(points)
+    # Every output is off while waiting which holds the inverted shutter high
+    assert all(instruction.output_mask == 1 << 3 for instruction in instructions if instruction.opcode == "wait")
+    assert output_changes(iterate_program(program)) == output_changes(playlist_instructions(points,wait_duration_ns=100,idle_mask=1 << 3))
+
+def test_playlist_loops_every_point():
+    points = [rabi_point(tau_ns) for tau_ns in (20,40,60)]
+    program = SpbiclPulseBlaster().generate_playlist(points,repetitions=5)
+
+    # The program can not branch back on the end of a loop so the last pass of the last point is written out after a loop of four
+    loop_counts = [instruction.data for instruction in parse_program(program) if instruction.opcode == "loop"]
+    assert loop_counts.count(5) == len(points)-1 and loop_counts.count(4) == 1
+    assert output_changes(iterate_program(program)) == output_changes(playlist_instructions(points,repetitions=5))
+
+@pytest.mark.parametrize("repetitions",[1,3])
+def test_point_that_ends_on_a_loop_is_peeled(repetitions):
+    points = [rabi_point(tau_ns,loop_last=True) for tau_ns in (20,40)]
+    program = SpbiclPulseBlaster().generate_playlist(points,repetitions=repetitions)
+
+    # The branch back to the start and the end of the repetitions loop are on plain instructions after the pulses
+    instructions = parse_program(program)
+    assert instructions[-1].opcode == "branch"
+    assert all(instructions[ind-1].opcode != "end_loop" for ind, instruction in enumerate(instructions) if instruction.opcode == "end_loop")
+    assert output_changes(iterate_program(program)) == output_changes(playlist_instructions(points,repetitions=repetitions))
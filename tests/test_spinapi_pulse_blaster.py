@@ -0,0 +1,149 @@
+import pytest
+
+from NV_ABJ.experimental_logic.sequence_generation.sequence_generation import Sequence, SequenceDevice, SequenceSubset
+from NV_ABJ.hardware_interfaces.pulse_generators.spbicl_pulse_blaster.pulse_blaster_simulator import (PulseBlasterInstruction, simulate_program,
+                                                                                                      sequence_timeline)
+from NV_ABJ.hardware_interfaces.pulse_generators.spbicl_pulse_blaster.spbicl_pulse_blaster import SpbiclPulseBlaster
+from NV_ABJ.hardware_interfaces.pulse_generators.spinapi_pulse_blaster.spinapi_pulse_blaster import SPINAPI_OPCODES, SimulatedSpinapi, SpinapiPulseBlaster
+
+OPCODE_NAMES = {opcode:name for name, opcode in SPINAPI_OPCODES.items()}
+
+class CountingSpinapi(SimulatedSpinapi):
+    """Simulated library that counts how many times a program is sent to it"""
+    def __init__(self):
+        super().__init__()
+        self.programs_loaded = 0
+
+    def pb_start_programming(self,device:int)->int:
+        self.programs_loaded = self.programs_loaded + 1
+        return super().pb_start_programming(device)
+
+def loaded_program(pulse_blaster:SpinapiPulseBlaster)->list:
+    """The instructions on the simulated board in the form of the simulator. The data of end_loop and branch is an index so
+    every instruction is labeled with its index
+    """
+    output_bits = (1 << (pulse_blaster.available_ports-2))-1
+    instructions = []
+    for ind, (flags, opcode, data, duration_ns) in enumerate(pulse_blaster.spinapi.instructions):
+        opcode = OPCODE_NAMES[opcode]
+        if opcode in ("end_loop","branch"):
+            data = str(data)
+        instructions.append(PulseBlasterInstruction(output_mask=flags & output_bits,duration_ns=duration_ns,opcode=opcode,
+                                                    data=data if opcode != "continue" else None,label=str(ind)))
+    return instructions
+
+def example_sequence()->Sequence:
+    laser = SequenceDevice(address=0,delayed_to_on_ns=30)
+    microwave = SequenceDevice(address=3,inverted_output=True)
+    counter = SequenceDevice(address=5)
+
+    seq = Sequence()
+    seq.add_step(1000,[laser])
+    pulses = SequenceSubset(loop_steps=50)
+    pulses.add_step(40,[microwave])
+    pulses.add_step(100,[])
+    pulses.add_step(20,[counter])
+    pulses.add_step(100,[])
+    seq.add_sub_sequence(pulses)
+    seq.add_step(500,[laser,counter])
+    return seq
+
+@pytest.mark.parametrize("wrapped",[True,False])
+def test_loaded_program_runs_the_sequence(wrapped):
+    seq = example_sequence()
+    pulse_blaster = SpinapiPulseBlaster(spinapi=SimulatedSpinapi())
+    pulse_blaster.load(pulse_blaster.generate_sequence(seq,wrapped=wrapped))
+
+    simulated = simulate_program(loaded_program(pulse_blaster))
+    assert simulated.matches(sequence_timeline(seq,wrapped=wrapped),tolerance_ns=abs(pulse_blaster.rounding_error_ns)+1e-6)
+    # Both backends compile the same way so the programs have exactly the same timing
+    assert simulated.matches(simulate_program(SpbiclPulseBlaster().generate_sequence(seq,wrapped=wrapped)))
+
+def test_instructions_match_the_program_text():
+    seq = example_sequence()
+    pulse_blaster = SpinapiPulseBlaster(spinapi=SimulatedSpinapi())
+    pulse_blaster.load(pulse_blaster.generate_sequence(seq))
+
+    # Every line of the text program is one instruction with the same output word and flow control
+    lines = [[part.strip() for part in line.split(":")[-1].split(",")] for line in SpbiclPulseBlaster().generate_sequence(seq).splitlines()]
+    instructions = pulse_blaster.spinapi.instructions
+    assert len(instructions) == len(lines)
+    assert any(OPCODE_NAMES[instruction[1]] == "loop" for instruction in instructions)
+    for (flags, opcode, data, duration_ns), line in zip(instructions,lines):
+        assert flags == int(line[0].replace(" ",""),2)
+        assert OPCODE_NAMES[opcode] == (line[2].lower() if len(line) > 2 else "continue")
+        if OPCODE_NAMES[opcode] == "loop":
+            assert data == int(line[3])
+
+    # The loops end on the instruction that starts them
+    for ind, (_, opcode, data, _) in enumerate(instructions):
+        if OPCODE_NAMES[opcode] == "end_loop":
+            assert OPCODE_NAMES[instructions[data][1]] == "loop" and data < ind
+
+def test_connection_sets_the_clock():
+    pulse_blaster = SpinapiPulseBlaster(spinapi=SimulatedSpinapi(),clock_frequency_megahertz=250)
+    pulse_blaster.make_connection()
+
+    assert pulse_blaster.spinapi.initialized
+    assert pulse_blaster.spinapi.clock_frequency_megahertz == 250
+
+    pulse_blaster.close_connection()
+    assert not pulse_blaster.spinapi.initialized
+
+def test_same_program_is_only_loaded_once():
+    spinapi = CountingSpinapi()
+    pulse_blaster = SpinapiPulseBlaster(spinapi=spinapi)
+    program = pulse_blaster.generate_sequence(example_sequence())
+
+    pulse_blaster.load(program)
+    pulse_blaster.load(program)
+    assert spinapi.programs_loaded == 1
+
+    # The board may have been programmed by something else
+    pulse_blaster.invalidate_loaded_program()
+    pulse_blaster.load(program)
+    assert spinapi.programs_loaded == 2
+
+    pulse_blaster.clear()
+    pulse_blaster.load(program)
+    assert spinapi.programs_loaded == 4
+
+    # A new connection does not know what is on the board
+    pulse_blaster.close_connection()
+    pulse_blaster.load(program)
+    assert spinapi.programs_loaded == 5
+
+def test_start_and_stop_lock_the_devices():
+    pulse_blaster = SpinapiPulseBlaster(spinapi=SimulatedSpinapi())
+    pulse_blaster.load(pulse_blaster.generate_sequence(example_sequence()))
+    pulse_blaster.start()
+
+    assert pulse_blaster.spinapi.running
+    with pytest.raises(Warning):
+        pulse_blaster.update_devices([SequenceDevice(address=0,device_status=True)])
+
+    pulse_blaster.stop()
+    assert not pulse_blaster.spinapi.running
+
+def test_update_devices_holds_the_outputs():
+    laser = SequenceDevice(address=0,device_status=True)
+    microwave = SequenceDevice(address=3,inverted_output=True)
+    counter = SequenceDevice(address=5,inverted_output=True,device_status=True)
+    # Controlled devices that are not given are turned off
+    pulse_blaster = SpinapiPulseBlaster(spinapi=SimulatedSpinapi(),controlled_devices=[SequenceDevice(address=7,inverted_output=True)])
+    pulse_blaster.update_devices([laser,microwave,counter])
+
+    output_mask = (1 << 0) | (1 << 3) | (1 << 7)
+    assert pulse_blaster.static_output_mask([laser,microwave,counter]) == output_mask
+    assert pulse_blaster.spinapi.running
+    assert [(flags, OPCODE_NAMES[opcode]) for flags, opcode, _, _ in pulse_blaster.spinapi.instructions] == \
+        [(int(pulse_blaster.masks_to_lines([output_mask])[0],2),"continue"),(int(pulse_blaster.masks_to_lines([output_mask])[0],2),"branch")]
+
+def test_errors_of_the_library_are_raised():
+    pulse_blaster = SpinapiPulseBlaster(spinapi=SimulatedSpinapi())
+
+    with pytest.raises(Exception,match="Unknown opcode"):
+        pulse_blaster.load([(0,99,0,100)])
+
+    # The failed program is not thought to be on the board
+    assert pulse_blaster._loaded_fingerprint == None
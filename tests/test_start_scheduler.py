@@ -0,0 +1,80 @@
+import time
+
+import pytest
+
+from NV_ABJ.abstract_interfaces.pulse_generator import StartScheduler
+
+def test_function_is_called_after_the_delay():
+    scheduler = StartScheduler()
+    scheduled_s = time.perf_counter()
+    handle = scheduler.schedule(lambda: "started",delayed_s=0.05)
+
+    assert handle.result(timeout_s=5) == "started"
+    assert handle.started_s-scheduled_s >= 0.05
+    assert handle.latency_s >= 0
+    assert scheduler.jitter_s()["count"] == 1
+
+def test_starts_are_called_in_the_order_of_their_deadlines():
+    scheduler = StartScheduler()
+    calls = []
+    late = scheduler.schedule(lambda: calls.append("late"),delayed_s=0.1)
+    early = scheduler.schedule(lambda: calls.append("early"),delayed_s=0.02)
+
+    assert late.wait(timeout_s=5) and early.wait(timeout_s=5)
+    assert calls == ["early","late"]
+
+def test_cancelled_start_is_never_called():
+    scheduler = StartScheduler()
+    calls = []
+    handle = scheduler.schedule(lambda: calls.append("started"),delayed_s=0.1)
+
+    assert handle.cancel()
+    assert handle.done() and handle.cancelled()
+    time.sleep(0.2)
+    assert calls == []
+    with pytest.raises(RuntimeError):
+        handle.result(timeout_s=1)
+
+def test_started_start_can_not_be_cancelled():
+    scheduler = StartScheduler()
+    handle = scheduler.schedule(lambda: "started",delayed_s=0)
+    handle.wait(timeout_s=5)
+
+    assert not handle.cancel()
+    assert handle.result() == "started"
+
+def test_exception_of_the_start_is_raised_by_result():
+    def failing_start():
+        raise ConnectionError("No board")
+
+    scheduler = StartScheduler()
+    handle = scheduler.schedule(failing_start,delayed_s=0)
+
+    with pytest.raises(ConnectionError):
+        handle.result(timeout_s=5)
+
+def test_negative_delay_raises():
+    with pytest.raises(ValueError):
+        StartScheduler().schedule(lambda: None,delayed_s=-1)
+
+def test_jitter_without_starts_is_empty():
+    assert StartScheduler().jitter_s() == {"mean":None,"standard_deviation":None,"maximum":None,"count":0}
+
+def test_cancel_wakes_the_scheduler():
+    scheduler = StartScheduler()
+    handle = scheduler.schedule(lambda: None,delayed_s=5)
+    time.sleep(0.05)
+    handle.cancel()
+
+    # The scheduler removes the cancelled start right away instead of when its deadline was close
+    stop_s = time.perf_counter()+1
+    while len(scheduler._scheduled) > 0 and time.perf_counter() < stop_s:
+        time.sleep(0.01)
+    assert scheduler._scheduled == []
+
+def test_start_without_spinning():
+    scheduler = StartScheduler(spin_s=0)
+    handle = scheduler.schedule(lambda: "started",delayed_s=0.02)
+
+    assert handle.result(timeout_s=5) == "started"
+    assert handle.latency_s >= 0